@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Benchmark how extraction time scales with the number of rows in a document.
+
+Generates synthetic documents with a fixed set of container fields followed by N repeating row
+elements, and times extract_table_from_file on each. Pass --module to time another copy of
+xml2csv.py (e.g. one checked out from an older commit) for a before/after comparison:
+
+    git show HEAD~1:xml2csv.py > /tmp/xml2csv_before.py
+    python3 benchmarks/bench_rows.py --module /tmp/xml2csv_before.py
+    python3 benchmarks/bench_rows.py
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import ModuleType
+from typing import Dict, List, Tuple
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Time row extraction for growing row counts")
+    parser.add_argument(
+        "--module",
+        dest="module",
+        default=str(REPO_ROOT / "xml2csv.py"),
+        help="Path to the xml2csv.py to benchmark (default: the one in this repository)",
+    )
+    parser.add_argument(
+        "--rows",
+        dest="rows",
+        default="1000,2000,4000,8000,16000",
+        help="Comma-separated row counts to benchmark (default: 1000,2000,4000,8000,16000)",
+    )
+    parser.add_argument(
+        "--container-fields",
+        dest="container_fields",
+        type=int,
+        default=40,
+        help="Number of scalar container fields before the rows (default: 40)",
+    )
+    parser.add_argument(
+        "--repeat",
+        dest="repeat",
+        type=int,
+        default=3,
+        help="Runs per row count; the fastest is reported (default: 3)",
+    )
+    return parser.parse_args()
+
+
+def load_module(path: Path) -> ModuleType:
+    spec = importlib.util.spec_from_file_location("xml2csv_under_test", path)
+    if spec is None or spec.loader is None:
+        raise ImportError(f"Cannot load {path}")
+    module = importlib.util.module_from_spec(spec)
+    # dataclasses looks the defining module up in sys.modules
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def write_document(path: Path, rows: int, container_fields: int) -> None:
+    with path.open("w", encoding="utf-8") as f:
+        f.write("<Feed>")
+        for i in range(container_fields):
+            f.write(f"<h{i}>header {i}</h{i}>")
+        for i in range(rows):
+            f.write(
+                f"<Record><id>{i}</id><name>name {i}</name><amount>{i * 1.5}</amount>"
+                f"<address><city>city {i % 97}</city><zip>{i % 10000:05d}</zip></address></Record>"
+            )
+        f.write("</Feed>")
+
+
+def time_extraction(module: ModuleType, path: Path, repeat: int) -> Tuple[float, int]:
+    best = float("inf")
+    row_count = 0
+    for _ in range(repeat):
+        header_order: List[str] = []
+        header_paths: Dict[str, Tuple[str, ...]] = {}
+        start = time.perf_counter()
+        # A list from older copies, a generator from newer ones
+        row_count = sum(1 for _ in module.extract_table_from_file(path, header_order, header_paths))
+        best = min(best, time.perf_counter() - start)
+    return best, row_count
+
+
+def main() -> None:
+    args = parse_args()
+    module = load_module(Path(args.module).expanduser().resolve())
+    counts = [int(c) for c in args.rows.split(",") if c.strip()]
+
+    print(f"module: {args.module}")
+    print(f"{'rows':>8} {'seconds':>10} {'us/row':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in counts:
+            path = Path(tmp) / f"rows_{count}.xml"
+            write_document(path, count, args.container_fields)
+            seconds, row_count = time_extraction(module, path, args.repeat)
+            print(f"{row_count:>8} {seconds:>10.3f} {seconds / row_count * 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
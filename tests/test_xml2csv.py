@@ -0,0 +1,918 @@
+"""
+End-to-end checks of the command line and the Python API: the execution strategies (--jobs,
+--split-size, --spill, --schema-in) must not change the output, --select-columns/--where must match
+selecting and filtering the full output afterwards, and each input, output and reporting option
+does what the README says.
+"""
+
+import bz2
+import csv
+import gzip
+import json
+import lzma
+import pstats
+import re
+import subprocess
+import sys
+import tarfile
+import tracemalloc
+import zipfile
+from pathlib import Path
+from typing import Dict, List
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+SCRIPT = ROOT / "xml2csv.py"
+sys.path.insert(0, str(ROOT))
+
+import xml2csv  # noqa: E402
+
+# Below the size of each fixture, so that --split-size cuts it into several chunks
+SPLIT_MIB = "0.002"
+
+
+def write_feed(path: Path, first_id: int, count: int, extra: bool = False) -> Path:
+    """
+    A feed with container fields before the rows, a leaf name that collides (Record/Id and
+    Addr/Id), nested repeating groups that expand, optional fields and, with extra, a column the
+    other feeds do not have.
+    """
+    records = []
+    for n in range(first_id, first_id + count):
+        lines = "".join(
+            f"<Line><Sku>s{n}-{k}</Sku><Qty>{(n + k) % 5}</Qty></Line>" for k in range(1 + n % 3)
+        )
+        tags = "".join(f"<Tag>t{k}</Tag>" for k in range(n % 4))
+        note = f"<Note>n{n}</Note>" if n % 4 == 0 else ""
+        region = f"<Region>r{n % 2}</Region>" if extra else ""
+        status = "ACTIVE" if n % 3 else "CLOSED"
+        records.append(
+            f"<Record><Id>{n}</Id><Status>{status}</Status><Addr><Id>A{n}</Id><City>c{n % 7}</City></Addr>"
+            f"{note}{region}<Lines>{lines}</Lines><Tags>{tags}</Tags></Record>"
+        )
+    path.write_text(
+        f"<?xml version=\"1.0\"?>\n<Root><Records><Batch>b{first_id}</Batch>\n"
+        + "\n".join(records)
+        + "\n</Records></Root>\n",
+        encoding="utf-8",
+    )
+    return path
+
+
+@pytest.fixture
+def feeds(tmp_path: Path) -> List[Path]:
+    return [
+        write_feed(tmp_path / "one.xml", 0, 40),
+        write_feed(tmp_path / "two.xml", 40, 30, extra=True),
+        write_feed(tmp_path / "three.xml", 70, 35),
+    ]
+
+
+def run(*args: object, cwd: Path) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, str(SCRIPT), *map(str, args)], cwd=cwd, capture_output=True, text=True, check=True
+    )
+
+
+def read_table(path: Path) -> List[Dict[str, str]]:
+    with path.open(newline="", encoding="utf-8") as f:
+        return list(csv.DictReader(f))
+
+
+def test_fixtures_are_split(feeds: List[Path]) -> None:
+    for feed in feeds:
+        chunks = xml2csv.plan_row_chunks(feed, int(float(SPLIT_MIB) * 1024 * 1024))
+        assert chunks is not None and len(chunks) > 1
+
+
+@pytest.mark.parametrize(
+    "variant",
+    [
+        ["--jobs", "2"],
+        ["--jobs", "2", "--split-size", SPLIT_MIB],
+        ["--spill"],
+        ["--jobs", "2", "--split-size", SPLIT_MIB, "--spill"],
+        ["--row-path", "/Root/Records/Record"],
+        ["--detect-bytes", "4096"],
+    ],
+)
+def test_per_file_output_matches_serial(tmp_path: Path, feeds: List[Path], variant: List[str]) -> None:
+    run(*feeds, "--output-dir", tmp_path / "serial", cwd=tmp_path)
+    run(*feeds, "--output-dir", tmp_path / "variant", *variant, cwd=tmp_path)
+    for feed in feeds:
+        name = feed.with_suffix(".csv").name
+        assert (tmp_path / "variant" / name).read_bytes() == (tmp_path / "serial" / name).read_bytes()
+
+
+@pytest.mark.parametrize(
+    "variant",
+    [
+        ["--jobs", "2"],
+        ["--jobs", "2", "--split-size", SPLIT_MIB],
+        ["--spill"],
+        ["--jobs", "2", "--split-size", SPLIT_MIB, "--spill"],
+    ],
+)
+def test_merged_output_matches_serial(tmp_path: Path, feeds: List[Path], variant: List[str]) -> None:
+    run(*feeds, "--merge-into", tmp_path / "serial.csv", cwd=tmp_path)
+    run(*feeds, "--merge-into", tmp_path / "variant.csv", *variant, cwd=tmp_path)
+    assert (tmp_path / "variant.csv").read_bytes() == (tmp_path / "serial.csv").read_bytes()
+
+
+@pytest.mark.parametrize("variant", [[], ["--jobs", "2"], ["--spill"]])
+def test_failed_input_adds_no_columns_to_the_merged_header(
+    tmp_path: Path, feeds: List[Path], variant: List[str]
+) -> None:
+    broken = tmp_path / "broken.xml"
+    # Fails after its first rows have registered a column no other input has
+    broken.write_text(
+        "<Root><Records><Record><Id>x</Id><Only>o</Only></Record><Record><Id>y</Id></Rec",
+        encoding="utf-8",
+    )
+    single_pass = ["--row-path", "/Root/Records/Record"]
+    result = run(broken, *feeds, "--merge-into", tmp_path / "merged.csv", *single_pass, *variant, cwd=tmp_path)
+    assert f"Failed to parse {broken}" in result.stdout
+    run(*feeds, "--merge-into", tmp_path / "good.csv", *single_pass, cwd=tmp_path)
+    assert (tmp_path / "merged.csv").read_bytes() == (tmp_path / "good.csv").read_bytes()
+
+
+@pytest.mark.parametrize("variant", [[], ["--jobs", "2"]])
+def test_schema_round_trip(tmp_path: Path, feeds: List[Path], variant: List[str]) -> None:
+    run(*feeds, "--merge-into", tmp_path / "full.csv", "--schema-out", tmp_path / "schema.json", cwd=tmp_path)
+    schema = ["--schema-in", tmp_path / "schema.json"]
+    run(*feeds, "--merge-into", tmp_path / "schema.csv", *schema, *variant, cwd=tmp_path)
+    assert (tmp_path / "schema.csv").read_bytes() == (tmp_path / "full.csv").read_bytes()
+
+
+@pytest.mark.parametrize("variant", [[], ["--jobs", "2"]])
+def test_per_file_schema_in_writes_the_schema_columns(tmp_path: Path, feeds: List[Path], variant: List[str]) -> None:
+    # The schema comes from the first two feeds; the third has a column it lacks
+    feeds[2].write_text(
+        feeds[2].read_text(encoding="utf-8").replace("<Tags>", "<Promo>p</Promo><Tags>"), encoding="utf-8"
+    )
+    run(*feeds[:2], "--merge-into", tmp_path / "two.csv", "--schema-out", tmp_path / "schema.json", cwd=tmp_path)
+    run(*feeds, "--output-dir", tmp_path / "plain", cwd=tmp_path)
+    schema = ["--schema-in", tmp_path / "schema.json"]
+    result = run(*feeds, "--output-dir", tmp_path / "out", *schema, *variant, cwd=tmp_path)
+    assert "three.xml has columns that are not in the schema: Promo" in result.stdout
+    columns = [col["name"] for col in json.loads((tmp_path / "schema.json").read_text(encoding="utf-8"))["columns"]]
+    for feed in feeds:
+        name = feed.with_suffix(".csv").name
+        with (tmp_path / "out" / name).open(newline="", encoding="utf-8") as f:
+            assert next(csv.reader(f)) == columns
+        expected = [{col: row.get(col, "") for col in columns} for row in read_table(tmp_path / "plain" / name)]
+        assert read_table(tmp_path / "out" / name) == expected
+
+
+def test_stdout_matches_merge(tmp_path: Path, feeds: List[Path]) -> None:
+    run(*feeds, "--merge-into", tmp_path / "merged.csv", cwd=tmp_path)
+    result = run(*feeds, "--stdout", cwd=tmp_path)
+    assert result.stdout.encode("utf-8") == (tmp_path / "merged.csv").read_bytes().replace(b"\r\n", b"\n")
+
+
+def test_colliding_leaf_names_are_disambiguated(tmp_path: Path, feeds: List[Path]) -> None:
+    run(*feeds, "--merge-into", tmp_path / "merged.csv", cwd=tmp_path)
+    with (tmp_path / "merged.csv").open(newline="", encoding="utf-8") as f:
+        header = next(csv.reader(f))
+    assert header[:4] == ["Batch", "Id", "Status", "Record.Addr.Id"]
+    assert "Region" in header and "Note" in header
+
+
+def test_disambiguate_column_name() -> None:
+    existing = {"Id": ("Record", "Id")}
+    assert xml2csv.disambiguate_column_name("Id", ("Record", "Id"), existing) == "Id"
+    assert xml2csv.disambiguate_column_name("Id", ("Record", "Addr", "Id"), existing) == "Record.Addr.Id"
+    existing["Record.Addr.Id"] = ("Other", "Id")
+    assert xml2csv.disambiguate_column_name("Id", ("Record", "Addr", "Id"), existing) == "Record.Addr.Id_2"
+
+
+def test_register_column_reuses_the_name_of_a_path() -> None:
+    header_order: List[str] = []
+    header_paths: Dict[str, xml2csv.PathKey] = {}
+    first = xml2csv.register_column(("Record", "Addr", "Id"), header_order, header_paths)
+    xml2csv.register_column(("Record", "Id"), header_order, header_paths)
+    # Seen again after a colliding path: still the same column, and the header does not grow
+    assert xml2csv.register_column(("Record", "Addr", "Id"), header_order, header_paths) == first
+    assert header_order == ["Id", "Record.Id"]
+
+
+def test_rows_are_yielded_before_the_document_has_been_read(tmp_path: Path) -> None:
+    feed = write_feed(tmp_path / "feed.xml", 0, 50)
+    broken = tmp_path / "broken.xml"
+    # Cut off in the middle of the last record: only a parser that has not read that far yields rows
+    broken.write_bytes(feed.read_bytes()[:-200])
+    header_order: List[str] = []
+    rows = xml2csv.extract_table_from_file(broken, header_order, {}, detect_bytes=4096)
+    assert next(rows)[:3] == ("b0", "0", "CLOSED")
+    assert header_order[:3] == ["Batch", "Id", "Status"]
+    with pytest.raises(xml2csv.ET.ParseError):
+        list(rows)
+
+
+def test_extraction_memory_does_not_grow_with_the_document(tmp_path: Path) -> None:
+    peaks = []
+    for count in (300, 3000):
+        feed = write_feed(tmp_path / f"feed{count}.xml", 0, count)
+        tracemalloc.start()
+        try:
+            for _ in xml2csv.extract_table_from_file(feed, [], {}, detect_bytes=4096):
+                pass
+            peaks.append(tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+    # Elements are cleared once their rows are out, so ten times the rows need no more memory
+    assert peaks[1] < peaks[0] * 1.5
+
+
+def test_container_columns_are_resolved_once_per_document(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    resolve = xml2csv.resolve_container_columns
+    calls = []
+
+    def counting_resolve(*args: object) -> List:
+        calls.append(args)
+        return resolve(*args)
+
+    monkeypatch.setattr(xml2csv, "resolve_container_columns", counting_resolve)
+    feed = write_feed(tmp_path / "feed.xml", 0, 40)
+    header_order: List[str] = []
+    rows = list(xml2csv.extract_table_from_file(feed, header_order, {}))
+    assert len(calls) == 1
+    assert header_order[0] == "Batch" and {row[0] for row in rows} == {"b0"}
+
+
+def test_row_benchmark_times_every_row_count() -> None:
+    bench = ROOT / "benchmarks" / "bench_rows.py"
+    args = ["--rows", "20,40", "--repeat", "1", "--container-fields", "3"]
+    result = subprocess.run([sys.executable, str(bench), *args], capture_output=True, text=True, check=True)
+    counts = [line.split()[0] for line in result.stdout.splitlines()[2:]]
+    assert counts == ["20", "40"]
+
+
+@pytest.mark.parametrize("variant", [[], ["--jobs", "2", "--split-size", SPLIT_MIB], ["--spill"]])
+def test_select_columns_matches_full_output(tmp_path: Path, feeds: List[Path], variant: List[str]) -> None:
+    columns = ["Sku", "Id", "Batch", "Region"]
+    run(*feeds, "--merge-into", tmp_path / "full.csv", cwd=tmp_path)
+    selection = ["--select-columns", ",".join(columns)]
+    run(*feeds, "--merge-into", tmp_path / "selected.csv", *selection, *variant, cwd=tmp_path)
+    expected = [{col: row[col] for col in columns} for row in read_table(tmp_path / "full.csv")]
+    assert read_table(tmp_path / "selected.csv") == expected
+
+
+@pytest.mark.parametrize("variant", [[], ["--spill"], ["--jobs", "2", "--split-size", SPLIT_MIB]])
+def test_input_without_any_selected_column_fails(tmp_path: Path, feeds: List[Path], variant: List[str]) -> None:
+    selection = ["--select-columns", "Region,Nope"]
+    stats = ["--stats-json", "stats.json"]
+    result = run(*feeds, "--output-dir", tmp_path / "out", *selection, *stats, *variant, cwd=tmp_path)
+    assert "Failed to convert" in result.stdout and "none of the selected columns are in one.xml" in result.stdout
+    assert "1 converted, 2 failed" in result.stdout
+    assert (tmp_path / "out" / "two.csv").read_text(encoding="utf-8").splitlines()[0] == "Region"
+    # No input is extracted a second time: at most the skeleton scan and the extraction are counted
+    report = json.loads((tmp_path / "stats.json").read_text(encoding="utf-8"))
+    sizes = {str(feed): feed.stat().st_size for feed in feeds}
+    assert all(entry["bytes_read"] <= 2 * sizes[entry["name"]] for entry in report["files"])
+
+
+def test_selection_outside_the_schema_is_rejected_up_front(tmp_path: Path, feeds: List[Path]) -> None:
+    run(*feeds, "--merge-into", tmp_path / "all.csv", "--schema-out", tmp_path / "schema.json", cwd=tmp_path)
+    result = subprocess.run(
+        [sys.executable, str(SCRIPT), *map(str, feeds), "--schema-in", "schema.json", "--select-columns", "Nope"],
+        cwd=tmp_path,
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode != 0
+    assert "none of the selected columns are in the schema" in result.stderr
+    assert not (tmp_path / "one.csv").exists()
+
+
+@pytest.mark.parametrize(
+    "conditions, keep",
+    [
+        (["Qty>2"], lambda row: row["Qty"] != "" and float(row["Qty"]) > 2),
+        (["Status=ACTIVE", "Tag is null"], lambda row: row["Status"] == "ACTIVE" and row["Tag"] == ""),
+        (["Batch!=b0", "Sku~-1$"], lambda row: row["Batch"] != "b0" and row["Sku"].endswith("-1")),
+        (["Note is not null"], lambda row: row["Note"] != ""),
+        (["Note="], lambda row: row["Note"] == ""),
+        (["Note!=", "Status!=CLOSED"], lambda row: row["Note"] != "" and row["Status"] != "CLOSED"),
+    ],
+)
+@pytest.mark.parametrize("variant", [[], ["--jobs", "2", "--split-size", SPLIT_MIB], ["--select-columns", "Id,Sku"]])
+def test_where_matches_filtered_full_output(
+    tmp_path: Path, feeds: List[Path], conditions: List[str], keep, variant: List[str]
+) -> None:
+    run(*feeds, "--merge-into", tmp_path / "full.csv", cwd=tmp_path)
+    where = [arg for condition in conditions for arg in ("--where", condition)]
+    run(*feeds, "--merge-into", tmp_path / "filtered.csv", *where, *variant, cwd=tmp_path)
+    expected = [row for row in read_table(tmp_path / "full.csv") if keep(row)]
+    assert expected
+    if "--select-columns" in variant:
+        expected = [{"Id": row["Id"], "Sku": row["Sku"]} for row in expected]
+    assert read_table(tmp_path / "filtered.csv") == expected
+
+
+@pytest.mark.parametrize("variant", [[], ["--select-columns", "F8,F0"]])
+def test_rows_past_the_shape_cap_are_extracted_like_the_rest(tmp_path: Path, variant: List[str]) -> None:
+    # Every row has its own subset of fields, so the row path sees more shapes than are cached for it
+    count = xml2csv.MAX_SHAPES_PER_PATH + 60
+    fields = range(count.bit_length())
+    feed = tmp_path / "shapes.xml"
+    feed.write_text(
+        "<r>"
+        + "".join(
+            "<o>" + "".join(f"<F{k}>{n}.{k}</F{k}>" for k in fields if n >> k & 1) + "</o>" for n in range(1, count + 1)
+        )
+        + "</r>",
+        encoding="utf-8",
+    )
+    run(feed, "--output-dir", tmp_path / "out", *variant, cwd=tmp_path)
+    columns = variant[1].split(",") if variant else [f"F{k}" for k in fields]
+    expected = [
+        {col: f"{n}.{col[1:]}" if n >> int(col[1:]) & 1 else "" for col in columns} for n in range(1, count + 1)
+    ]
+    assert read_table(tmp_path / "out" / "shapes.csv") == expected
+
+
+@pytest.mark.parametrize(
+    "variant", [[], ["--spill"], ["--select-columns", "Late,Id"], ["--jobs", "2", "--split-size", "0.0002"]]
+)
+def test_rows_built_before_later_columns_are_padded(tmp_path: Path, variant: List[str]) -> None:
+    # Rows are kept as tuples by header position, shorter than the header for the rows before Mid and Late
+    feed = tmp_path / "late.xml"
+    feed.write_text(
+        "<r><Head>h</Head>"
+        + "".join(
+            f"<o><Id>{n}</Id>"
+            + (f"<Mid>m{n}</Mid>" if n % 10 == 5 else "")
+            + (f"<Late>l{n}</Late>" if n >= 40 else "")
+            + "</o>"
+            for n in range(60)
+        )
+        + "</r>",
+        encoding="utf-8",
+    )
+    run(feed, feed, "--merge-into", tmp_path / "merged.csv", *variant, cwd=tmp_path)
+    expected = [
+        {"Head": "h", "Id": str(n), "Mid": f"m{n}" if n % 10 == 5 else "", "Late": f"l{n}" if n >= 40 else ""}
+        for n in range(60)
+    ] * 2
+    if "--select-columns" in variant:
+        expected = [{"Late": row["Late"], "Id": row["Id"]} for row in expected]
+    assert read_table(tmp_path / "merged.csv") == expected
+
+
+@pytest.mark.parametrize(
+    "option, value",
+    [
+        ("--jobs", "-1"),
+        ("--split-size", "0"),
+        ("--split-size", "-1"),
+        ("--detect-bytes", "0"),
+        ("--detect-bytes", "-1"),
+        ("--max-expansion", "0"),
+        ("--max-file-expansion", "-5"),
+    ],
+)
+def test_out_of_range_numbers_are_rejected(tmp_path: Path, feeds: List[Path], option: str, value: str) -> None:
+    result = subprocess.run(
+        [sys.executable, str(SCRIPT), str(feeds[0]), option, value], cwd=tmp_path, capture_output=True, text=True
+    )
+    assert result.returncode == 2
+    assert option in result.stderr
+    assert not (tmp_path / "one.csv").exists()
+
+
+@pytest.mark.parametrize("variant", [[], ["--jobs", "2", "--split-size", SPLIT_MIB]])
+def test_row_path_converts_like_detection(tmp_path: Path, feeds: List[Path], variant: List[str]) -> None:
+    run(*feeds, "--output-dir", tmp_path / "detected", cwd=tmp_path)
+    run(*feeds, "--output-dir", tmp_path / "named", "--row-path", "/Root/Records/Record", *variant, cwd=tmp_path)
+    for feed in feeds:
+        name = feed.with_suffix(".csv").name
+        assert (tmp_path / "named" / name).read_bytes() == (tmp_path / "detected" / name).read_bytes()
+
+
+def test_row_path_reads_the_input_once_without_a_skeleton(
+    tmp_path: Path, feeds: List[Path], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    def no_scan(*args: object, **kwargs: object) -> None:
+        raise AssertionError("the skeleton was scanned")
+
+    monkeypatch.setattr(xml2csv, "scan_document", no_scan)
+    monkeypatch.setattr(xml2csv, "detect_row_path", no_scan)
+    header_order: List[str] = []
+    row_paths: List[xml2csv.PathKey] = []
+    rows = list(
+        xml2csv.iter_table_rows(
+            feeds[0], header_order, {}, row_path=("Root", "Records", "Record"), on_row_path=row_paths.append
+        )
+    )
+    assert row_paths == [("Root", "Records", "Record")]
+    run(feeds[0], "--output-dir", tmp_path / "out", cwd=tmp_path)
+    assert len(rows) == len(read_table(tmp_path / "out" / "one.csv"))
+
+
+def test_unmatched_row_path_fails_the_input(tmp_path: Path, feeds: List[Path]) -> None:
+    result = run(feeds[0], "--output-dir", tmp_path / "out", "--row-path", "/Root/Records/Nope", cwd=tmp_path)
+    assert "Failed to convert" in result.stdout
+    assert "1 failed" in result.stdout
+    assert not (tmp_path / "out" / "one.csv").exists()
+
+
+def test_converter_rows_have_the_width_of_the_header_when_yielded(tmp_path: Path) -> None:
+    feed = tmp_path / "ragged.xml"
+    feed.write_text("<r><o><a>1</a></o><o/><o><a>2</a><b>3</b></o></r>", encoding="utf-8")
+    converter = xml2csv.Converter()
+    assert list(converter.iter_rows(feed)) == [("1",), ("",), ("2", "3")]
+    assert converter.columns == ("a", "b")
+
+
+def test_incremental_skips_unchanged_inputs(tmp_path: Path, feeds: List[Path]) -> None:
+    out = tmp_path / "out"
+    run(*feeds, "--output-dir", out, "--incremental", cwd=tmp_path)
+    result = run(*feeds, "--output-dir", out, "--incremental", cwd=tmp_path)
+    assert "0 converted, 0 failed, 0 skipped, 3 up to date" in result.stdout
+    write_feed(feeds[1], 40, 31, extra=True)
+    result = run(*feeds, "--output-dir", out, "--incremental", cwd=tmp_path)
+    assert "1 converted, 0 failed, 0 skipped, 2 up to date" in result.stdout
+    run(feeds[1], "--output-dir", tmp_path / "fresh", cwd=tmp_path)
+    assert (out / "two.csv").read_bytes() == (tmp_path / "fresh" / "two.csv").read_bytes()
+
+
+def test_force_reconverts_and_rerecords_every_input(tmp_path: Path, feeds: List[Path]) -> None:
+    out = tmp_path / "out"
+    manifest = tmp_path / "manifest.json"
+    run(*feeds, "--output-dir", out, "--incremental", "--manifest", manifest, cwd=tmp_path)
+    (out / "one.csv").write_text("stale\n", encoding="utf-8")
+    before = json.loads(manifest.read_text(encoding="utf-8"))["entries"]
+    result = run(*feeds, "--output-dir", out, "--incremental", "--manifest", manifest, "--force", cwd=tmp_path)
+    assert "3 converted, 0 failed, 0 skipped, 0 up to date" in result.stdout
+    assert "stale" not in (out / "one.csv").read_text(encoding="utf-8")
+    after = json.loads(manifest.read_text(encoding="utf-8"))["entries"]
+    assert after.keys() == before.keys()
+    assert after[str(feeds[0])]["outputs"][0]["size"] == (out / "one.csv").stat().st_size
+    result = run(*feeds, "--output-dir", out, "--incremental", "--manifest", manifest, cwd=tmp_path)
+    assert "0 converted, 0 failed, 0 skipped, 3 up to date" in result.stdout
+
+
+def test_incremental_rechecks_outputs_under_a_new_expansion_limit(tmp_path: Path, feeds: List[Path]) -> None:
+    out = tmp_path / "out"
+    run(feeds[0], "--output-dir", out, "--incremental", cwd=tmp_path)
+    result = run(feeds[0], "--output-dir", out, "--incremental", "--max-expansion", "2", cwd=tmp_path)
+    assert "0 converted, 1 failed" in result.stdout
+    result = run(feeds[0], "--output-dir", out, "--incremental", "--max-file-expansion", "10", cwd=tmp_path)
+    assert "0 converted, 1 failed" in result.stdout
+
+
+def test_stdin_to_stdout_matches_merge(tmp_path: Path, feeds: List[Path]) -> None:
+    run(feeds[0], "--merge-into", tmp_path / "merged.csv", cwd=tmp_path)
+    result = subprocess.run(
+        [sys.executable, str(SCRIPT), "-", "--stdout"],
+        input=feeds[0].read_text(encoding="utf-8"),
+        cwd=tmp_path,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.encode("utf-8") == (tmp_path / "merged.csv").read_bytes().replace(b"\r\n", b"\n")
+    assert "Wrote merged CSV: standard output" in result.stderr
+
+
+def test_stdout_exits_quietly_when_the_reader_goes_away(tmp_path: Path) -> None:
+    # Far more CSV than a pipe buffers, so the writer is still going when the reader stops
+    feed = write_feed(tmp_path / "big.xml", 0, 3000)
+    proc = subprocess.Popen(
+        [sys.executable, str(SCRIPT), str(feed), "--stdout"],
+        cwd=tmp_path,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    assert proc.stdout is not None and proc.stderr is not None
+    assert proc.stdout.readline().startswith(b"Batch,")
+    proc.stdout.close()
+    stderr = proc.stderr.read().decode("utf-8")
+    assert proc.wait() == xml2csv.EXIT_BROKEN_PIPE
+    assert "Traceback" not in stderr and "Wrote merged CSV" not in stderr
+
+
+def test_failed_stdin_does_not_report_a_merged_output(tmp_path: Path) -> None:
+    result = subprocess.run(
+        [sys.executable, str(SCRIPT), "-", "--stdout"], input="<r><a>", cwd=tmp_path, capture_output=True, text=True
+    )
+    assert "Failed to parse -" in result.stderr
+    assert "Wrote merged CSV" not in result.stderr
+
+
+@pytest.mark.parametrize("variant", [["--jobs", "2"], ["--jobs", "2", "--split-size", "0.0002"]])
+def test_where_on_a_colliding_column_matches_serial(tmp_path: Path, variant: List[str]) -> None:
+    # In the second input alone, Id would name x/A/Id; merged, it is still x/Id
+    first = tmp_path / "a.xml"
+    first.write_text("<r>" + "<x><Id>1</Id><B>q</B></x><x><Id>5</Id></x>" * 20 + "</r>", encoding="utf-8")
+    second = tmp_path / "b.xml"
+    second.write_text("<r>" + "".join(f"<x><A><Id>{n % 7}</Id></A></x>" for n in range(40)) + "</r>", encoding="utf-8")
+    run(first, second, "--merge-into", tmp_path / "serial.csv", "--where", "Id=5", cwd=tmp_path)
+    run(first, second, "--merge-into", tmp_path / "variant.csv", "--where", "Id=5", *variant, cwd=tmp_path)
+    assert (tmp_path / "variant.csv").read_bytes() == (tmp_path / "serial.csv").read_bytes()
+    assert [row["x.A.Id"] for row in read_table(tmp_path / "serial.csv")] == [""] * 20
+
+
+@pytest.mark.parametrize(
+    "variant", [[], ["--row-path", "/Root/Records/Record", "--jobs", "2"], ["--detect-bytes", "1024"]]
+)
+def test_compressed_inputs_and_archive_members_match_plain(
+    tmp_path: Path, feeds: List[Path], variant: List[str]
+) -> None:
+    run(*feeds, "--output-dir", tmp_path / "plain", cwd=tmp_path)
+    packed = tmp_path / "packed"
+    packed.mkdir()
+    for feed, opener, suffix in zip(feeds, (gzip.open, bz2.open, lzma.open), (".gz", ".bz2", ".xz")):
+        with opener(packed / (feed.name + suffix), "wb") as f:
+            f.write(feed.read_bytes())
+    with zipfile.ZipFile(packed / "feeds.zip", "w") as zf:
+        zf.write(feeds[0], "2024/one.xml")
+    with tarfile.open(packed / "feeds.tar.gz", "w:gz") as tf:
+        tf.add(feeds[1], "two.xml")
+    run(packed, "--output-dir", tmp_path / "out", *variant, cwd=tmp_path)
+    out = tmp_path / "out"
+    for feed in feeds:
+        name = feed.with_suffix(".csv").name
+        assert (out / name).read_bytes() == (tmp_path / "plain" / name).read_bytes()
+    assert (out / "feeds" / "2024" / "one.csv").read_bytes() == (tmp_path / "plain" / "one.csv").read_bytes()
+    assert (out / "feeds" / "two.csv").read_bytes() == (tmp_path / "plain" / "two.csv").read_bytes()
+
+
+@pytest.mark.parametrize(
+    "variant", [[], ["--jobs", "2"], ["--select-columns", "Id,Sku"], ["--schema-in", "schema.json", "--jobs", "2"]]
+)
+def test_archive_members_merge_like_plain_inputs_and_leave_no_copies(
+    tmp_path: Path, feeds: List[Path], variant: List[str]
+) -> None:
+    run(*feeds, "--merge-into", tmp_path / "full.csv", "--schema-out", tmp_path / "schema.json", cwd=tmp_path)
+    run(*feeds, "--merge-into", tmp_path / "plain.csv", *variant, cwd=tmp_path)
+    with tarfile.open(tmp_path / "feeds.tgz", "w:gz") as tf:
+        tf.add(feeds[0], "a/one.xml")
+    with gzip.open(tmp_path / "two.xml.gz", "wb") as f:
+        f.write(feeds[1].read_bytes())
+    with tarfile.open(tmp_path / "feeds.tar", "w") as tf:
+        tf.add(tmp_path / "two.xml.gz", "b/two.xml.gz")
+        tf.add(feeds[2], "c/three.xml")
+    scratch = tmp_path / "scratch"
+    scratch.mkdir()
+    archives = [tmp_path / "feeds.tgz", tmp_path / "feeds.tar"]
+    run(*archives, "--merge-into", tmp_path / "packed.csv", "--spill-dir", scratch, *variant, cwd=tmp_path)
+    assert (tmp_path / "packed.csv").read_bytes() == (tmp_path / "plain.csv").read_bytes()
+    assert list(scratch.iterdir()) == []
+
+
+@pytest.mark.parametrize("single_pass", [False, True])
+def test_only_tar_members_read_twice_are_copied(
+    tmp_path: Path, feeds: List[Path], monkeypatch: pytest.MonkeyPatch, single_pass: bool
+) -> None:
+    with zipfile.ZipFile(tmp_path / "feeds.zip", "w") as zf:
+        zf.write(feeds[0], "one.xml")
+    with gzip.open(tmp_path / "two.xml.gz", "wb") as f:
+        f.write(feeds[1].read_bytes())
+    with tarfile.open(tmp_path / "feeds.tgz", "w:gz") as tf:
+        tf.add(tmp_path / "two.xml.gz", "two.xml.gz")
+        tf.add(feeds[2], "three.xml")
+    copied: List[Path] = []
+    add = xml2csv.MemberSpools.add
+
+    def counted_add(self: xml2csv.MemberSpools, inp: Path, member: object) -> None:
+        copied.append(inp)
+        add(self, inp, member)
+
+    monkeypatch.setattr(xml2csv.MemberSpools, "add", counted_add)
+    spools = xml2csv.MemberSpools(tmp_path, single_pass)
+    counts: List[int] = []
+    try:
+        for inp in xml2csv.iter_input_paths([str(tmp_path / "feeds.zip"), str(tmp_path / "feeds.tgz")], spools):
+            source = spools.source(inp)
+            assert isinstance(source, Path) != (single_pass and inp.parent.name == "feeds.tgz")
+            row_path = ("Root", "Records", "Record") if single_pass else None
+            counts.append(sum(1 for _ in xml2csv.iter_table_rows(source, [], {}, row_path=row_path)))
+            spools.release(inp)
+    finally:
+        spools.close()
+    tar_members = [tmp_path / "feeds.tgz" / "two.xml.gz", tmp_path / "feeds.tgz" / "three.xml"]
+    assert copied == ([] if single_pass else tar_members)
+    assert counts == [sum(1 for _ in xml2csv.iter_table_rows(feed, [], {})) for feed in feeds]
+
+
+@pytest.mark.parametrize("variant", [[], ["--jobs", "2"]])
+def test_inputs_with_the_same_output_name_do_not_overwrite_each_other(
+    tmp_path: Path, feeds: List[Path], variant: List[str]
+) -> None:
+    with gzip.open(tmp_path / "one.xml.gz", "wb") as f:
+        f.write(feeds[1].read_bytes())
+    with zipfile.ZipFile(tmp_path / "bundle.zip", "w") as zf:
+        zf.write(feeds[0], "x.xml")
+    with tarfile.open(tmp_path / "bundle.tgz", "w:gz") as tf:
+        tf.add(feeds[1], "x.xml")
+    inputs = [feeds[0], tmp_path / "one.xml.gz", tmp_path / "bundle.zip", tmp_path / "bundle.tgz"]
+    result = run(*inputs, "--output-dir", tmp_path / "out", *variant, cwd=tmp_path)
+    assert "2 converted, 2 failed" in result.stdout
+    assert f"Failed to convert {tmp_path / 'one.xml.gz'}" in result.stdout
+    run(feeds[0], "--output-dir", tmp_path / "plain", cwd=tmp_path)
+    expected = (tmp_path / "plain" / "one.csv").read_bytes()
+    assert (tmp_path / "out" / "one.csv").read_bytes() == expected
+    assert (tmp_path / "out" / "bundle" / "x.csv").read_bytes() == expected
+
+
+def write_late_feed(path: Path) -> Path:
+    # Footer follows the rows: only a scan of the whole document sees it before the first row
+    records = "".join(f"<Record><Id>{n}</Id></Record>" for n in range(5))
+    path.write_text(f"<Root><Records><Batch>b</Batch>{records}<Footer>f</Footer></Records></Root>", encoding="utf-8")
+    return path
+
+
+def test_detect_bytes_covering_the_whole_input_reads_it_in_two_passes(tmp_path: Path) -> None:
+    feed = write_late_feed(tmp_path / "late.xml")
+    run(feed, "--output-dir", tmp_path / "serial", cwd=tmp_path)
+    result = run(feed, "--output-dir", tmp_path / "prefix", "--detect-bytes", "4096", cwd=tmp_path)
+    assert "Warning" not in result.stdout
+    assert (tmp_path / "prefix" / "late.csv").read_bytes() == (tmp_path / "serial" / "late.csv").read_bytes()
+    assert read_table(tmp_path / "serial" / "late.csv")[0] == {"Batch": "b", "Footer": "f", "Id": "0"}
+
+
+@pytest.mark.parametrize("variant", [["--detect-bytes", "80"], ["--row-path", "/Root/Records/Record"]])
+def test_single_pass_warns_of_fields_after_the_first_row(tmp_path: Path, variant: List[str]) -> None:
+    feed = write_late_feed(tmp_path / "late.xml")
+    result = run(feed, "--output-dir", tmp_path / "out", *variant, cwd=tmp_path)
+    assert "late.xml has fields after its first row, which a single pass reads too late for its rows: Footer" in (
+        result.stdout
+    )
+    assert read_table(tmp_path / "out" / "late.csv")[0] == {"Batch": "b", "Id": "0"}
+
+
+@pytest.mark.parametrize("method, opener", [("gzip", gzip.open), ("bz2", bz2.open), ("xz", lzma.open)])
+@pytest.mark.parametrize("variant", [[], ["--jobs", "2", "--split-size", SPLIT_MIB]])
+def test_compressed_output_holds_the_plain_csv(
+    tmp_path: Path, feeds: List[Path], method: str, opener, variant: List[str]
+) -> None:
+    suffix = {"gzip": ".gz", "bz2": ".bz2", "xz": ".xz"}[method]
+    run(*feeds, "--output-dir", tmp_path / "plain", cwd=tmp_path)
+    run(*feeds, "--merge-into", tmp_path / "plain.csv", cwd=tmp_path)
+    run(*feeds, "--output-dir", tmp_path / "packed", "--compress", method, *variant, cwd=tmp_path)
+    for feed in feeds:
+        name = feed.with_suffix(".csv").name
+        with opener(tmp_path / "packed" / (name + suffix), "rb") as f:
+            assert f.read() == (tmp_path / "plain" / name).read_bytes()
+    run(*feeds, "--merge-into", tmp_path / "merged.csv", "--compress", method, *variant, cwd=tmp_path)
+    with opener(tmp_path / ("merged.csv" + suffix), "rb") as f:
+        assert f.read() == (tmp_path / "plain.csv").read_bytes()
+
+
+def test_directories_globs_and_input_lists_expand_to_the_same_inputs(tmp_path: Path) -> None:
+    tree = tmp_path / "tree"
+    (tree / "b" / "deep").mkdir(parents=True)
+    first = write_feed(tree / "z.xml", 0, 10)
+    second = write_feed(tree / "b" / "a.xml", 10, 10, extra=True)
+    third = write_feed(tree / "b" / "deep" / "m.xml", 20, 10)
+    (tree / "b" / "notes.txt").write_text("not xml", encoding="utf-8")
+    # A directory lists its files, in name order, before its subdirectories
+    run(first, second, third, "--merge-into", tmp_path / "explicit.csv", cwd=tmp_path)
+    run(tree, "--merge-into", tmp_path / "walked.csv", cwd=tmp_path)
+    assert (tmp_path / "walked.csv").read_bytes() == (tmp_path / "explicit.csv").read_bytes()
+
+    run("tree/b/**/*.xml", "--merge-into", tmp_path / "globbed.csv", cwd=tmp_path)
+    run(second, third, "--merge-into", tmp_path / "expected.csv", cwd=tmp_path)
+    assert (tmp_path / "globbed.csv").read_bytes() == (tmp_path / "expected.csv").read_bytes()
+
+    (tmp_path / "list.txt").write_text(f"{second}\n\ntree/b/deep\n", encoding="utf-8")
+    run("--inputs-from", tmp_path / "list.txt", "--merge-into", tmp_path / "listed.csv", cwd=tmp_path)
+    assert (tmp_path / "listed.csv").read_bytes() == (tmp_path / "expected.csv").read_bytes()
+    result = subprocess.run(
+        [sys.executable, str(SCRIPT), "--inputs-from", "-", "--merge-into", tmp_path / "piped.csv"],
+        input=f"{second}\n{third}\n",
+        cwd=tmp_path,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert (tmp_path / "piped.csv").read_bytes() == (tmp_path / "expected.csv").read_bytes()
+
+    result = run("tree/**/*.json", "--output-dir", tmp_path / "none", cwd=tmp_path)
+    assert "No inputs match pattern: tree/**/*.json" in result.stdout
+
+
+def write_groups_feed(path: Path) -> Path:
+    path.write_text(
+        "<r><o><k>1</k><L><a>x</a></L><L><a>y</a></L><T><t>1</t></T><T><t>2</t></T><T><t>3</t></T></o>"
+        "<o><k>2</k></o></r>",
+        encoding="utf-8",
+    )
+    return path
+
+
+@pytest.mark.parametrize("variant", [[], ["--spill"], ["--jobs", "2", "--split-size", "0.0002"]])
+def test_cartesian_expansion_emits_every_combination(tmp_path: Path, variant: List[str]) -> None:
+    feed = tmp_path / "nested.xml"
+    feed.write_text(
+        "<r><o><k>1</k><L><a>x</a><S><s>p</s></S><S><s>q</s></S></L><L><a>y</a></L><T><t>1</t></T><T><t>2</t></T></o>"
+        + "".join(
+            f"<o><k>{n}</k>" + "".join(f"<A><u>{i}</u></A>" for i in range(4))
+            + "".join(f"<B><v>{j}</v></B>" for j in range(5)) + "".join(f"<C><w>{m}</w></C>" for m in range(6))
+            + "</o>"
+            for n in range(2, 12)
+        )
+        + "</r>",
+        encoding="utf-8",
+    )
+    run(feed, "--output-dir", tmp_path / "out", *variant, cwd=tmp_path)
+    rows = read_table(tmp_path / "out" / "nested.csv")
+    # A group nested in one entry of another only varies with that entry; later groups vary first
+    assert [(row["k"], row["a"], row["t"], row["s"]) for row in rows[:6]] == [
+        ("1", "y", "2", ""),
+        ("1", "y", "1", ""),
+        ("1", "x", "2", "q"),
+        ("1", "x", "2", "p"),
+        ("1", "x", "1", "q"),
+        ("1", "x", "1", "p"),
+    ]
+    for n in range(2, 12):
+        combos = [(row["u"], row["v"], row["w"]) for row in rows if row["k"] == str(n)]
+        assert sorted(combos) == [(str(i), str(j), str(m)) for i in range(4) for j in range(5) for m in range(6)]
+
+
+def test_zip_expansion_pairs_up_group_entries(tmp_path: Path) -> None:
+    feed = write_groups_feed(tmp_path / "groups.xml")
+    run(feed, "--output-dir", tmp_path / "out", "--expand", "zip", cwd=tmp_path)
+    rows = [(row["k"], row["a"], row["t"]) for row in read_table(tmp_path / "out" / "groups.csv")]
+    assert rows == [("1", "x", "1"), ("1", "y", "2"), ("1", "", "3"), ("2", "", "")]
+
+
+def test_max_expansion_fails_an_oversized_row_element(tmp_path: Path) -> None:
+    feed = write_groups_feed(tmp_path / "groups.xml")
+    result = run(feed, "--output-dir", tmp_path / "out", "--max-expansion", "5", cwd=tmp_path)
+    assert "expands to 6 rows, over the per-element limit of 5 (--max-expansion)" in result.stdout
+    assert not (tmp_path / "out" / "groups.csv").exists()
+    result = run(feed, "--output-dir", tmp_path / "out", "--max-expansion", "6", cwd=tmp_path)
+    assert "1 converted, 0 failed" in result.stdout
+
+
+@pytest.mark.parametrize("variant", [[], ["--jobs", "2", "--split-size", SPLIT_MIB]])
+def test_max_file_expansion_counts_every_row_of_an_input(
+    tmp_path: Path, feeds: List[Path], variant: List[str]
+) -> None:
+    run(feeds[0], "--output-dir", tmp_path / "full", cwd=tmp_path)
+    rows = len(read_table(tmp_path / "full" / "one.csv"))
+    limit = ["--max-file-expansion", str(rows - 1)]
+    result = run(feeds[0], "--output-dir", tmp_path / "out", *limit, *variant, cwd=tmp_path)
+    assert f"Input expands to more than {rows - 1} rows (--max-file-expansion)" in result.stdout
+    limit = ["--max-file-expansion", str(rows)]
+    run(feeds[0], "--output-dir", tmp_path / "out", *limit, *variant, cwd=tmp_path)
+    assert (tmp_path / "out" / "one.csv").read_bytes() == (tmp_path / "full" / "one.csv").read_bytes()
+
+
+def test_normalized_output_writes_a_keyed_table_per_group(tmp_path: Path) -> None:
+    feed = write_groups_feed(tmp_path / "groups.xml")
+    run(feed, "--output-dir", tmp_path / "out", "--expand", "normalized", cwd=tmp_path)
+    out = tmp_path / "out"
+    assert sorted(path.name for path in out.iterdir()) == ["groups.L.csv", "groups.T.csv", "groups.csv"]
+    assert read_table(out / "groups.csv") == [{"_id": "1", "k": "1"}, {"_id": "2", "k": "2"}]
+    assert read_table(out / "groups.L.csv") == [
+        {"_id": "1", "_parent_id": "1", "a": "x"},
+        {"_id": "2", "_parent_id": "1", "a": "y"},
+    ]
+    assert [(row["_parent_id"], row["t"]) for row in read_table(out / "groups.T.csv")] == [
+        ("1", "1"),
+        ("1", "2"),
+        ("1", "3"),
+    ]
+
+
+def test_list_columns_reads_the_header_off_the_scan(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    feed = write_feed(tmp_path / "feed.xml", 0, 60, extra=True)
+    # Group entries that bring different leaves, an empty leaf and a container field after the rows
+    feed.write_text(
+        feed.read_text(encoding="utf-8").replace(
+            "<Record><Id>3</Id>", "<Record><Id>3</Id><G><u>1</u></G><G><v>2</v></G><w>3</w><w/>"
+        ).replace("</Records>", "<Trailer>t</Trailer></Records>"),
+        encoding="utf-8",
+    )
+    expected: List[str] = []
+    for _row in xml2csv.iter_table_rows(feed, expected, {}):
+        pass
+
+    def no_parse(*args: object, **kwargs: object) -> None:
+        raise AssertionError("the rows were parsed")
+
+    monkeypatch.setattr(xml2csv, "iter_rows_from_events", no_parse)
+    listed: List[str] = []
+    for _row in xml2csv.iter_table_rows(feed, listed, {}, schema_only=True):
+        pass
+    assert listed == expected
+    assert {"u", "v", "w", "Trailer"} <= set(listed)
+
+
+def test_list_columns_parses_the_rows_when_they_have_too_many_shapes(
+    tmp_path: Path, feeds: List[Path], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    expected: List[str] = []
+    for _row in xml2csv.iter_table_rows(feeds[0], expected, {}):
+        pass
+    monkeypatch.setattr(xml2csv, "MAX_LISTED_SHAPES", 10)
+    listed: List[str] = []
+    for _row in xml2csv.iter_table_rows(feeds[0], listed, {}, schema_only=True):
+        pass
+    assert listed == expected
+
+
+@pytest.mark.parametrize("variant", [[], ["--jobs", "2", "--split-size", SPLIT_MIB]])
+def test_list_columns_matches_the_written_header(tmp_path: Path, feeds: List[Path], variant: List[str]) -> None:
+    run(*feeds, "--output-dir", tmp_path / "out", cwd=tmp_path)
+    result = run(*feeds, "--list-columns", *variant, cwd=tmp_path)
+    expected = []
+    for feed in feeds:
+        with (tmp_path / "out" / feed.with_suffix(".csv").name).open(newline="", encoding="utf-8") as f:
+            expected.append(f"{feed.name}: {','.join(next(csv.reader(f)))}")
+    assert result.stdout.splitlines() == expected
+
+    run(*feeds, "--merge-into", tmp_path / "merged.csv", cwd=tmp_path)
+    result = run(*feeds, "--list-columns", "--merge-into", tmp_path / "listed.csv", *variant, cwd=tmp_path)
+    with (tmp_path / "merged.csv").open(newline="", encoding="utf-8") as f:
+        assert result.stdout.splitlines() == [",".join(next(csv.reader(f)))]
+    assert not (tmp_path / "listed.csv").exists()
+
+
+@pytest.mark.parametrize("variant", [[], ["--jobs", "2", "--split-size", SPLIT_MIB]])
+def test_stats_count_the_rows_written(tmp_path: Path, feeds: List[Path], variant: List[str]) -> None:
+    where = ["--where", "Status=ACTIVE"]
+    run(*feeds, "--output-dir", tmp_path / "out", *where, cwd=tmp_path)
+    stats = ["--stats", "--stats-json", tmp_path / "stats.json"]
+    result = run(*feeds, "--output-dir", tmp_path / "timed", *where, *stats, *variant, cwd=tmp_path)
+    assert "Stats:" in result.stderr and "Stats:" not in result.stdout
+    assert "Wrote stats:" in result.stderr and "Wrote stats:" not in result.stdout
+    report = json.loads((tmp_path / "stats.json").read_text(encoding="utf-8"))
+    for feed, entry in zip(feeds, report["files"]):
+        csv_path = tmp_path / "out" / feed.with_suffix(".csv").name
+        assert entry["name"] == str(feed)
+        assert entry["rows"] == len(read_table(csv_path))
+        # Both passes over the input are counted
+        assert entry["bytes_read"] >= feed.stat().st_size
+        assert entry["bytes_written"] == csv_path.stat().st_size
+    assert report["total"]["rows"] == sum(entry["rows"] for entry in report["files"])
+
+
+def test_stats_go_to_standard_error_with_stdout(tmp_path: Path, feeds: List[Path]) -> None:
+    plain = run(*feeds, "--stdout", cwd=tmp_path)
+    timed = run(*feeds, "--stdout", "--stats", cwd=tmp_path)
+    assert timed.stdout == plain.stdout
+    assert "Stats:" in timed.stderr
+
+
+@pytest.mark.parametrize("variant", [[], ["--jobs", "2"]])
+def test_profile_writes_pstats_and_stacks_rooted_at_each_input(tmp_path: Path, variant: List[str]) -> None:
+    # Large enough for the stack sampler to catch the conversion of each input
+    feeds = [write_feed(tmp_path / "big1.xml", 0, 1500), write_feed(tmp_path / "big2.xml", 1500, 1500)]
+    profile = tmp_path / "run.folded"
+    run(*feeds, "--output-dir", tmp_path / "out", "--profile", profile, *variant, cwd=tmp_path)
+    # The stacks go next to the profile, never onto it, even when its name ends in .folded
+    functions = {name for _file, _line, name in pstats.Stats(str(profile)).stats}
+    assert "iter_rows_from_events" in functions
+    stacks = (tmp_path / "run.folded.folded").read_text(encoding="utf-8").splitlines()
+    assert all(re.fullmatch(r"[^;]+(;[^;]+)* \d+", line) for line in stacks)
+    roots = {line.split(";", 1)[0] for line in stacks}
+    assert {str(feed) for feed in feeds} <= roots
+
+
+def test_profile_sampling_writes_only_stacks(tmp_path: Path) -> None:
+    feed = write_feed(tmp_path / "big.xml", 0, 1500)
+    run(feed, "--output-dir", tmp_path / "out", "--profile", tmp_path / "run.prof", "--profile-sampling", cwd=tmp_path)
+    assert not (tmp_path / "run.prof").exists()
+    stacks = (tmp_path / "run.prof.folded").read_text(encoding="utf-8").splitlines()
+    assert any(line.startswith(f"{feed};") for line in stacks)
+
+
+def test_convert_writes_the_command_line_csv(tmp_path: Path, feeds: List[Path]) -> None:
+    run(feeds[1], "--output-dir", tmp_path / "cli", cwd=tmp_path)
+    expected = (tmp_path / "cli" / "two.csv").read_bytes()
+    columns = xml2csv.convert(feeds[1], tmp_path / "api.csv")
+    assert (tmp_path / "api.csv").read_bytes() == expected
+    assert columns == next(csv.reader(expected.decode("utf-8").splitlines()))
+    with feeds[1].open("rb") as f:
+        xml2csv.convert(f, tmp_path / "stream.csv")
+    assert (tmp_path / "stream.csv").read_bytes() == expected
+
+    assert xml2csv.convert(feeds[1], tmp_path / "some.csv", columns=["Region", "Id"]) == ["Region", "Id"]
+    expected_rows = [{"Region": row["Region"], "Id": row["Id"]} for row in read_table(tmp_path / "api.csv")]
+    assert read_table(tmp_path / "some.csv") == expected_rows
+    with pytest.raises(ValueError, match="unknown columns: Nope"):
+        xml2csv.convert(feeds[1], tmp_path / "bad.csv", columns=["Id", "Nope"])
+    assert not (tmp_path / "bad.csv").exists()
+
+
+def test_converter_shares_the_header_across_documents(tmp_path: Path, feeds: List[Path]) -> None:
+    run(*feeds, "--merge-into", tmp_path / "merged.csv", cwd=tmp_path)
+    converter = xml2csv.Converter()
+    rows = [row for feed in feeds for row in converter.iter_rows(feed)]
+    width = len(converter.columns)
+    expected = read_table(tmp_path / "merged.csv")
+    assert [dict(zip(converter.columns, row + ("",) * (width - len(row)))) for row in rows] == expected
+
+    # Started from the first converter's state, a second one reads every document in one pass
+    schema_converter = xml2csv.Converter(converter.to_schema())
+    for feed, first_id in zip(feeds, (0, 40, 70)):
+        out = tmp_path / feed.with_suffix(".csv").name
+        schema_converter.convert(feed, out)
+        assert read_table(out) == [row for row in expected if row["Batch"] == f"b{first_id}"]
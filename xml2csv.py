@@ -23,6 +23,7 @@ Behavior inferred from provided samples:
 Enhancements:
 - Optionally list the columns that would be produced (per-file or merged across inputs)
 - Optionally select a subset of columns to write, preserving requested order
+- Stream each input with iterparse instead of building the full ElementTree
 
 Note: This is a general-purpose heuristic to match the examples provided. XMLs with
 multiple different repeating groups at the same level or ambiguous structures may
@@ -32,11 +33,45 @@ require explicit configuration which is out of scope here.
 from __future__ import annotations
 
 import argparse
+import bz2
+import codecs
+import cProfile
 import csv
-from collections import Counter, OrderedDict
-from pathlib import Path
-from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import glob
+import gzip
+import hashlib
+import io
+import json
+import lzma
+import os
+import pstats
+import re
+import shutil
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass, field
+from functools import lru_cache, wraps
+from itertools import chain
+from operator import itemgetter
+from pathlib import Path, PurePosixPath
+from typing import IO, Callable, ClassVar, Deque, Dict, FrozenSet, Iterable, Iterator, List, Mapping, Optional, Sequence, Set, Tuple, Union
 import xml.etree.ElementTree as ET
+import xml.parsers.expat as expat
+
+try:
+    import resource
+except ImportError:  # Unix only; elsewhere --stats reports no peak memory
+    resource = None  # type: ignore[assignment]
+
+# The importable API; see Converter
+__all__ = ["Converter", "ExpansionPolicy", "OutputCompression", "TableSchema", "convert", "iter_rows"]
 
 
 def parse_args() -> argparse.Namespace:
@@ -45,8 +80,17 @@ def parse_args() -> argparse.Namespace:
     )
     parser.add_argument(
         "inputs",
-        nargs="+",
-        help="One or more XML files to convert",
+        nargs="*",
+        help=(
+            "XML files to convert. Directories are searched recursively for *.xml files and glob "
+            "patterns are expanded (quote them to bypass the shell; ** matches any depth)"
+        ),
+    )
+    parser.add_argument(
+        "--inputs-from",
+        dest="inputs_from",
+        default=None,
+        help="Read further inputs (files, directories or patterns), one per line, from this file or - for stdin",
     )
     parser.add_argument(
         "--merge-into",
@@ -57,6 +101,15 @@ def parse_args() -> argparse.Namespace:
             "are combined and written to this single CSV."
         ),
     )
+    parser.add_argument(
+        "--stdout",
+        dest="stdout",
+        action="store_true",
+        help=(
+            "Write the rows of all inputs as a single CSV to standard output, like --merge-into; "
+            "messages go to standard error. Use - as an input to read XML from standard input"
+        ),
+    )
     parser.add_argument(
         "--output-dir",
         dest="output_dir",
@@ -94,7 +147,249 @@ def parse_args() -> argparse.Namespace:
             "Names must match the resolved header names (after disambiguation)."
         ),
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--where",
+        dest="where",
+        action="append",
+        default=None,
+        metavar="CONDITION",
+        help=(
+            "Write only rows meeting CONDITION on a resolved column name: COLUMN=VALUE, COLUMN!=VALUE, "
+            "COLUMN~REGEX, COLUMN!~REGEX, COLUMN<N (also <=, >, >=) or 'COLUMN is [not] null'. Can be "
+            "provided multiple times; a row must meet every condition"
+        ),
+    )
+    parser.add_argument(
+        "--spill",
+        dest="spill",
+        action="store_true",
+        help=(
+            "Spill extracted rows to a temporary file instead of keeping them in memory until the "
+            "header is known. Memory use then stays constant regardless of the number of rows."
+        ),
+    )
+    parser.add_argument(
+        "--spill-dir",
+        dest="spill_dir",
+        default=None,
+        help=(
+            "Directory for the temporary spill file used by --spill and for the copies of the tar members "
+            "that are read twice (default: system temp directory)."
+        ),
+    )
+    parser.add_argument(
+        "--jobs",
+        dest="jobs",
+        type=int,
+        default=1,
+        help=(
+            "Number of worker processes used to convert inputs in parallel (default: 1). "
+            "Use 0 for one worker per CPU."
+        ),
+    )
+    parser.add_argument(
+        "--detect-bytes",
+        dest="detect_bytes",
+        type=int,
+        default=None,
+        help=(
+            "Detect the row element from only the first N bytes of each input and convert it in a "
+            "single pass, instead of scanning the whole document first. Ancestor fields are then "
+            "taken from those that precede the rows."
+        ),
+    )
+    parser.add_argument(
+        "--split-size",
+        dest="split_size",
+        type=float,
+        default=None,
+        help=(
+            "With --jobs > 1, split inputs larger than this many MiB into row-aligned chunks that are "
+            "parsed in parallel, so a single huge file uses every worker."
+        ),
+    )
+    parser.add_argument(
+        "--expand",
+        dest="expand",
+        choices=EXPAND_MODES,
+        default="cartesian",
+        help=(
+            "How nested repeating groups become rows: 'cartesian' (default) emits every combination, "
+            "'zip' pairs up the i-th entries of all groups, 'normalized' writes one row per row "
+            "element plus one <name>.<group>.csv per nested group, linked by _id/_parent_id"
+        ),
+    )
+    parser.add_argument(
+        "--max-expansion",
+        dest="max_expansion",
+        type=int,
+        default=None,
+        help="Fail an input if a single row element would expand to more than this many rows",
+    )
+    parser.add_argument(
+        "--max-file-expansion",
+        dest="max_file_expansion",
+        type=int,
+        default=None,
+        help="Fail an input if it would expand to more than this many rows in total",
+    )
+    parser.add_argument(
+        "--schema-out",
+        dest="schema_out",
+        default=None,
+        help=(
+            "Write the detected row element and the resolved header (merged across all inputs) to this "
+            "JSON file, for later runs with --schema-in"
+        ),
+    )
+    parser.add_argument(
+        "--schema-in",
+        dest="schema_in",
+        default=None,
+        help=(
+            "Read the row element and header from a --schema-out file instead of detecting them: each "
+            "input is read once and rows are written as they are extracted. Output has exactly the "
+            "schema's columns; columns missing from the schema are reported and left out"
+        ),
+    )
+    parser.add_argument(
+        "--row-path",
+        dest="row_path",
+        default=None,
+        metavar="PATH",
+        help=(
+            "Absolute path of the row element, e.g. /Root/Records/Record, instead of detecting it. Each "
+            "input is read once and rows are recognized by their path as it is parsed; ancestor fields "
+            "are taken from those that precede the rows, as with --detect-bytes"
+        ),
+    )
+    parser.add_argument(
+        "--compress",
+        dest="compress",
+        choices=COMPRESS_METHODS,
+        default=None,
+        help="Compress the CSV outputs while writing them (adds .gz, .bz2 or .xz to their names)",
+    )
+    parser.add_argument(
+        "--compress-level",
+        dest="compress_level",
+        type=int,
+        choices=range(10),
+        default=None,
+        metavar="0-9",
+        help="Compression level for --compress (default: 6 for gzip and xz, 9 for bz2; bz2 accepts 1-9)",
+    )
+    parser.add_argument(
+        "--stats",
+        dest="stats",
+        action="store_true",
+        help=(
+            "Report wall and CPU time per stage (detect, parse, containers, expand, columns, buffer, write), "
+            "rows, bytes read and written, throughput per input and peak memory at the end of the run"
+        ),
+    )
+    parser.add_argument(
+        "--stats-json",
+        dest="stats_json",
+        default=None,
+        metavar="FILE",
+        help="Write the --stats report to FILE as JSON (implies collecting the stats)",
+    )
+    parser.add_argument(
+        "--profile",
+        dest="profile",
+        default=None,
+        metavar="FILE",
+        help=(
+            "Run the conversion under cProfile (worker processes included) and write the profile to FILE "
+            "in pstats format, plus collapsed stacks for flamegraph tools, rooted at each input, "
+            "to FILE.folded"
+        ),
+    )
+    parser.add_argument(
+        "--profile-sampling",
+        dest="profile_sampling",
+        action="store_true",
+        help=(
+            "With --profile, only sample stacks (every 5 ms) instead of also tracing every call with cProfile: "
+            "the run keeps close to full speed, and only the .folded file is written"
+        ),
+    )
+    parser.add_argument(
+        "--incremental",
+        dest="incremental",
+        action="store_true",
+        help=(
+            "Skip inputs whose outputs are still up to date according to a manifest of earlier runs "
+            "(input size, mtime and content hash, options, output files); per-file mode only"
+        ),
+    )
+    parser.add_argument(
+        "--manifest",
+        dest="manifest",
+        default=None,
+        help=(
+            "Manifest file for --incremental "
+            "(default: .xml2csv-manifest.json in --output-dir, else the current directory)"
+        ),
+    )
+    parser.add_argument(
+        "--force",
+        dest="force",
+        action="store_true",
+        help="With --incremental, convert every input again and rewrite the manifest",
+    )
+    args = parser.parse_args()
+    if not args.inputs and args.inputs_from is None:
+        parser.error("no inputs given; pass files, directories or patterns, or --inputs-from")
+    if args.inputs_from not in (None, "-") and not Path(args.inputs_from).expanduser().is_file():
+        parser.error(f"--inputs-from: no such file: {args.inputs_from}")
+    if args.stdout and args.merge_into is not None:
+        parser.error("--stdout and --merge-into both choose the merged output; pass only one")
+    if args.stdout and (args.list_columns or args.incremental or args.expand == "normalized"):
+        parser.error("--stdout cannot be used with --list-columns, --incremental or --expand normalized")
+    if args.inputs_from == "-" and "-" in args.inputs:
+        parser.error("standard input cannot hold both XML (-) and the --inputs-from list")
+    if args.compress_level is not None and args.compress is None:
+        parser.error("--compress-level requires --compress")
+    if args.compress == "bz2" and args.compress_level == 0:
+        parser.error("bz2 compression levels range from 1 to 9")
+    if args.stdout:
+        args.merge_into = "-"
+    if args.incremental and args.merge_into is not None:
+        parser.error("--incremental applies to per-file conversion and cannot be used with --merge-into")
+    if args.expand == "normalized" and args.merge_into is not None:
+        parser.error("--expand normalized writes a set of tables per input and cannot be used with --merge-into")
+    if args.expand == "normalized" and (args.schema_in is not None or args.schema_out is not None):
+        parser.error("--expand normalized cannot be used with --schema-in or --schema-out")
+    if args.row_path is not None:
+        if args.schema_in is not None:
+            parser.error("--schema-in already sets the row element; --row-path cannot be used with it")
+        try:
+            args.row_path = parse_row_path(args.row_path)
+        except ValueError as exc:
+            parser.error(f"--row-path: {exc}")
+    if args.where is not None:
+        if args.expand == "normalized":
+            parser.error("--where filters a single table and cannot be used with --expand normalized")
+        try:
+            args.row_filter = RowFilter.parse(args.where)
+        except ValueError as exc:
+            parser.error(f"--where: {exc}")
+    else:
+        args.row_filter = None
+    if args.profile_sampling and args.profile is None:
+        parser.error("--profile-sampling requires --profile")
+    if args.jobs < 0:
+        parser.error("--jobs must be 0 (one worker per CPU) or a positive number of workers")
+    if args.split_size is not None and args.split_size <= 0:
+        parser.error("--split-size must be a positive number of MiB")
+    if args.detect_bytes is not None and args.detect_bytes <= 0:
+        parser.error("--detect-bytes must be a positive number of bytes")
+    for name, limit in (("--max-expansion", args.max_expansion), ("--max-file-expansion", args.max_file_expansion)):
+        if limit is not None and limit <= 0:
+            parser.error(f"{name} must be a positive number of rows")
+    return args
 
 
 def get_children_by_tag(parent: ET.Element) -> Dict[str, List[ET.Element]]:
@@ -104,14 +399,6 @@ def get_children_by_tag(parent: ET.Element) -> Dict[str, List[ET.Element]]:
     return children_by_tag
 
 
-def first_repeating_child_tag(parent: ET.Element) -> Optional[str]:
-    by_tag = get_children_by_tag(parent)
-    for tag, nodes in by_tag.items():
-        if len(nodes) > 1:
-            return tag
-    return None
-
-
 def find_row_parent_and_tag(root: ET.Element) -> Tuple[Optional[ET.Element], str, List[ET.Element]]:
     """
     Find the first element in document order that has a repeating child tag.
@@ -119,76 +406,74 @@ def find_row_parent_and_tag(root: ET.Element) -> Tuple[Optional[ET.Element], str
 
     If none found, treat the root as a single-row element.
     """
-    # BFS through the tree until we find a parent with a repeating child
-    queue: List[ET.Element] = [root]
+    # BFS through the tree until we find a parent with a repeating child; each element is
+    # visited once and the search stops at the first parent found
+    queue: Deque[ET.Element] = deque([root])
     while queue:
-        parent = queue.pop(0)
-        tag = first_repeating_child_tag(parent)
-        if tag is not None:
-            row_elements = get_children_by_tag(parent)[tag]
-            return parent, tag, row_elements
-        queue.extend(list(parent))
+        parent = queue.popleft()
+        for tag, nodes in get_children_by_tag(parent).items():
+            if len(nodes) > 1:
+                return parent, tag, nodes
+        queue.extend(parent)
 
     # No repeating children anywhere: single row is the root
     return None, root.tag, [root]
 
 
-PathKey = Tuple[str, ...]
+def detect_row_path(input_path: Path, max_bytes: int, stats: Optional[ConversionStats] = None) -> Optional[PathKey]:
+    """
+    Detect the row path from only the first max_bytes of the document. Returns None if that prefix
+    holds no repeating group, or is the whole document, which the two-pass mode then reads cheaply.
+    """
+    with open_input(input_path) as f:
+        prefix = f.read(max_bytes)
+    if stats is not None:
+        stats.bytes_read += len(prefix)
+    if len(prefix) < max_bytes:
+        return None
+    return detect_prefix_row_path(prefix)
 
 
-def compute_repeating_group_keys(parent: ET.Element, parent_path: PathKey) -> List[Tuple[PathKey, str, List[ET.Element]]]:
+def detect_prefix_row_path(prefix: bytes) -> Optional[PathKey]:
     """
-    For a given parent node, return a list of repeating groups under this parent.
-    Each entry is (group_key, child_tag, children).
-    group_key identifies the group by (path_to_parent + child_tag).
+    Detect the row path from the leading bytes of a document; see detect_row_path.
     """
-    children_by_tag = get_children_by_tag(parent)
-    groups: List[Tuple[PathKey, str, List[ET.Element]]] = []
-    for tag, children in children_by_tag.items():
-        if len(children) > 1:
-            group_key: PathKey = parent_path + (tag,)
-            groups.append((group_key, tag, children))
-    return groups
+    parser = ET.XMLPullParser(events=("start",))
+    parser.feed(prefix)
+    for _event, root in parser.read_events():
+        row_parent, row_tag, _ = find_row_parent_and_tag(root)
+        if row_parent is None:
+            return None
+        return element_path(root, row_parent) + (row_tag,)
+    return None
 
 
-def find_next_unselected_repeating_group(
-    root: ET.Element,
-    selection: Dict[PathKey, int],
-    path_prefix: Optional[PathKey] = None,
-) -> Optional[Tuple[PathKey, List[ET.Element]]]:
-    """
-    Depth-first search for the next repeating group under root not covered by selection.
-    Returns (group_key, children) or None if all are selected.
-    """
-    if path_prefix is None:
-        path_prefix = (root.tag,)
-
-    # First, check for unselected repeating groups at the current level
-    groups_here = compute_repeating_group_keys(root, path_prefix)
-    for group_key, _tag, children in groups_here:
-        if group_key not in selection:
-            return group_key, children
-
-    # If all repeating groups at this level are selected, recurse into children
-    children_by_tag = get_children_by_tag(root)
-    for tag, children in children_by_tag.items():
-        child_path = path_prefix + (tag,)
-        if len(children) > 1:
-            # This is a repeating group, which we already know is in 'selection'
-            group_key = child_path
-            if group_key in selection:
-                idx = selection[group_key]
-                if 0 <= idx < len(children):
-                    found = find_next_unselected_repeating_group(children[idx], selection, child_path)
-                    if found:
-                        return found
-        else:
-            # Non-repeating child, recurse
-            found = find_next_unselected_repeating_group(children[0], selection, child_path)
-            if found:
-                return found
+# One step of a --row-path: an element name, namespaced ones in ElementTree's {uri}name form
+_ROW_PATH_STEP = r"/((?:\{[^}]*\})?[^/{}\[\]()@*=\s]+)"
+_ROW_PATH_RE = re.compile(f"(?:{_ROW_PATH_STEP})+")
+
+
+def parse_row_path(text: str) -> PathKey:
+    """
+    Parse a --row-path, an absolute location path of element names such as /Root/Records/Record,
+    into the tag path of the row element. Raise ValueError for anything else (relative paths,
+    //, wildcards, predicates, attributes).
+    """
+    if _ROW_PATH_RE.fullmatch(text) is None:
+        raise ValueError(f"{text!r} is not an absolute path of element names such as /Root/Records/Record")
+    return tuple(re.findall(_ROW_PATH_STEP, text))
+
+
+def format_row_path(path: PathKey) -> str:
+    """Return a row path in --row-path form."""
+    return "/" + "/".join(path)
 
-    return None
+
+PathKey = Tuple[str, ...]
+
+# An extracted row: values by header index, None where the row has no value. The header only grows
+# at the end, so a row built before later columns were added is simply shorter than the header.
+Row = Tuple[Optional[str], ...]
 
 
 def iter_scalar_leaves(
@@ -255,273 +540,4122 @@ def disambiguate_column_name(
 ) -> str:
     """
     Ensure column names are unique. Prefer leaf tag name; on collision use dotted path.
-    If dotted path also collides, append a numeric suffix.
+    If dotted path also collides, append a numeric suffix. A path already registered keeps its name.
     """
-    if candidate not in existing:
+    if existing.get(candidate, full_path) == full_path:
         return candidate
 
     dotted = ".".join(full_path)
-    if dotted not in existing:
+    if existing.get(dotted, full_path) == full_path:
         return dotted
 
     # Append numeric suffix until unique
     i = 2
     while True:
         alt = f"{dotted}_{i}"
-        if alt not in existing:
+        if existing.get(alt, full_path) == full_path:
             return alt
         i += 1
 
 
-def extract_rows_for_element(
-    row_elem: ET.Element,
+def register_column(full_path: PathKey, header_order: List[str], header_paths: Dict[str, PathKey]) -> str:
+    """
+    Resolve the column name of full_path, appending it to the header if it is new.
+    """
+    col = disambiguate_column_name(full_path[-1], full_path, header_paths)
+    if col not in header_paths:
+        header_paths[col] = full_path
+        header_order.append(col)
+    return col
+
+
+def resolve_container_columns(
+    container_values: Mapping[str, str],
     row_parent: Optional[ET.Element],
-    row_tag: str,
     header_order: List[str],
     header_paths: Dict[str, PathKey],
-) -> List[OrderedDict]:
+) -> List[Tuple[str, str]]:
     """
-    Expand nested repeating groups under row_elem into multiple contexts and
-    extract a list of row dictionaries for CSV writing.
+    Resolve (and register in the header) the column name of every container value.
+    Returns (column, value) pairs in container order, ready to seed each row.
     """
-    container_values = build_container_values(row_parent, row_tag)
+    columns: List[Tuple[str, str]] = []
+    if row_parent is None:
+        return columns
+    for candidate_name, value in container_values.items():
+        columns.append((register_column((row_parent.tag, candidate_name), header_order, header_paths), value))
+    return columns
 
-    # Expand contexts across nested repeating groups under row_elem
-    pending: List[Dict[PathKey, int]] = [{}]
-    finalized: List[Dict[PathKey, int]] = []
 
-    while pending:
-        sel = pending.pop()
-        found = find_next_unselected_repeating_group(row_elem, sel)
-        if found is None:
-            finalized.append(sel)
-            continue
-        group_key, children = found
-        for idx in range(len(children)):
-            new_sel = dict(sel)
-            new_sel[group_key] = idx
-            pending.append(new_sel)
-
-    rows: List[OrderedDict] = []
-    for sel in finalized:
-        row_map: OrderedDict[str, str] = OrderedDict()
-
-        # Seed with container values first (and register header order/paths)
-        for candidate_name, value in container_values.items():
-            if candidate_name in header_paths and header_paths[candidate_name] != (row_parent.tag, candidate_name) if row_parent is not None else False:
-                # Disambiguate against an existing different path
-                full_path = (row_parent.tag, candidate_name) if row_parent is not None else (candidate_name,)
-                col = disambiguate_column_name(candidate_name, full_path, header_paths)
-            else:
-                col = candidate_name
+# Most shapes compiled plans are kept for at one path. Elements whose children vary freely (a
+# random subset of optional fields, say) would otherwise add a plan per row; past the cap, plans are
+# compiled per element and dropped with it, while leaf columns stay cached per path
+MAX_SHAPES_PER_PATH = 256
 
-            if col not in header_paths:
-                full_path = (row_parent.tag, candidate_name) if row_parent is not None else (candidate_name,)
-                header_paths[col] = full_path
-                header_order.append(col)
+# Child tag sequence -> compiled plan, for the elements at one path
+ShapeCache = Dict[Tuple[str, ...], "_ShapePlan"]
 
-            if col not in row_map:
-                row_map[col] = value
 
-        # Now add values from row element subtree respecting selection
-        for path, text in iter_scalar_leaves(row_elem, sel):
-            # Skip the top-level tag of row's parent in the path if present.
-            if len(path) >= 2 and row_parent is not None and path[0] == row_parent.tag and path[1] == row_tag:
-                effective_path = path[1:]  # start from row_tag
-            else:
-                effective_path = path
+class _ChildGroup:
+    """
+    The children of one tag under an element shape: their positions among the element's children
+    and the shapes seen so far at their path, shared by every group that reaches that path.
+    """
 
-            if text == "":
-                continue
-            candidate_name = effective_path[-1]
-            if candidate_name in header_paths and header_paths[candidate_name] != effective_path:
-                col = disambiguate_column_name(candidate_name, effective_path, header_paths)
-            else:
-                col = candidate_name
+    __slots__ = ("path", "positions", "repeating", "shapes", "projected")
 
-            # Update header tracking
-            if col not in header_paths:
-                header_paths[col] = effective_path
-                header_order.append(col)
+    def __init__(self, path: PathKey, positions: List[int], shapes: ShapeCache) -> None:
+        self.path = path
+        self.positions = positions
+        self.repeating = len(positions) > 1
+        # False when the subtree leads to no projected column (see ColumnProjection)
+        self.projected = True
+        self.shapes = shapes
 
-            row_map[col] = text
 
-        rows.append(row_map)
+class _ShapePlan:
+    """
+    Compiled extraction plan for one element shape: a path plus the tag sequence of its children.
+    Groups the children by tag (first-appearance order) once, instead of once per visited node.
+    """
 
-    return rows
+    __slots__ = ("path", "groups", "repeating", "column")
 
+    def __init__(self, path: PathKey, child_tags: Tuple[str, ...], caches: Dict[PathKey, ShapeCache]) -> None:
+        self.path = path
+        positions: Dict[str, List[int]] = {}
+        for idx, tag in enumerate(child_tags):
+            positions.setdefault(tag, []).append(idx)
+        self.groups = []
+        for tag, idx in positions.items():
+            child_path = path + (tag,)
+            shapes = caches.get(child_path)
+            if shapes is None:
+                shapes = caches[child_path] = {}
+            self.groups.append(_ChildGroup(child_path, idx, shapes))
+        self.repeating = [group for group in self.groups if group.repeating]
+        # Leaf shapes only: header index of the column, resolved the first time it has a value
+        self.column: Optional[int] = None
 
-def convert_xml_to_csv(
-    input_path: Path,
-    output_dir: Optional[Path],
-    encoding: str,
-    delimiter: str,
-    selected_columns: Optional[List[str]] = None,
-) -> Path:
-    tree = ET.parse(str(input_path))
-    root = tree.getroot()
 
-    row_parent, row_tag, row_elements = find_row_parent_and_tag(root)
+# Selected child index per nested repeating group of one row
+Selection = Dict[_ChildGroup, int]
+# Children and compiled plan of each element of the row being extracted
+NodeCache = Dict[ET.Element, Tuple[List[ET.Element], _ShapePlan]]
 
-    header_order: List[str] = []
-    header_paths: Dict[str, PathKey] = {}
-    table_rows: List[OrderedDict[str, str]] = []
 
-    for row_elem in row_elements:
-        extracted = extract_rows_for_element(row_elem, row_parent, row_tag, header_order, header_paths)
-        table_rows.extend(extracted)
+# How nested repeating groups under a row element are turned into rows
+EXPAND_MODES = ("cartesian", "zip", "normalized")
 
-    # Ensure all container columns appear first in header order by scanning first row's container again
-    # (header already constructed during extraction, which seeded container columns first per row.)
+# Key columns of normalized output
+ID_COLUMN = "_id"
+PARENT_ID_COLUMN = "_parent_id"
 
-    # Compute output path
-    out_dir = output_dir if output_dir is not None else input_path.parent
-    out_path = out_dir / (input_path.stem + ".csv")
-
-    # Determine columns to write
-    columns_to_write: List[str]
-    if selected_columns:
-        present = [c for c in selected_columns if c in header_order]
-        missing = [c for c in selected_columns if c not in header_order]
-        if missing:
-            print(f"Warning: skipping unknown columns for {input_path.name}: {', '.join(missing)}")
-        columns_to_write = present
-    else:
-        columns_to_write = header_order
 
-    # Write CSV
-    with out_path.open("w", encoding=encoding, newline="") as f:
-        writer = csv.writer(f, delimiter=delimiter)
-        writer.writerow(columns_to_write)
-        for row in table_rows:
-            writer.writerow([row.get(col, "") for col in columns_to_write])
+def file_expansion_error(limit: int) -> str:
+    return f"Input expands to more than {limit} rows (--max-file-expansion)"
 
-    return out_path
 
+@dataclass(frozen=True)
+class ExpansionPolicy:
+    """
+    How nested repeating groups are expanded (cartesian, zip or normalized), and how many rows that may produce.
+    """
 
-def extract_table_from_file(
-    input_path: Path,
-    header_order: List[str],
-    header_paths: Dict[str, PathKey],
-) -> List[OrderedDict[str, str]]:
+    mode: str = "cartesian"
+    # Most rows a single row element may expand to
+    max_rows_per_element: Optional[int] = None
+    # Most rows one input may expand to in total
+    max_rows_per_file: Optional[int] = None
+
+
+# Numbered alternative of a colliding dotted column name (see disambiguate_column_name)
+_NUMBERED_NAME_RE = re.compile(r"_\d+$")
+
+# Column of leaf shapes outside the column projection: their values are never written
+UNPROJECTED_COLUMN = -1
+
+
+@dataclass(frozen=True)
+class ColumnProjection:
     """
-    Parse a single XML file and extract rows, updating the provided header_order and header_paths
-    so that column naming is consistent across multiple files when merging.
+    The columns extraction is limited to (--select-columns). Leaves whose tag can end a selected name are
+    extracted, so names resolve as in a full extraction; with paths (from a schema) only those leaves are.
     """
-    tree = ET.parse(str(input_path))
-    root = tree.getroot()
-    row_parent, row_tag, row_elements = find_row_parent_and_tag(root)
 
-    rows: List[OrderedDict[str, str]] = []
-    for row_elem in row_elements:
-        extracted = extract_rows_for_element(row_elem, row_parent, row_tag, header_order, header_paths)
-        rows.extend(extracted)
-    return rows
+    names: FrozenSet[str]
+    paths: Optional[FrozenSet[PathKey]] = None
 
+    def wants_tag(self, tag: str) -> bool:
+        """
+        Whether a leaf with this tag can resolve to one of the selected names.
+        """
+        suffix = "." + tag
+        for name in self.names:
+            if name == tag or name.endswith(suffix):
+                return True
+            numbered = _NUMBERED_NAME_RE.sub("", name)
+            if numbered == tag or numbered.endswith(suffix):
+                return True
+        return False
 
-def normalize_selected_columns(select_columns_args: Optional[List[str]]) -> Optional[List[str]]:
-    if not select_columns_args:
-        return None
-    selected: List[str] = []
-    for part in select_columns_args:
-        if not part:
-            continue
-        selected.extend([c.strip() for c in part.split(",") if c.strip()])
-    return selected or None
 
+# Comparison operators of --where, longest first so that "<=" is not read as "<"
+WHERE_OPERATORS = ("!=", "!~", "<=", ">=", "=", "~", "<", ">")
+_WHERE_NULL_RE = re.compile(r"^\s*(?P<column>\S.*?)\s+is\s+(?P<negated>not\s+)?null\s*$", re.IGNORECASE)
+_WHERE_COMPARISON_RE = re.compile(
+    r"^\s*(?P<column>[^!=~<>]*?)\s*(?P<op>"
+    + "|".join(re.escape(op) for op in WHERE_OPERATORS)
+    + r")\s*(?P<operand>.*?)\s*$"
+)
 
-def main() -> None:
-    args = parse_args()
-    inputs: List[Path] = [Path(p).expanduser().resolve() for p in args.inputs]
-    output_dir: Optional[Path] = None
-    if args.output_dir is not None:
-        output_dir = Path(args.output_dir).expanduser().resolve()
-        output_dir.mkdir(parents=True, exist_ok=True)
 
-    selected_columns = normalize_selected_columns(args.select_columns)
+@dataclass(frozen=True)
+class RowCondition:
+    """
+    One --where condition on a resolved column name.
+    """
 
-    if args.merge_into is not None:
-        # Merge all inputs into a single CSV
-        merged_header_order: List[str] = []
-        merged_header_paths: Dict[str, PathKey] = {}
-        merged_rows: List[OrderedDict[str, str]] = []
+    column: str
+    op: str
+    operand: Optional[str] = None
+    pattern: Optional["re.Pattern[str]"] = None
+    number: Optional[float] = None
 
-        for inp in inputs:
-            if not inp.exists():
-                print(f"Skipping non-existent file: {inp}")
-                continue
+    @classmethod
+    def parse(cls, expr: str) -> "RowCondition":
+        """
+        Parse "COLUMN OP VALUE" or "COLUMN is [not] null"; raise ValueError if malformed.
+        """
+        match = _WHERE_NULL_RE.match(expr)
+        if match is not None:
+            return cls(match.group("column"), "notnull" if match.group("negated") else "null")
+        match = _WHERE_COMPARISON_RE.match(expr)
+        if match is None or not match.group("column"):
+            raise ValueError(f"cannot parse condition {expr!r}; expected COLUMN OP VALUE or COLUMN is [not] null")
+        column, op, operand = match.group("column"), match.group("op"), match.group("operand")
+        if op in ("~", "!~"):
             try:
-                merged_rows.extend(extract_table_from_file(inp, merged_header_order, merged_header_paths))
-            except Exception as exc:
-                print(f"Failed to parse {inp}: {exc}")
+                return cls(column, op, operand, pattern=re.compile(operand))
+            except re.error as exc:
+                raise ValueError(f"invalid regular expression in {expr!r}: {exc}") from None
+        if op in ("<", "<=", ">", ">="):
+            try:
+                return cls(column, op, operand, number=float(operand))
+            except ValueError:
+                raise ValueError(f"{op} needs a number in {expr!r}") from None
+        return cls(column, op, operand)
 
-        # If only listing columns, print and exit
-        if args.list_columns:
-            print(",".join(merged_header_order))
-            return
+    def test(self, value: Optional[str]) -> bool:
+        """
+        Whether a row whose value in this column is value (None if it has none) passes.
+        """
+        op = self.op
+        if op == "=" or op == "!=":
+            matched = value == self.operand or (value is None and not self.operand)
+            return matched == (op == "=")
+        if op == "null":
+            return value is None
+        if op == "notnull":
+            return value is not None
+        if value is None:
+            return op == "!~"
+        if op == "~" or op == "!~":
+            assert self.pattern is not None
+            return (self.pattern.search(value) is not None) == (op == "~")
+        try:
+            number = float(value)
+        except ValueError:
+            return False
+        assert self.number is not None
+        if op == "<":
+            return number < self.number
+        if op == "<=":
+            return number <= self.number
+        if op == ">":
+            return number > self.number
+        return number >= self.number
 
-        # Determine output path for merged file
-        merge_path = Path(args.merge_into).expanduser().resolve()
-        if merge_path.is_dir():
-            # If a directory is provided, use a default filename inside it
-            merge_path = merge_path / "merged.csv"
-        merge_path.parent.mkdir(parents=True, exist_ok=True)
-
-        # Determine columns to write
-        columns_to_write: List[str]
-        if selected_columns:
-            present = [c for c in selected_columns if c in merged_header_order]
-            missing = [c for c in selected_columns if c not in merged_header_order]
-            if missing:
-                print(f"Warning: skipping unknown columns in merged output: {', '.join(missing)}")
-            columns_to_write = present
-        else:
-            columns_to_write = merged_header_order
-
-        with merge_path.open("w", encoding=args.encoding, newline="") as f:
-            writer = csv.writer(f, delimiter=args.delimiter)
-            writer.writerow(columns_to_write)
-            for row in merged_rows:
-                writer.writerow([row.get(col, "") for col in columns_to_write])
-        print(f"Wrote merged CSV: {merge_path}")
-    else:
-        # One CSV per input
-        for inp in inputs:
-            if not inp.exists():
-                print(f"Skipping non-existent file: {inp}")
-                continue
-            try:
-                # Build header (and rows) first to support listing/selection
-                header_order: List[str] = []
-                header_paths: Dict[str, PathKey] = {}
-                rows = extract_table_from_file(inp, header_order, header_paths)
 
-                if args.list_columns:
-                    print(f"{inp.name}: {','.join(header_order)}")
-                    continue
+@dataclass(frozen=True)
+class RowFilter:
+    """
+    Conditions every written row must meet (--where, all of them). Rows are filtered as they are
+    extracted, so the header is the same as without the filter: it only drops rows.
+    """
 
-                # Determine columns to write for this file
-                columns_to_write: Optional[List[str]] = None
-                if selected_columns:
-                    present = [c for c in selected_columns if c in header_order]
-                    missing = [c for c in selected_columns if c not in header_order]
-                    if missing:
-                        print(f"Warning: skipping unknown columns for {inp.name}: {', '.join(missing)}")
-                    columns_to_write = present
-
-                # Write CSV using the precomputed header/rows to avoid recomputation
-                out_dir = output_dir if output_dir is not None else inp.parent
-                out_path = out_dir / (inp.stem + ".csv")
-                with out_path.open("w", encoding=args.encoding, newline="") as f:
-                    writer = csv.writer(f, delimiter=args.delimiter)
-                    writer.writerow(columns_to_write or header_order)
-                    for row in rows:
-                        writer.writerow([row.get(col, "") for col in (columns_to_write or header_order)])
-                print(f"Wrote: {out_path}")
-            except Exception as exc:
-                print(f"Failed to convert {inp}: {exc}")
+    conditions: Tuple[RowCondition, ...]
 
+    @classmethod
+    def parse(cls, exprs: Iterable[str]) -> "RowFilter":
+        return cls(tuple(RowCondition.parse(expr) for expr in exprs))
 
-if __name__ == "__main__":
-    main()
+    @property
+    def columns(self) -> List[str]:
+        """
+        The columns the conditions read, in order, without repeats.
+        """
+        return list(dict.fromkeys(cond.column for cond in self.conditions))
+
+    def record_test(self, positions: Mapping[str, int]) -> Callable[[Sequence[Optional[str]]], bool]:
+        """
+        Return whether a finished record passes, given column name -> position in the record (a
+        column with no position, like an empty value, has no value).
+        """
+        checks = [(positions.get(cond.column, -1), cond) for cond in self.conditions]
+
+        def test(record: Sequence[Optional[str]]) -> bool:
+            size = len(record)
+            for idx, cond in checks:
+                if not cond.test((record[idx] if 0 <= idx < size else None) or None):
+                    return False
+            return True
+
+        return test
+
+
+class _FilterPlan:
+    """
+    A RowFilter laid out against the header as it stands: conditions by header index, the indexes
+    whose conditions fail for a row without a value, and whether the conditions on columns the
+    header does not have yet (so no row has a value for them) hold.
+    """
+
+    __slots__ = ("size", "checks", "null_failing", "absent_pass")
+
+    def __init__(self, row_filter: RowFilter, header_order: Sequence[str], indexes: Mapping[str, int]) -> None:
+        self.size = len(header_order)
+        self.checks: Dict[int, List[RowCondition]] = {}
+        self.absent_pass = True
+        for cond in row_filter.conditions:
+            idx = indexes.get(cond.column)
+            if idx is None and cond.column in header_order:
+                idx = header_order.index(cond.column)
+            if idx is None:
+                self.absent_pass = self.absent_pass and cond.test(None)
+            else:
+                self.checks.setdefault(idx, []).append(cond)
+        self.null_failing = [idx for idx, conds in self.checks.items() if not all(c.test(None) for c in conds)]
+
+    def seed_passes(self, seed: Sequence[Optional[str]]) -> bool:
+        """
+        Whether the values a row starts from (its row parent's fields) pass their conditions.
+        """
+        size = len(seed)
+        for idx, conds in self.checks.items():
+            if idx < size and seed[idx] is not None:
+                value = seed[idx]
+                for cond in conds:
+                    if not cond.test(value):
+                        return False
+        return True
+
+    def passes(self, values: Sequence[Optional[str]]) -> bool:
+        if not self.absent_pass:
+            return False
+        size = len(values)
+        for idx, conds in self.checks.items():
+            value = values[idx] if idx < size else None
+            for cond in conds:
+                if not cond.test(value):
+                    return False
+        return True
+
+
+# Stages --stats splits the time of an input into, in pipeline order. buffer is the time spent
+# holding rows (in memory or a spill file) until the header is final
+STATS_STAGES = ("detect", "parse", "containers", "expand", "columns", "buffer", "write")
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """
+    Peak resident set size of this process and of its finished worker processes, where the
+    platform reports it.
+    """
+    if resource is None:
+        return None
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    )
+    # Kilobytes everywhere but macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+@dataclass
+class ConversionStats:
+    """
+    Time per stage and counters of one input, or of a merged output (--stats). Stages are timed
+    exclusively: switch() charges the time since the previous switch to the stage that was running.
+    """
+
+    name: str
+    wall: Dict[str, float] = field(default_factory=lambda: dict.fromkeys(STATS_STAGES, 0.0))
+    cpu: Dict[str, float] = field(default_factory=lambda: dict.fromkeys(STATS_STAGES, 0.0))
+    bytes_read: int = 0
+    bytes_written: int = 0
+    # Row elements extracted, the rows they expanded to, and the rows emitted (after --where)
+    row_elements: int = 0
+    expanded: int = 0
+    rows: int = 0
+    # Columns the input added to the header
+    columns: int = 0
+    peak_rss: Optional[int] = None
+    stage: Optional[str] = None
+    _wall_mark: float = 0.0
+    _cpu_mark: float = 0.0
+
+    def switch(self, stage: Optional[str]) -> Optional[str]:
+        """
+        Charge the time since the last switch to the running stage, start stage (None stops the
+        clock) and return the stage that was running.
+        """
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        previous = self.stage
+        if previous is not None:
+            self.wall[previous] += wall - self._wall_mark
+            self.cpu[previous] += cpu - self._cpu_mark
+        self.stage = stage
+        self._wall_mark = wall
+        self._cpu_mark = cpu
+        return previous
+
+    def finish(self) -> None:
+        """
+        Stop the clock and note the peak memory use so far.
+        """
+        self.switch(None)
+        self.peak_rss = peak_rss_bytes()
+
+    def add(self, other: ConversionStats) -> None:
+        """
+        Add the times and counters of another part of the same input (see --split-size).
+        """
+        for stage in STATS_STAGES:
+            self.wall[stage] += other.wall[stage]
+            self.cpu[stage] += other.cpu[stage]
+        self.bytes_read += other.bytes_read
+        self.bytes_written += other.bytes_written
+        self.row_elements += other.row_elements
+        self.expanded += other.expanded
+        self.rows += other.rows
+        self.columns = max(self.columns, other.columns)
+        if other.peak_rss is not None:
+            self.peak_rss = max(self.peak_rss or 0, other.peak_rss)
+
+    @property
+    def seconds(self) -> float:
+        return sum(self.wall.values())
+
+    def to_json(self) -> Dict[str, object]:
+        seconds = self.seconds
+        return {
+            "name": self.name,
+            "wall": self.wall,
+            "cpu": self.cpu,
+            "seconds": seconds,
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "row_elements": self.row_elements,
+            "expanded": self.expanded,
+            "rows": self.rows,
+            "columns": self.columns,
+            "peak_rss": self.peak_rss,
+            "mb_per_s": self.bytes_read / 1e6 / seconds if seconds else None,
+            "rows_per_s": self.rows / seconds if seconds else None,
+        }
+
+
+class _CountingReader:
+    """
+    A binary input stream that adds the bytes read through it to stats.bytes_read.
+    """
+
+    def __init__(self, raw: IO[bytes], stats: ConversionStats) -> None:
+        self.raw = raw
+        self.stats = stats
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.raw.read(size)
+        self.stats.bytes_read += len(data)
+        return data
+
+    def read1(self, size: int = -1) -> bytes:
+        data = getattr(self.raw, "read1", self.raw.read)(size)
+        self.stats.bytes_read += len(data)
+        return data
+
+
+class _CountingWriter(io.RawIOBase):
+    """
+    A binary output stream that adds the bytes written through it to stats.bytes_written; only used
+    where the output cannot be measured afterwards (a pipe), so it cannot be truncated either.
+    """
+
+    def __init__(self, raw: IO[bytes], stats: ConversionStats) -> None:
+        super().__init__()
+        self.raw = raw
+        self.stats = stats
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: bytes) -> int:  # type: ignore[override]
+        written = self.raw.write(data)
+        self.stats.bytes_written += written
+        return written
+
+    def flush(self) -> None:
+        self.raw.flush()
 
+
+# Seconds between the stack samples --profile folds for flamegraph tools
+PROFILE_SAMPLE_INTERVAL = 0.005
+
+
+class RunProfiler:
+    """
+    Profile of one process for --profile: a sampler thread that records the main thread's stack every
+    PROFILE_SAMPLE_INTERVAL, rooted at the current label (see label_profile), plus cProfile with calls.
+    """
+
+    # The profiler running in this process, if any
+    active: ClassVar[Optional[RunProfiler]] = None
+
+    def __init__(self, label: str = "run", calls: bool = True) -> None:
+        self.label = label
+        self.profile = cProfile.Profile() if calls else None
+        # (label, code objects innermost first) -> number of samples
+        self.samples: Counter = Counter()
+        self._thread_id = threading.get_ident()
+        self._stopped = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name="xml2csv-profile", daemon=True)
+
+    def start(self) -> None:
+        RunProfiler.active = self
+        self._sampler.start()
+        if self.profile is not None:
+            self.profile.enable()
+
+    def stop(self) -> None:
+        if self.profile is not None:
+            self.profile.disable()
+        self._stopped.set()
+        self._sampler.join()
+        RunProfiler.active = None
+
+    def _sample(self) -> None:
+        while not self._stopped.wait(PROFILE_SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(self._thread_id)
+            codes = []
+            while frame is not None:
+                codes.append(frame.f_code)
+                frame = frame.f_back
+            self.samples[(self.label, tuple(codes))] += 1
+
+    def folded(self) -> Counter:
+        """
+        Return the samples as collapsed stacks ("label;outermost;...;innermost" -> count), the
+        input format of flamegraph.pl, speedscope and similar tools.
+        """
+        stacks: Counter = Counter()
+        for (label, codes), count in self.samples.items():
+            frames = [label]
+            for code in reversed(codes):
+                frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            stacks[";".join(frame.replace(";", ",") for frame in frames)] += count
+        return stacks
+
+    def save(self, pstats_path: Path) -> None:
+        """
+        Write the cProfile data, if any, to pstats_path and the collapsed stacks next to it (see
+        folded_path).
+        """
+        if self.profile is not None:
+            self.profile.dump_stats(str(pstats_path))
+        write_folded(folded_path(pstats_path), self.folded())
+
+
+def folded_path(pstats_path: Path) -> Path:
+    """
+    Return where the collapsed stacks of a --profile file go: its full name plus .folded, so that no
+    name (not even one ending in .folded) maps onto the pstats file itself.
+    """
+    return pstats_path.with_name(pstats_path.name + ".folded")
+
+
+def write_folded(path: Path, stacks: Mapping[str, int]) -> None:
+    with path.open("w", encoding="utf-8") as f:
+        for stack, count in sorted(stacks.items()):
+            f.write(f"{stack} {count}\n")
+
+
+def label_profile(label: object) -> Optional[str]:
+    """
+    Root the --profile samples taken from now on at label (an input path, a chunk's input or an
+    output name) and return the previous label. Does nothing when the process is not profiled.
+    """
+    profiler = RunProfiler.active
+    if profiler is None:
+        return None
+    previous = profiler.label
+    profiler.label = str(getattr(label, "input_path", label))
+    return previous
+
+
+def profiled_per_input(fn: Callable) -> Callable:
+    """
+    Attribute the --profile samples taken inside fn to its first argument: an input path, or a
+    RowChunk whose input is used.
+    """
+
+    @wraps(fn)
+    def attributed(target: object, *args: object, **kwargs: object) -> object:
+        previous = label_profile(target)
+        try:
+            return fn(target, *args, **kwargs)
+        finally:
+            if previous is not None:
+                label_profile(previous)
+
+    return attributed
+
+
+def run_profiled(profile_dir: str, calls: bool, fn: Callable, *args: object) -> object:
+    """
+    Run a worker task under its own RunProfiler and leave the profile in profile_dir, where the
+    parent merges it into the --profile output at the end of the run.
+    """
+    inherited = RunProfiler.active
+    if inherited is not None:
+        # A forked worker inherits the parent's cProfile hook, though not its sampler thread
+        if inherited.profile is not None:
+            inherited.profile.disable()
+        RunProfiler.active = None
+    profiler = RunProfiler("worker", calls)
+    profiler.start()
+    try:
+        return fn(*args)
+    finally:
+        profiler.stop()
+        fd, name = tempfile.mkstemp(suffix=".pstats", dir=profile_dir)
+        os.close(fd)
+        profiler.save(Path(name))
+
+
+class RowExtractor:
+    """
+    Extract rows against a growing header, compiling a plan per element shape on first sight and
+    skipping the leaves a projection leaves out and the branches a row filter rejects.
+    """
+
+    def __init__(
+        self,
+        parent_tag: Optional[str],
+        row_tag: str,
+        header_order: List[str],
+        header_paths: Dict[str, PathKey],
+        expansion: ExpansionPolicy = ExpansionPolicy(),
+        group_tables: Optional[GroupTables] = None,
+        projection: Optional[ColumnProjection] = None,
+        row_filter: Optional[RowFilter] = None,
+        stats: Optional[ConversionStats] = None,
+    ) -> None:
+        if projection is not None and expansion.mode == "normalized":
+            raise ValueError("Column projection applies to a single table, not to normalized expansion")
+        if row_filter is not None and expansion.mode == "normalized":
+            raise ValueError("Row filters apply to a single table, not to normalized expansion")
+        self.header_order = header_order
+        self.header_paths = header_paths
+        self.expansion = expansion
+        self.group_tables = group_tables
+        self.projection = projection
+        # Column paths leading to a projected leaf, when the projection knows its paths
+        self._projected_prefixes: Optional[Set[PathKey]] = None
+        if projection is not None and projection.paths is not None:
+            self._projected_prefixes = {path[:end] for path in projection.paths for end in range(1, len(path) + 1)}
+        self._projected_tags: Dict[str, bool] = {}
+        self.row_filter = row_filter
+        self._filter_plan: Optional[_FilterPlan] = None
+        # Column name resolution is timed as its own stage (see ConversionStats)
+        self.stats = stats
+        # Row elements seen and rows they expand to, for the expansion limits
+        self.element_count = 0
+        self.expanded_count = 0
+        # A row nested directly in a same-named row drops the outer row tag from its column paths
+        self._strip_outer = parent_tag == row_tag
+        # Shape caches by path (see MAX_SHAPES_PER_PATH)
+        self._shape_caches: Dict[PathKey, ShapeCache] = {(row_tag,): {}}
+        self._root = _ChildGroup((row_tag,), [0], self._shape_caches[(row_tag,)])
+        self._indexes: Dict[str, int] = {}
+        self._seed: List[Optional[str]] = []
+        self._seed_columns: Optional[Sequence[Tuple[str, str]]] = None
+        self._id_index = -1
+        if expansion.mode == "normalized":
+            if group_tables is None:
+                raise ValueError("Normalized expansion needs group tables to write nested groups to")
+            self._id_index = self.column_index(register_column((ID_COLUMN,), header_order, header_paths))
+
+    def column_index(self, col: str) -> int:
+        """
+        Return the header index of a registered column.
+        """
+        idx = self._indexes.get(col)
+        if idx is None:
+            idx = self._indexes[col] = self.header_order.index(col)
+        return idx
+
+    def _resolve_column(self, shape: _ShapePlan, table: Optional[GroupTable] = None) -> int:
+        stage = self.stats.switch("columns") if self.stats is not None else None
+        if table is not None:
+            col = register_column(shape.path, table.header_order, table.header_paths)
+            shape.column = table.header_order.index(col)
+        else:
+            path = self._column_path(shape.path)
+            shape.column = self.column_index(register_column(path, self.header_order, self.header_paths))
+        if self.stats is not None:
+            self.stats.switch(stage)
+        return shape.column
+
+    def _current_filter_plan(self) -> _FilterPlan:
+        assert self.row_filter is not None
+        plan = self._filter_plan
+        if plan is None or plan.size != len(self.header_order):
+            plan = self._filter_plan = _FilterPlan(self.row_filter, self.header_order, self._indexes)
+        return plan
+
+    def _column_path(self, path: PathKey) -> PathKey:
+        if self._strip_outer and len(path) >= 2 and path[1] == path[0]:
+            return path[1:]
+        return path
+
+    def _is_projected_leaf(self, path: PathKey) -> bool:
+        assert self.projection is not None
+        if self.projection.paths is not None:
+            return self._column_path(path) in self.projection.paths
+        tag = path[-1]
+        wanted = self._projected_tags.get(tag)
+        if wanted is None:
+            wanted = self._projected_tags[tag] = self.projection.wants_tag(tag)
+        return wanted
+
+    def _shape(self, group: _ChildGroup, key: Tuple[str, ...]) -> _ShapePlan:
+        shape = group.shapes.get(key)
+        if shape is None:
+            shape = _ShapePlan(group.path, key, self._shape_caches)
+            if len(group.shapes) < MAX_SHAPES_PER_PATH or not key:
+                group.shapes[key] = shape
+            if self.projection is not None:
+                if not key:
+                    if not self._is_projected_leaf(group.path):
+                        shape.column = UNPROJECTED_COLUMN
+                elif self._projected_prefixes is not None:
+                    for child_group in shape.groups:
+                        child_group.projected = self._column_path(child_group.path) in self._projected_prefixes
+        return shape
+
+    def _node(self, elem: ET.Element, group: _ChildGroup, nodes: NodeCache) -> Tuple[List[ET.Element], _ShapePlan]:
+        entry = nodes.get(elem)
+        if entry is None:
+            kids = list(elem)
+            entry = nodes[elem] = (kids, self._shape(group, tuple([kid.tag for kid in kids])))
+        return entry
+
+    def _fill(
+        self,
+        elem: ET.Element,
+        group: _ChildGroup,
+        selection: Selection,
+        nodes: NodeCache,
+        values: List[Optional[str]],
+    ) -> None:
+        kids, shape = self._node(elem, group, nodes)
+        if not kids:
+            idx = shape.column
+            if idx == UNPROJECTED_COLUMN:
+                return
+            text = (elem.text or "").strip()
+            if text:
+                if idx is None:
+                    idx = self._resolve_column(shape)
+                if idx >= len(values):
+                    values.extend([None] * (idx + 1 - len(values)))
+                values[idx] = text
+            return
+        for child_group in shape.groups:
+            if not child_group.projected:
+                continue
+            if child_group.repeating:
+                idx = selection.get(child_group)
+                if idx is None:
+                    continue
+            else:
+                idx = 0
+            self._fill(kids[child_group.positions[idx]], child_group, selection, nodes, values)
+
+    def _count_combinations(self, elem: ET.Element, group: _ChildGroup, nodes: NodeCache) -> int:
+        """
+        Number of rows cartesian expansion produces for elem: the product over its child groups,
+        where a repeating group contributes the sum over its children.
+        """
+        kids, shape = self._node(elem, group, nodes)
+        total = 1
+        for child_group in shape.groups:
+            total *= sum(
+                self._count_combinations(kids[pos], child_group, nodes) for pos in child_group.positions
+            )
+        return total
+
+    def _longest_group(self, elem: ET.Element, group: _ChildGroup, nodes: NodeCache) -> int:
+        """
+        Length of the longest repeating group anywhere under elem (at least 1).
+        """
+        kids, shape = self._node(elem, group, nodes)
+        longest = 1
+        for child_group in shape.groups:
+            longest = max(longest, len(child_group.positions))
+            for pos in child_group.positions:
+                longest = max(longest, self._longest_group(kids[pos], child_group, nodes))
+        return longest
+
+    def _select_index(
+        self, elem: ET.Element, group: _ChildGroup, index: int, selection: Selection, nodes: NodeCache
+    ) -> None:
+        """
+        Select child index in every repeating group reachable from elem that is long enough (zip).
+        """
+        kids, shape = self._node(elem, group, nodes)
+        for child_group in shape.groups:
+            if child_group.repeating:
+                if index >= len(child_group.positions):
+                    continue
+                selection[child_group] = index
+                pos = child_group.positions[index]
+            else:
+                pos = child_group.positions[0]
+            self._select_index(kids[pos], child_group, index, selection, nodes)
+
+    def _check_expansion(self, count: int) -> None:
+        self.element_count += 1
+        self.expanded_count += count
+        limit = self.expansion.max_rows_per_element
+        if limit is not None and count > limit:
+            raise ValueError(
+                f"Row element #{self.element_count} expands to {count} rows, "
+                f"over the per-element limit of {limit} (--max-expansion)"
+            )
+        limit = self.expansion.max_rows_per_file
+        if limit is not None and self.expanded_count > limit:
+            raise ValueError(file_expansion_error(limit))
+
+    def _expand(
+        self,
+        todo: List[Tuple[ET.Element, _ChildGroup]],
+        values: List[Optional[str]],
+        complete: bool,
+        selection: Selection,
+        nodes: NodeCache,
+        plan: Optional[_FilterPlan] = None,
+    ) -> Iterator[Tuple[List[Optional[str]], bool]]:
+        """
+        Walk the elements on todo (a stack, next element on top) in document preorder, writing leaf
+        values and branching at the first element with repeating groups. Yields (values, complete) per
+        row; complete is False when a leaf had no column yet and so could not be written.
+        """
+        while todo:
+            elem, group = todo.pop()
+            if not group.projected:
+                # Writes nothing: continue once per combination instead of branching into it
+                count = self._count_combinations(elem, group, nodes)
+                if count > 1:
+                    for _ in range(count):
+                        yield from self._expand(list(todo), list(values), complete, selection, nodes, plan)
+                    return
+                continue
+            kids, shape = self._node(elem, group, nodes)
+            if not kids:
+                idx = shape.column
+                if idx == UNPROJECTED_COLUMN:
+                    continue
+                text = (elem.text or "").strip()
+                if text:
+                    if idx is None:
+                        complete = False
+                        continue
+                    if plan is not None:
+                        conds = plan.checks.get(idx)
+                        if conds is not None and not all(cond.test(text) for cond in conds):
+                            return
+                    if idx >= len(values):
+                        values.extend([None] * (idx + 1 - len(values)))
+                    values[idx] = text
+                continue
+            if shape.repeating:
+                yield from self._branch(kids, shape, 0, todo, values, complete, selection, nodes, plan)
+                return
+            for child_group in reversed(shape.groups):
+                todo.append((kids[child_group.positions[0]], child_group))
+        if plan is not None:
+            # A column whose conditions need a value was left without one
+            size = len(values)
+            for idx in plan.null_failing:
+                if idx >= size or values[idx] is None:
+                    return
+        yield values, complete
+
+    def _branch(
+        self,
+        kids: List[ET.Element],
+        shape: _ShapePlan,
+        depth: int,
+        todo: List[Tuple[ET.Element, _ChildGroup]],
+        values: List[Optional[str]],
+        complete: bool,
+        selection: Selection,
+        nodes: NodeCache,
+        plan: Optional[_FilterPlan] = None,
+    ) -> Iterator[Tuple[List[Optional[str]], bool]]:
+        """
+        Select every combination of the element's repeating groups (from shape.repeating[depth] on)
+        and continue the walk into the selected children. Each branch starts from a copy of the
+        values collected so far, so only the subtrees the branch selects are walked again.
+        """
+        if depth == len(shape.repeating):
+            branch_todo = list(todo)
+            for child_group in reversed(shape.groups):
+                idx = selection[child_group] if child_group.repeating else 0
+                branch_todo.append((kids[child_group.positions[idx]], child_group))
+            yield from self._expand(branch_todo, list(values), complete, selection, nodes, plan)
+            return
+        group = shape.repeating[depth]
+        # Last child first, as rows have always been emitted in that order
+        for idx in reversed(range(len(group.positions))):
+            selection[group] = idx
+            yield from self._branch(kids, shape, depth + 1, todo, values, complete, selection, nodes, plan)
+        del selection[group]
+
+    def _collect(
+        self,
+        elem: ET.Element,
+        group: _ChildGroup,
+        nodes: NodeCache,
+        values: List[Optional[str]],
+        table: Optional[GroupTable],
+        entries: List[Tuple[ET.Element, _ChildGroup]],
+    ) -> None:
+        """
+        Write the leaves of one normalized record into values, in walk order, and queue the entries
+        of the group tables found under it on entries instead of descending into them.
+        """
+        kids, shape = self._node(elem, group, nodes)
+        if not kids:
+            text = (elem.text or "").strip()
+            if text:
+                idx = shape.column
+                if idx is None:
+                    idx = self._resolve_column(shape, table)
+                if idx >= len(values):
+                    values.extend([None] * (idx + 1 - len(values)))
+                values[idx] = text
+            return
+        assert self.group_tables is not None
+        for child_group in shape.groups:
+            if child_group.repeating or child_group.path in self.group_tables.paths:
+                entries.extend((kids[pos], child_group) for pos in child_group.positions)
+            else:
+                self._collect(kids[child_group.positions[0]], child_group, nodes, values, table, entries)
+
+    def _normalize(self, row_elem: ET.Element, nodes: NodeCache) -> Iterator[Row]:
+        """
+        Yield the row element's own row and append the entries of its nested groups, breadth-first,
+        to their group tables, each keyed to the record it is nested in.
+        """
+        assert self.group_tables is not None
+        entries: List[Tuple[ET.Element, _ChildGroup]] = []
+        values = list(self._seed)
+        if self._id_index >= len(values):
+            values.extend([None] * (self._id_index + 1 - len(values)))
+        self.group_tables.row_count += 1
+        values[self._id_index] = str(self.group_tables.row_count)
+        self._collect(row_elem, self._root, nodes, values, None, entries)
+        yield tuple(values)
+
+        queue = deque((elem, group, values[self._id_index]) for elem, group in entries)
+        while queue:
+            elem, group, parent_id = queue.popleft()
+            table = self.group_tables.table(group.path)
+            table.row_count += 1
+            record_id = str(table.row_count)
+            values = [record_id, parent_id]
+            entries = []
+            self._collect(elem, group, nodes, values, table, entries)
+            table.append(tuple(values))
+            queue.extend((child, child_group, record_id) for child, child_group in entries)
+
+    def _lay_out_seed(self, container_columns: Sequence[Tuple[str, str]]) -> None:
+        if container_columns is self._seed_columns:
+            return
+        # Container columns are the same for every row of a row parent: lay them out once
+        seed: List[Optional[str]] = []
+        for col, value in container_columns:
+            idx = self.column_index(col)
+            if idx >= len(seed):
+                seed.extend([None] * (idx + 1 - len(seed)))
+            seed[idx] = value
+        self._seed = seed
+        self._seed_columns = container_columns
+
+    def _has_unresolved(self, nodes: NodeCache) -> bool:
+        """
+        Whether a non-empty leaf among the walked elements has no column yet.
+        """
+        for elem, (kids, shape) in nodes.items():
+            if not kids and shape.column is None and (elem.text or "").strip():
+                return True
+        return False
+
+    def _rows(
+        self, row_elem: ET.Element, nodes: NodeCache, enforce_limits: bool, filtered: bool = False
+    ) -> Iterator[Row]:
+        if self.expansion.mode == "normalized":
+            if enforce_limits:
+                self._check_expansion(1)
+            yield from self._normalize(row_elem, nodes)
+            return
+
+        if self.expansion.mode == "zip":
+            count = self._longest_group(row_elem, self._root, nodes)
+            if enforce_limits:
+                self._check_expansion(count)
+            for index in range(count):
+                zipped: Selection = {}
+                self._select_index(row_elem, self._root, index, zipped, nodes)
+                values = list(self._seed)
+                self._fill(row_elem, self._root, zipped, nodes, values)
+                if filtered and not self._current_filter_plan().passes(values):
+                    continue
+                yield tuple(values)
+            return
+
+        if enforce_limits or filtered:
+            # Also walks every element of the row into nodes
+            count = self._count_combinations(row_elem, self._root, nodes)
+            if enforce_limits:
+                self._check_expansion(count)
+        plan: Optional[_FilterPlan] = None
+        # Rows are filtered once built when they may register columns (see class docstring)
+        filter_built = filtered and self._has_unresolved(nodes)
+        if filtered and not filter_built:
+            plan = self._current_filter_plan()
+            if not plan.absent_pass or not plan.seed_passes(self._seed):
+                return
+        selection: Selection = {}
+        for values, complete in self._expand([(row_elem, self._root)], list(self._seed), True, selection, nodes, plan):
+            if not complete:
+                # New columns are registered in a full walk of the row, keeping the header in walk order
+                values = list(self._seed)
+                self._fill(row_elem, self._root, selection, nodes, values)
+            if filter_built and not self._current_filter_plan().passes(values):
+                continue
+            yield tuple(values)
+
+    def extract(self, row_elem: ET.Element, container_columns: Sequence[Tuple[str, str]]) -> Iterator[Row]:
+        """
+        Expand nested repeating groups under row_elem (cartesian product), yielding one positional
+        row at a time; rows the row filter rejects are left out.
+        """
+        self._lay_out_seed(container_columns)
+        yield from self._rows(row_elem, {}, True, self.row_filter is not None)
+
+    def _unresolved_leaves(self, elem: ET.Element, group: _ChildGroup, found: List[_ShapePlan]) -> List[_ShapePlan]:
+        """
+        Collect the plans of the non-empty leaves under elem, in any child of any group, whose
+        column is not known yet.
+        """
+        if not len(elem):
+            shape = group.shapes.get(())
+            if (shape is None or shape.column is None) and (elem.text or "").strip():
+                if shape is None:
+                    shape = self._shape(group, ())
+                if shape.column is None:
+                    found.append(shape)
+            return found
+        kids = list(elem)
+        shape = self._shape(group, tuple([kid.tag for kid in kids]))
+        for child_group in shape.groups:
+            if not child_group.projected:
+                continue
+            for pos in child_group.positions:
+                self._unresolved_leaves(kids[pos], child_group, found)
+        return found
+
+    def register(self, row_elem: ET.Element, container_columns: Sequence[Tuple[str, str]]) -> None:
+        """
+        Add the columns row_elem contributes to the header, in the order extract() would, without building its
+        rows. Expansion limits are not enforced, as no rows are produced.
+        """
+        self._lay_out_seed(container_columns)
+        nodes: NodeCache = {}
+        if self.expansion.mode == "normalized":
+            # Linear anyway, and it also creates group tables whose entries have no values
+            for _row in self._rows(row_elem, nodes, False):
+                pass
+            return
+        pending = self._unresolved_leaves(row_elem, self._root, [])
+        if not pending:
+            return
+        for _row in self._rows(row_elem, nodes, False):
+            if all(shape.column is not None for shape in pending):
+                return
+
+
+def extract_rows_for_element(
+    row_elem: ET.Element,
+    row_parent: Optional[ET.Element],
+    row_tag: str,
+    header_order: List[str],
+    header_paths: Dict[str, PathKey],
+    container_columns: Optional[List[Tuple[str, str]]] = None,
+    expansion: ExpansionPolicy = ExpansionPolicy(),
+    row_filter: Optional[RowFilter] = None,
+) -> List[Row]:
+    """
+    Expand nested repeating groups under row_elem into multiple contexts and
+    extract a list of positional rows for CSV writing, leaving out those row_filter rejects.
+    Callers extracting many rows should use one RowExtractor, which keeps its compiled plans.
+    """
+    if container_columns is None:
+        container_values = build_container_values(row_parent, row_tag)
+        container_columns = resolve_container_columns(container_values, row_parent, header_order, header_paths)
+    parent_tag = row_parent.tag if row_parent is not None else None
+    extractor = RowExtractor(parent_tag, row_tag, header_order, header_paths, expansion, row_filter=row_filter)
+    return list(extractor.extract(row_elem, container_columns))
+
+
+# Bytes read per parser feed when scanning or chunking inputs
+SCAN_BLOCK_SIZE = 1 << 20
+
+# Input "-" is standard input; with --stdout the merged CSV goes to standard output
+STDIO_PATH = Path("-")
+
+# Leading bytes of standard input the row element is detected from, unless --detect-bytes is set
+STDIN_DETECT_BYTES = 1 << 20
+
+
+@dataclass
+class RowBoundaries:
+    """
+    Byte layout of the detected row group, used to cut a document into row-aligned chunks.
+    """
+
+    # Start-tag offsets of the root and every ancestor down to the row parent (inclusive)
+    ancestor_offsets: List[int]
+    # Offset of the first row of each chunk
+    chunk_offsets: List[int]
+    # Offset of the row parent's end tag
+    end_offset: int = -1
+
+
+class _OpenElement:
+    __slots__ = ("elem", "offset", "ordinal", "counts", "first_child", "first_offset", "path_id", "kids")
+
+    def __init__(self, elem: ET.Element, offset: int, ordinal: int, path_id: int = -1) -> None:
+        self.elem = elem
+        self.offset = offset
+        # Position of this element among its same-tag siblings (1-based)
+        self.ordinal = ordinal
+        # Child tag -> occurrences so far, in first-appearance order; created with the first child,
+        # as most elements are leaves
+        self.counts: Optional[Dict[str, int]] = None
+        self.first_child: Optional[Dict[str, ET.Element]] = None
+        self.first_offset: Optional[Dict[str, int]] = None
+        # Path and child shape ids, when the scan collects shapes (see ShapeTable)
+        self.path_id = path_id
+        self.kids: Optional[List[int]] = None
+
+
+# Most distinct shapes a scan collects for --list-columns before it gives up and the rows are parsed
+MAX_LISTED_SHAPES = 1 << 16
+
+
+class ShapeTable:
+    """
+    The distinct shapes of the elements a skeleton scan sees, per element path in document order. A
+    shape is the tag tree of an element with its leaves reduced to empty or not, which is all that
+    RowExtractor.register reads, so registering one element per shape lists the columns of them all.
+    """
+
+    def __init__(self) -> None:
+        # (parent path id, tag) -> path id, from -1 for the root, and the tag of each path
+        self.path_ids: Dict[Tuple[int, str], int] = {}
+        self.path_tags: List[str] = []
+        # (path id, child shape ids) or, for a leaf, (path id, has text) -> shape id, in document order
+        self.ids: Dict[Tuple[int, object], int] = {}
+        self.shapes: List[Tuple[int, object]] = []
+        self.overflowed = False
+
+    def add_path(self, parent_id: int, tag: str) -> int:
+        path_id = self.path_ids[parent_id, tag] = len(self.path_tags)
+        self.path_tags.append(tag)
+        return path_id
+
+    def add(self, key: Tuple[int, object]) -> int:
+        shape_id = self.ids[key] = len(self.shapes)
+        self.shapes.append(key)
+        if len(self.shapes) > MAX_LISTED_SHAPES:
+            self.overflowed = True
+        return shape_id
+
+    def elements(self, path: PathKey) -> Optional[List[ET.Element]]:
+        """
+        Return one element per shape found at path, in document order, or None if the scan
+        stopped collecting shapes.
+        """
+        if self.overflowed:
+            return None
+        path_id = -1
+        for tag in path:
+            path_id = self.path_ids.get((path_id, tag), -2)
+        return [self._build(shape_id) for shape_id, (found_id, _) in enumerate(self.shapes) if found_id == path_id]
+
+    def _build(self, shape_id: int) -> ET.Element:
+        # A fresh element per occurrence: RowExtractor caches its plans by element
+        path_id, content = self.shapes[shape_id]
+        elem = ET.Element(self.path_tags[path_id])
+        if isinstance(content, tuple):
+            elem.extend([self._build(kid) for kid in content])
+        elif content:
+            elem.text = "-"
+        return elem
+
+
+class _SkeletonScanner:
+    """
+    expat handlers that build the pruned skeleton described in scan_document and, when
+    chunk_bytes is given, track the row group the way find_row_parent_and_tag will pick it (or the
+    group at row_path, if given) so its chunk boundaries are known by the end of the same pass.
+    """
+
+    def __init__(
+        self,
+        parser: "expat.XMLParserType",
+        chunk_bytes: Optional[int],
+        row_path: Optional[PathKey] = None,
+        shapes: Optional[ShapeTable] = None,
+    ) -> None:
+        self.parser = parser
+        self.builder = ET.TreeBuilder()
+        self.chunk_bytes = chunk_bytes
+        self.row_path = row_path
+        self.stack: List[_OpenElement] = []
+        self.winner: Optional[_OpenElement] = None
+        self.winner_tag = ""
+        self.boundaries: Optional[RowBoundaries] = None
+        # Path of every element that repeats under some parent
+        self.repeating_paths: Set[PathKey] = set()
+        self.shapes = shapes
+
+    def start(self, name: str, _attrs: Dict[str, str]) -> None:
+        tag = "{" + name if "}" in name else name
+        # Attributes never contribute to the output, so the skeleton does not keep them
+        elem = self.builder.start(tag, {})
+        offset = self.parser.CurrentByteIndex
+        ordinal = 1
+        path_id = -1
+        if self.shapes is not None:
+            parent_id = self.stack[-1].path_id if self.stack else -1
+            path_id = self.shapes.path_ids.get((parent_id, tag), -1)
+            if path_id < 0:
+                path_id = self.shapes.add_path(parent_id, tag)
+        if self.stack:
+            parent = self.stack[-1]
+            counts = parent.counts
+            if counts is None:
+                counts = parent.counts = {}
+                parent.first_child = {}
+                parent.first_offset = {}
+            ordinal = counts.get(tag, 0) + 1
+            counts[tag] = ordinal
+            if ordinal == 2:
+                self.repeating_paths.add(tuple([entry.elem.tag for entry in self.stack]) + (tag,))
+            if self.chunk_bytes is not None:
+                if ordinal == 1:
+                    parent.first_offset[tag] = offset
+                else:
+                    self._track_rows(parent, tag, ordinal, offset)
+        self.stack.append(_OpenElement(elem, offset, ordinal, path_id))
+
+    def end(self, _name: str) -> None:
+        entry = self.stack.pop()
+        elem = self.builder.end(entry.elem.tag)
+        if entry is self.winner and self.boundaries is not None:
+            self.boundaries.end_offset = self.parser.CurrentByteIndex
+        shapes = self.shapes
+        if shapes is not None:
+            if shapes.overflowed:
+                self.shapes = None
+            else:
+                # Recorded before the pruning below, which only touches the skeleton
+                kids = entry.kids
+                key = (entry.path_id, tuple(kids) if kids is not None else bool(elem.text and elem.text.strip()))
+                shape_id = shapes.ids.get(key)
+                if shape_id is None:
+                    shape_id = shapes.add(key)
+                if self.stack:
+                    parent_entry = self.stack[-1]
+                    if parent_entry.kids is None:
+                        parent_entry.kids = [shape_id]
+                    else:
+                        parent_entry.kids.append(shape_id)
+        if not self.stack:
+            return
+        parent = self.stack[-1]
+        if entry.ordinal == 1:
+            parent.first_child[elem.tag] = elem
+        elif entry.ordinal == 2:
+            # The tag repeats: keep two empty placeholders so the group still reads as repeating
+            parent.first_child.pop(elem.tag).clear()
+            elem.clear()
+        else:
+            del parent.elem[-1]
+
+    def _track_rows(self, parent: _OpenElement, tag: str, ordinal: int, offset: int) -> None:
+        assert self.chunk_bytes is not None
+        boundaries = self.boundaries
+        if boundaries is not None and parent is self.winner and tag == self.winner_tag:
+            if offset - boundaries.chunk_offsets[-1] >= self.chunk_bytes:
+                boundaries.chunk_offsets.append(offset)
+            return
+        if ordinal != 2:
+            return
+
+        if self.row_path is not None:
+            # The first group at the given path is the row group; its parent's later namesakes are not
+            if boundaries is not None or tag != self.row_path[-1] or len(self.stack) != len(self.row_path) - 1:
+                return
+            if tuple([entry.elem.tag for entry in self.stack]) != self.row_path[:-1]:
+                return
+            self._start_rows(parent, tag, offset)
+            return
+
+        # A new repeating group: it becomes the row group if breadth-first detection would prefer it,
+        # i.e. it is shallower, or it is under the same parent and its tag appeared first
+        depth = len(self.stack) - 1
+        if boundaries is not None:
+            winner_depth = len(boundaries.ancestor_offsets) - 1
+            if depth > winner_depth:
+                return
+            if depth == winner_depth:
+                if parent is not self.winner:
+                    return
+                tags = list(parent.counts)
+                if tags.index(tag) > tags.index(self.winner_tag):
+                    return
+        self._start_rows(parent, tag, offset)
+
+    def _start_rows(self, parent: _OpenElement, tag: str, offset: int) -> None:
+        assert self.chunk_bytes is not None
+        first = parent.first_offset[tag]
+        self.winner = parent
+        self.winner_tag = tag
+        self.boundaries = RowBoundaries([entry.offset for entry in self.stack], [first])
+        if offset - first >= self.chunk_bytes:
+            self.boundaries.chunk_offsets.append(offset)
+
+
+def scan_document(
+    input_path: Path,
+    chunk_bytes: Optional[int] = None,
+    row_path: Optional[PathKey] = None,
+    stats: Optional[ConversionStats] = None,
+    shapes: Optional[ShapeTable] = None,
+) -> Tuple[ET.Element, Optional[_SkeletonScanner]]:
+    """
+    Stream the document once with expat and return its skeleton, the root with every repeating group
+    pruned to two empty placeholders; with chunk_bytes, the scanner also carries the row boundaries.
+    The shape of every element is collected into shapes, if given.
+    """
+    parser = expat.ParserCreate(namespace_separator="}")
+    parser.buffer_text = True
+    scanner = _SkeletonScanner(parser, chunk_bytes, row_path, shapes)
+    parser.StartElementHandler = scanner.start
+    parser.EndElementHandler = scanner.end
+    parser.CharacterDataHandler = scanner.builder.data
+    with open_input(input_path) as f:
+        while True:
+            block = f.read(SCAN_BLOCK_SIZE)
+            parser.Parse(block, not block)
+            if not block:
+                break
+            if stats is not None:
+                stats.bytes_read += len(block)
+    return scanner.builder.close(), scanner
+
+
+def element_path(root: ET.Element, target: ET.Element) -> PathKey:
+    """
+    Return the tag path from root down to target (inclusive).
+    """
+    stack: List[Tuple[ET.Element, PathKey]] = [(root, (root.tag,))]
+    while stack:
+        node, path = stack.pop()
+        if node is target:
+            return path
+        for child in node:
+            stack.append((child, path + (child.tag,)))
+    raise ValueError(f"<{target.tag}> is not part of the tree rooted at <{root.tag}>")
+
+
+def iter_rows_from_events(
+    events: Iterable[Tuple[str, ET.Element]],
+    row_path: PathKey,
+    row_parent: Optional[ET.Element],
+    row_tag: str,
+    header_order: List[str],
+    header_paths: Dict[str, PathKey],
+    expansion: ExpansionPolicy = ExpansionPolicy(),
+    group_tables: Optional[GroupTables] = None,
+    schema_only: bool = False,
+    projection: Optional[ColumnProjection] = None,
+    row_filter: Optional[RowFilter] = None,
+    stats: Optional[ConversionStats] = None,
+    on_late_fields: Optional[Callable[[List[str]], None]] = None,
+) -> Iterator[Row]:
+    """
+    Extract rows from (start/end, element) parse events, expanding each element at row_path when it
+    ends and then clearing it. Without row_parent, container values come from the fields that
+    precede the first row, and on_late_fields is called with the columns of any that follow it.
+    """
+    # The stage of whoever pulls the rows, resumed while a row is handed over
+    outer = stats.switch("parse") if stats is not None else None
+    columns_before = len(header_order)
+    row_depth = len(row_path) - 1
+    container_values = build_container_values(row_parent, row_tag)
+    # Container columns are registered when the first row is extracted, as they lead every row
+    container_columns: Optional[List[Tuple[str, str]]] = None
+    # Take container values from the stream itself (see docstring)
+    from_stream = row_parent is None and row_depth > 0
+    # Tags of the row parent's non-empty leaves that follow its first row, in document order
+    late_tags: Dict[str, None] = {}
+    extractor = RowExtractor(
+        row_path[-2] if row_depth else None,
+        row_tag,
+        header_order,
+        header_paths,
+        expansion,
+        group_tables,
+        projection,
+        row_filter,
+        stats,
+    )
+    stack: List[ET.Element] = []
+    # Number of leading stack entries whose tags match row_path, and the most there ever were
+    matched = 0
+    deepest = 0
+    root_tag: Optional[str] = None
+    for event, elem in events:
+        if event == "start":
+            depth = len(stack)
+            if not depth and root_tag is None:
+                root_tag = elem.tag
+            if matched == depth and depth <= row_depth and elem.tag == row_path[depth]:
+                matched += 1
+                deepest = max(deepest, matched)
+                if from_stream and depth == row_depth and stack[-1] is not row_parent:
+                    # First row under this parent: everything before it is the container context
+                    row_parent = stack[-1]
+                    preceding = ET.Element(row_parent.tag)
+                    count = 0
+                    for child in row_parent:
+                        if child is elem:
+                            break
+                        preceding.append(child)
+                        count += 1
+                    del row_parent[:count]
+                    container_values = build_container_values(preceding, row_tag)
+                    container_columns = None
+            stack.append(elem)
+            continue
+
+        stack.pop()
+        depth = len(stack)
+        if depth > row_depth and matched > row_depth:
+            # Inside a row: kept until the row itself closes
+            continue
+        if matched > depth:
+            # A row, or one of its ancestors closing
+            matched = depth
+            if depth == row_depth:
+                if container_columns is None:
+                    if stats is not None:
+                        stats.switch("containers")
+                    container_columns = resolve_container_columns(
+                        container_values, row_parent, header_order, header_paths
+                    )
+                if stats is not None:
+                    stats.switch("expand")
+                if schema_only:
+                    extractor.register(elem, container_columns)
+                elif stats is None:
+                    yield from extractor.extract(elem, container_columns)
+                else:
+                    for row in extractor.extract(elem, container_columns):
+                        stats.rows += 1
+                        stats.switch(outer)
+                        yield row
+                        outer = stats.switch("expand")
+                if stats is not None:
+                    stats.switch("parse")
+        elif from_stream and matched == row_depth and depth >= row_depth and stack[row_depth - 1] is not row_parent:
+            # Content of a row parent whose first row has not started yet: kept for its container values
+            continue
+        elif from_stream and depth >= row_depth and stack[row_depth - 1] is row_parent and not len(elem):
+            if elem.text and elem.text.strip():
+                late_tags[elem.tag] = None
+
+        # Anything that is not part of an open row is no longer needed
+        elem.clear()
+        if stack:
+            stack[-1].remove(elem)
+
+    if deepest <= row_depth and root_tag is not None:
+        # A mistyped --row-path or a schema from another kind of document: fail rather than write nothing
+        if not deepest:
+            raise ValueError(
+                f"The row path {format_row_path(row_path)} does not match the document, whose root is <{root_tag}>"
+            )
+        raise ValueError(
+            f"No element matches the row path {format_row_path(row_path)}; "
+            f"the document has no <{row_path[deepest]}> under {format_row_path(row_path[:deepest])}"
+        )
+    if late_tags and on_late_fields is not None:
+        container_names = {
+            header_paths[col][1]: col
+            for col in header_order
+            if len(header_paths[col]) == 2 and header_paths[col][0] == row_path[-2]
+        }
+        on_late_fields([container_names.get(tag, tag) for tag in late_tags])
+    if stats is not None:
+        stats.row_elements += extractor.element_count
+        stats.expanded += extractor.expanded_count
+        stats.columns += len(header_order) - columns_before
+        stats.switch(outer)
+
+
+def iter_table_rows(
+    input_path: Union[Path, IO[bytes]],
+    header_order: List[str],
+    header_paths: Dict[str, PathKey],
+    detect_bytes: Optional[int] = None,
+    expansion: ExpansionPolicy = ExpansionPolicy(),
+    group_tables: Optional[GroupTables] = None,
+    schema_only: bool = False,
+    row_path: Optional[PathKey] = None,
+    on_row_path: Optional[Callable[[PathKey], None]] = None,
+    projection: Optional[ColumnProjection] = None,
+    row_filter: Optional[RowFilter] = None,
+    stats: Optional[ConversionStats] = None,
+    on_late_fields: Optional[Callable[[List[str]], None]] = None,
+) -> Iterator[Row]:
+    """
+    Stream rows from one input, adding new columns to header_order and header_paths as they appear.
+    The input is read twice (skeleton scan, then iterparse) unless the row path is given or detected
+    from detect_bytes, which needs one pass; standard input and a streamed archive member (see
+    MemberSpools) always take the single pass.
+    """
+    if not isinstance(input_path, Path) or input_path == STDIO_PATH:
+        name = "standard input" if input_path == STDIO_PATH else "the archive member"
+        if group_tables is not None:
+            raise ValueError(f"normalized output scans the document twice and cannot read {name}")
+        yield from iter_stream_rows(
+            sys.stdin.buffer if input_path == STDIO_PATH else input_path,
+            header_order,
+            header_paths,
+            detect_bytes,
+            expansion,
+            schema_only,
+            row_path,
+            on_row_path,
+            name,
+            projection,
+            row_filter,
+            stats,
+            on_late_fields,
+        )
+        return
+
+    outer = stats.switch("detect") if stats is not None else None
+    if row_path is None and detect_bytes is not None and group_tables is None:
+        row_path = detect_row_path(input_path, detect_bytes, stats)
+    if row_path is not None and group_tables is None:
+        if stats is not None:
+            stats.switch(outer)
+        if on_row_path is not None:
+            on_row_path(row_path)
+        with open_input(input_path) as f:
+            events = ET.iterparse(f if stats is None else _CountingReader(f, stats), events=("start", "end"))
+            yield from iter_rows_from_events(
+                events,
+                row_path,
+                None,
+                row_path[-1],
+                header_order,
+                header_paths,
+                expansion,
+                None,
+                schema_only,
+                projection,
+                row_filter,
+                stats,
+                on_late_fields,
+            )
+        return
+
+    # Listing columns registers one row per shape straight from the scan, without parsing the rows
+    shapes = ShapeTable() if schema_only and group_tables is None else None
+    skeleton, scanner = scan_document(input_path, stats=stats, shapes=shapes)
+    if row_path is not None:
+        # Normalized mode only scans for its group paths: container values come from the stream
+        row_parent, row_tag = None, row_path[-1]
+    else:
+        row_parent, row_tag, _ = find_row_parent_and_tag(skeleton)
+        if row_parent is None:
+            # No repeating group: the whole document is a single row
+            row_path = (skeleton.tag,)
+        else:
+            row_path = element_path(skeleton, row_parent) + (row_tag,)
+    if on_row_path is not None:
+        on_row_path(row_path)
+    if group_tables is not None and scanner is not None:
+        # Group paths as the extractor sees them, starting at the row tag
+        row_depth = len(row_path) - 1
+        group_tables.paths = {
+            path[row_depth:]
+            for path in scanner.repeating_paths
+            if len(path) > len(row_path) and path[: len(row_path)] == row_path
+        }
+    if stats is not None:
+        stats.switch(outer)
+
+    row_shapes = shapes.elements(row_path) if shapes is not None else None
+    if row_shapes:
+        if stats is not None:
+            stats.switch("expand")
+        container_columns = resolve_container_columns(
+            build_container_values(row_parent, row_tag), row_parent, header_order, header_paths
+        )
+        extractor = RowExtractor(
+            row_path[-2] if len(row_path) > 1 else None, row_tag, header_order, header_paths, expansion
+        )
+        for row_elem in row_shapes:
+            extractor.register(row_elem, container_columns)
+        if stats is not None:
+            stats.switch(outer)
+        return
+
+    with open_input(input_path) as f:
+        events = ET.iterparse(f if stats is None else _CountingReader(f, stats), events=("start", "end"))
+        yield from iter_rows_from_events(
+            events,
+            row_path,
+            row_parent,
+            row_tag,
+            header_order,
+            header_paths,
+            expansion,
+            group_tables,
+            schema_only,
+            projection,
+            row_filter,
+            stats,
+        )
+
+
+def iter_stream_rows(
+    stream: IO[bytes],
+    header_order: List[str],
+    header_paths: Dict[str, PathKey],
+    detect_bytes: Optional[int] = None,
+    expansion: ExpansionPolicy = ExpansionPolicy(),
+    schema_only: bool = False,
+    row_path: Optional[PathKey] = None,
+    on_row_path: Optional[Callable[[PathKey], None]] = None,
+    name: str = "the stream",
+    projection: Optional[ColumnProjection] = None,
+    row_filter: Optional[RowFilter] = None,
+    stats: Optional[ConversionStats] = None,
+    on_late_fields: Optional[Callable[[List[str]], None]] = None,
+) -> Iterator[Row]:
+    """
+    Stream rows from a binary stream that can only be read once, in a single pass: the row element is
+    detected from its first detect_bytes (default STDIN_DETECT_BYTES) unless row_path is given, and that
+    prefix is then fed to the parser ahead of the rest. name is used in errors.
+    """
+    if stats is not None:
+        stream = _CountingReader(stream, stats)  # type: ignore[assignment]
+    prefix = b""
+    row_parent: Optional[ET.Element] = None
+    if row_path is None:
+        outer = stats.switch("detect") if stats is not None else None
+        limit = detect_bytes if detect_bytes is not None else STDIN_DETECT_BYTES
+        prefix = stream.read(limit)
+        if len(prefix) < limit:
+            root = ET.fromstring(prefix)
+            row_parent, row_tag, _ = find_row_parent_and_tag(root)
+            row_path = (root.tag,) if row_parent is None else element_path(root, row_parent) + (row_tag,)
+        else:
+            row_path = detect_prefix_row_path(prefix)
+        if row_path is None:
+            raise ValueError(
+                f"no repeating element in the first {limit} bytes of {name}; raise --detect-bytes or pass --schema-in"
+            )
+        if stats is not None:
+            stats.switch(outer)
+    if on_row_path is not None:
+        on_row_path(row_path)
+    # read1 returns what a pipe has delivered instead of waiting for a full block
+    read = getattr(stream, "read1", stream.read)
+    events = iter_feed_events(chain([prefix], iter(lambda: read(SCAN_BLOCK_SIZE), b"")))
+    yield from iter_rows_from_events(
+        events,
+        row_path,
+        row_parent,
+        row_path[-1],
+        header_order,
+        header_paths,
+        expansion,
+        None,
+        schema_only,
+        projection,
+        row_filter,
+        stats,
+        on_late_fields,
+    )
+
+
+# Raw start tag: name, then attributes whose quoted values may themselves contain ">"
+_START_TAG_RE = re.compile(rb"<([^\s/>]+)(?:\"[^\"]*\"|'[^']*'|[^\"'>])*>")
+
+
+@dataclass(frozen=True)
+class RowChunk:
+    """
+    A row-aligned byte range of one input plus what a worker needs to parse it on its own: the
+    document prologue and ancestor start tags before it, the matching end tags after it, and the
+    container element (from the skeleton) that supplies ancestor values.
+    """
+
+    input_path: Path
+    start: int
+    end: int
+    prefix: bytes
+    suffix: bytes
+    row_path: PathKey
+    row_parent: ET.Element
+    row_tag: str
+    # The scan that planned the chunks, carried by the first one so --stats charges it to the input
+    scan_stats: Optional[ConversionStats] = None
+
+
+def plan_row_chunks(
+    input_path: Path,
+    chunk_bytes: int,
+    row_path: Optional[PathKey] = None,
+    stats: Optional[ConversionStats] = None,
+) -> Optional[List[RowChunk]]:
+    """
+    Split input_path into chunks of roughly chunk_bytes that each start and end on row boundaries.
+    Returns None when there is no repeating group to split on, or the rows have several parents.
+    """
+    if stats is not None:
+        stats.switch("detect")
+    skeleton, scanner = scan_document(input_path, chunk_bytes, row_path, stats)
+    if stats is not None:
+        stats.switch(None)
+    assert scanner is not None
+    boundaries = scanner.boundaries
+    if row_path is not None:
+        if (
+            boundaries is None
+            or scanner.winner is None
+            or any(row_path[:end] in scanner.repeating_paths for end in range(2, len(row_path)))
+        ):
+            return None
+        row_parent: Optional[ET.Element] = scanner.winner.elem
+        row_tag = row_path[-1]
+    else:
+        row_parent, row_tag, _ = find_row_parent_and_tag(skeleton)
+        if (
+            row_parent is None
+            or boundaries is None
+            or scanner.winner is None
+            or scanner.winner.elem is not row_parent
+            or scanner.winner_tag != row_tag
+        ):
+            return None
+        row_path = element_path(skeleton, row_parent) + (row_tag,)
+    assert row_parent is not None
+
+    # Everything before the root (XML declaration, DOCTYPE) plus the raw start tags of the row
+    # parent and its ancestors, so namespace declarations, entities and encoding carry over
+    start_tags: List[bytes] = []
+    end_tags: List[bytes] = []
+    with input_path.open("rb") as f:
+        prefix = f.read(boundaries.ancestor_offsets[0])
+        for offset in boundaries.ancestor_offsets:
+            f.seek(offset)
+            buf = b""
+            while True:
+                block = f.read(4096)
+                buf += block
+                match = _START_TAG_RE.match(buf)
+                if match is not None or not block:
+                    break
+            if match is None:
+                raise ValueError(f"Could not read the start tag at byte {offset} of {input_path}")
+            start_tags.append(match.group(0))
+            end_tags.append(b"</" + match.group(1) + b">")
+    prefix += b"".join(start_tags)
+    suffix = b"".join(reversed(end_tags))
+
+    offsets = boundaries.chunk_offsets + [boundaries.end_offset]
+    return [
+        RowChunk(
+            input_path, start, end, prefix, suffix, row_path, row_parent, row_tag, stats if start == offsets[0] else None
+        )
+        for start, end in zip(offsets, offsets[1:])
+    ]
+
+
+def iter_feed_events(blocks: Iterable[bytes]) -> Iterator[Tuple[str, ET.Element]]:
+    """
+    Parse a document fed in blocks, yielding iterparse-style events as each block is parsed.
+    """
+    parser = ET.XMLPullParser(events=("start", "end"))
+    for block in blocks:
+        parser.feed(block)
+        yield from parser.read_events()
+    parser.close()
+    yield from parser.read_events()
+
+
+def iter_chunk_events(chunk: RowChunk) -> Iterator[Tuple[str, ET.Element]]:
+    """
+    Parse a chunk wrapped in its prefix and suffix, yielding iterparse-style events.
+    """
+    parser = ET.XMLPullParser(events=("start", "end"))
+    parser.feed(chunk.prefix)
+    with chunk.input_path.open("rb") as f:
+        f.seek(chunk.start)
+        remaining = chunk.end - chunk.start
+        while remaining > 0:
+            block = f.read(min(SCAN_BLOCK_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            parser.feed(block)
+            yield from parser.read_events()
+    parser.feed(chunk.suffix)
+    parser.close()
+    yield from parser.read_events()
+
+
+def convert_xml_to_csv(
+    input_path: Path,
+    output_dir: Optional[Path],
+    encoding: str,
+    delimiter: str,
+    selected_columns: Optional[List[str]] = None,
+) -> Path:
+    header_order: List[str] = []
+    header_paths: Dict[str, PathKey] = {}
+    table_rows = list(extract_table_from_file(input_path, header_order, header_paths))
+
+    # Compute output path
+    stem = output_stem(input_path, output_dir)
+    out_path = stem.with_name(stem.name + ".csv")
+
+    columns_to_write, missing = choose_columns_to_write(selected_columns, header_order)
+    if missing:
+        print(f"Warning: skipping unknown columns for {input_path.name}: {', '.join(missing)}")
+    write_csv(out_path, columns_to_write, iter_row_records(table_rows, header_order, columns_to_write), encoding, delimiter)
+
+    return out_path
+
+
+def extract_table_from_file(
+    input_path: Path,
+    header_order: List[str],
+    header_paths: Dict[str, PathKey],
+    detect_bytes: Optional[int] = None,
+    expansion: ExpansionPolicy = ExpansionPolicy(),
+    group_tables: Optional[GroupTables] = None,
+) -> Iterator[Row]:
+    """
+    Parse a single XML file and yield its rows as they are extracted, updating the provided header_order
+    and header_paths so that column naming is consistent across multiple files when merging. The header
+    is complete once the rows have been consumed.
+    """
+    yield from iter_table_rows(input_path, header_order, header_paths, detect_bytes, expansion, group_tables)
+
+
+class RowSpool:
+    """
+    Temporary on-disk store for rows extracted while the header is still growing. Rows are stored
+    positionally and padded out to the final header when read back.
+    """
+
+    def __init__(self, header_order: List[str], spill_dir: Optional[Path] = None, keep_file: bool = False) -> None:
+        self.header_order = header_order
+        self.row_count = 0
+        self._positions: Dict[str, int] = {}
+        self._keep_file = keep_file
+        temp_dir = str(spill_dir) if spill_dir is not None else None
+        if keep_file:
+            # Named and not deleted on close, so another process can read it back (see detach())
+            self._file = tempfile.NamedTemporaryFile(
+                "w+", encoding="utf-8", newline="", dir=temp_dir, suffix=".spill", delete=False
+            )
+        else:
+            self._file = tempfile.TemporaryFile("w+", encoding="utf-8", newline="", dir=temp_dir)
+        self._writer = csv.writer(self._file)
+
+    def _sync_positions(self) -> Dict[str, int]:
+        positions = self._positions
+        for idx in range(len(positions), len(self.header_order)):
+            positions[self.header_order[idx]] = idx
+        return positions
+
+    def append(self, row: Row) -> None:
+        self._writer.writerow(row)
+        self.row_count += 1
+
+    def extend(self, rows: Iterable[Row]) -> None:
+        writerow = self._writer.writerow
+        count = 0
+        try:
+            for row in rows:
+                writerow(row)
+                count += 1
+        finally:
+            self.row_count += count
+
+    def mark(self) -> Tuple[int, int]:
+        """
+        Return a position that rollback() can later truncate the spool back to.
+        """
+        return self._file.tell(), self.row_count
+
+    def rollback(self, mark: Tuple[int, int]) -> None:
+        offset, self.row_count = mark
+        self._file.seek(offset)
+        self._file.truncate()
+
+    def iter_records(self, columns: Sequence[str]) -> Iterator[List[str]]:
+        """
+        Yield every spilled row as a list of values for the given columns.
+        """
+        known = self._sync_positions()
+        positions = [known[col] for col in columns]
+        self._file.flush()
+        self._file.seek(0)
+        for record in csv.reader(self._file):
+            size = len(record)
+            yield [record[idx] if idx < size else "" for idx in positions]
+        self._file.seek(0, 2)
+
+    def detach(self) -> Path:
+        """
+        Close a keep_file spool and return the path of its positional records.
+        """
+        self._file.close()
+        return Path(self._file.name)
+
+    def close(self) -> None:
+        self._file.close()
+        if self._keep_file:
+            Path(self._file.name).unlink(missing_ok=True)
+
+
+class GroupTable:
+    """
+    The entries of one nested repeating group in normalized output. Each row is keyed by _id and
+    points at the record it is nested in (a row, or an entry of an enclosing group) by _parent_id.
+    """
+
+    def __init__(
+        self, path: PathKey, spill: bool = False, spill_dir: Optional[Path] = None, keep_rows: bool = True
+    ) -> None:
+        self.path = path
+        self.keep_rows = keep_rows
+        self.header_order: List[str] = []
+        self.header_paths: Dict[str, PathKey] = {}
+        register_column((ID_COLUMN,), self.header_order, self.header_paths)
+        register_column((PARENT_ID_COLUMN,), self.header_order, self.header_paths)
+        self.row_count = 0
+        self.rows: List[Row] = []
+        self.spool = RowSpool(self.header_order, spill_dir) if spill else None
+
+    @property
+    def name(self) -> str:
+        """
+        The group's path below the row element, e.g. "lines.line".
+        """
+        return ".".join(self.path[1:])
+
+    def append(self, row: Row) -> None:
+        if not self.keep_rows:
+            return
+        if self.spool is not None:
+            self.spool.append(row)
+        else:
+            self.rows.append(row)
+
+    def iter_records(self, columns: Sequence[str]) -> Iterator[Sequence[Optional[str]]]:
+        if self.spool is not None:
+            return self.spool.iter_records(columns)
+        return iter_row_records(self.rows, self.header_order, columns)
+
+    def close(self) -> None:
+        self.rows = []
+        if self.spool is not None:
+            self.spool.close()
+
+
+class GroupTables:
+    """
+    The group tables of one input in normalized mode (--expand normalized), in first-seen order. paths holds
+    every group path (starting at the row tag) that repeats anywhere in the document.
+    """
+
+    def __init__(self, spill: bool = False, spill_dir: Optional[Path] = None, keep_rows: bool = True) -> None:
+        self.spill = spill
+        self.spill_dir = spill_dir
+        # False when only the headers are wanted (--list-columns)
+        self.keep_rows = keep_rows
+        self.paths: Set[PathKey] = set()
+        self.tables: Dict[PathKey, GroupTable] = {}
+        # Rows of the row table, which numbers their _id
+        self.row_count = 0
+
+    def table(self, path: PathKey) -> GroupTable:
+        table = self.tables.get(path)
+        if table is None:
+            table = self.tables[path] = GroupTable(path, self.spill, self.spill_dir, self.keep_rows)
+        return table
+
+    def close(self) -> None:
+        for table in self.tables.values():
+            table.close()
+
+
+def iter_row_records(rows: Iterable[Row], header_order: Sequence[str], columns: Sequence[str]) -> Iterator[Row]:
+    """
+    Yield positional rows as records of the given columns, a subset of header_order, padding short rows.
+    Positions are fixed when iteration starts; columns the header gains after that are left out.
+    """
+    index = {col: idx for idx, col in enumerate(header_order)}
+    positions = [index[col] for col in columns]
+    width = len(header_order)
+    pad: Row = (None,) * width
+    if positions == list(range(width)):
+        for row in rows:
+            size = len(row)
+            if size < width:
+                row = row + pad[size:]
+            elif size > width:
+                # Columns beyond a schema, left out of the output
+                row = row[:width]
+            yield row
+        return
+    if len(positions) <= 1:
+        for row in rows:
+            yield tuple([row[idx] if idx < len(row) else None for idx in positions])
+        return
+    pick = itemgetter(*positions)
+    width = max(positions) + 1
+    for row in rows:
+        size = len(row)
+        yield pick(row if size >= width else row + pad[size:width])
+
+
+def choose_columns_to_write(
+    selected_columns: Optional[List[str]],
+    header_order: List[str],
+) -> Tuple[List[str], List[str]]:
+    """
+    Return (columns, missing): the selected columns that exist in header_order (in requested
+    order) or the full header when no selection was given, plus the selected names that are unknown.
+    """
+    if not selected_columns:
+        return header_order, []
+    present = [c for c in selected_columns if c in header_order]
+    missing = [c for c in selected_columns if c not in header_order]
+    return present, missing
+
+
+COMPRESS_METHODS = ("gzip", "bz2", "xz")
+
+# Buffer between the CSV writer and the compressor, and between the compressor and the file
+OUTPUT_BUFFER_SIZE = 1 << 20
+
+
+@dataclass(frozen=True)
+class OutputCompression:
+    """
+    Streaming compression of CSV outputs (--compress). level is the method's compression level
+    (gzip and xz 0-9, bz2 1-9); None means 6 for gzip and xz, 9 for bz2.
+    """
+
+    method: str
+    level: Optional[int] = None
+
+    @property
+    def suffix(self) -> str:
+        return {"gzip": ".gz", "bz2": ".bz2", "xz": ".xz"}[self.method]
+
+    def wrap(self, raw: IO[bytes]) -> IO[bytes]:
+        """
+        Return a compressor writing one complete stream to raw; closing it leaves raw open.
+        """
+        if self.method == "gzip":
+            return gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6 if self.level is None else self.level)
+        if self.method == "bz2":
+            return bz2.BZ2File(raw, "wb", compresslevel=9 if self.level is None else self.level)
+        return lzma.LZMAFile(raw, "wb", preset=self.level)
+
+
+def bomless_encoding(encoding: str) -> str:
+    """
+    Return the codec that continues text written in encoding without writing a second byte order
+    mark (e.g. utf-8 for utf-8-sig).
+    """
+    name = codecs.lookup(encoding).name
+    if name == "utf-8-sig":
+        return "utf-8"
+    if name in ("utf-16", "utf-32"):
+        return f"{name}-{'le' if sys.byteorder == 'little' else 'be'}"
+    return encoding
+
+
+@contextmanager
+def open_csv_segment(
+    raw: IO[bytes], encoding: str, compression: Optional[OutputCompression] = None
+) -> Iterator[IO[str]]:
+    """
+    Open a text stream that appends to raw, through a compressor if one is given, and leave raw open when it
+    is closed. Concatenated compressed segments decompress as one file, so one can be cut off again alone.
+    """
+    if compression is None:
+        text = io.TextIOWrapper(raw, encoding=encoding, newline="")
+        try:
+            yield text
+        finally:
+            text.flush()
+            text.detach()
+        return
+    buffered = io.BufferedWriter(compression.wrap(raw), OUTPUT_BUFFER_SIZE)  # type: ignore[arg-type]
+    with io.TextIOWrapper(buffered, encoding=encoding, newline="") as text:
+        yield text
+
+
+@contextmanager
+def open_raw_output(path: Path, stats: Optional[ConversionStats] = None) -> Iterator[IO[bytes]]:
+    """
+    Open an output file for binary writing; STDIO_PATH is standard output, which is flushed but
+    left open. stats, if given, is credited with the bytes the output holds once it is closed.
+    """
+    if path != STDIO_PATH:
+        with path.open("wb", buffering=OUTPUT_BUFFER_SIZE) as raw:
+            yield raw
+        if stats is not None:
+            stats.bytes_written += path.stat().st_size
+        return
+    # main() points sys.stdout at stderr for messages while the CSV owns the real stdout
+    raw = sys.__stdout__.buffer
+    start = raw.tell() if stats is not None and raw.seekable() else None
+    try:
+        if stats is not None and start is None:
+            # A pipe: count the bytes as they go through
+            yield _CountingWriter(raw, stats)  # type: ignore[misc]
+        else:
+            yield raw
+    finally:
+        raw.flush()
+    if start is not None:
+        assert stats is not None
+        stats.bytes_written += raw.tell() - start
+
+
+@contextmanager
+def open_output(
+    path: Path,
+    encoding: str,
+    compression: Optional[OutputCompression] = None,
+    stats: Optional[ConversionStats] = None,
+) -> Iterator[IO[str]]:
+    """
+    Open an output CSV for writing text, compressing it as it is written if compression is given.
+    """
+    if compression is None and path != STDIO_PATH:
+        with path.open("w", encoding=encoding, newline="") as f:
+            yield f
+        if stats is not None:
+            stats.bytes_written += path.stat().st_size
+        return
+    with open_raw_output(path, stats) as raw, open_csv_segment(raw, encoding, compression) as f:
+        yield f
+
+
+def write_csv(
+    out_path: Path,
+    columns: Sequence[str],
+    records: Iterable[Sequence[str]],
+    encoding: str,
+    delimiter: str,
+    compression: Optional[OutputCompression] = None,
+    stats: Optional[ConversionStats] = None,
+) -> None:
+    """
+    Write a CSV; with stats, the time spent writing (not pulling records) is charged to its write
+    stage and the bytes written are counted.
+    """
+    outer = stats.switch("write") if stats is not None else None
+    with open_output(out_path, encoding, compression, stats) as f:
+        writer = csv.writer(f, delimiter=delimiter)
+        writer.writerow(columns)
+        writer.writerows(records)
+    if stats is not None:
+        stats.switch(outer)
+
+
+def normalize_selected_columns(select_columns_args: Optional[List[str]]) -> Optional[List[str]]:
+    if not select_columns_args:
+        return None
+    selected: List[str] = []
+    for part in select_columns_args:
+        if not part:
+            continue
+        selected.extend([c.strip() for c in part.split(",") if c.strip()])
+    return selected or None
+
+
+# Format version written to and accepted in schema files
+SCHEMA_VERSION = 1
+
+
+@dataclass
+class TableSchema:
+    """
+    The row element path and resolved header of a feed, saved with --schema-out and loaded with
+    --schema-in so later runs can skip row detection and write rows as soon as they are extracted.
+    """
+
+    row_path: PathKey
+    header_order: List[str]
+    header_paths: Dict[str, PathKey]
+
+    def new_header(self) -> Tuple[List[str], Dict[str, PathKey]]:
+        """
+        Return a fresh (header_order, header_paths) pair seeded with the schema's columns.
+        """
+        return list(self.header_order), dict(self.header_paths)
+
+    def save(self, path: Path) -> None:
+        data = {
+            "version": SCHEMA_VERSION,
+            "row_path": list(self.row_path),
+            "columns": [{"name": col, "path": list(self.header_paths[col])} for col in self.header_order],
+        }
+        with path.open("w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+            f.write("\n")
+
+    @classmethod
+    def load(cls, path: Path) -> "TableSchema":
+        with path.open("r", encoding="utf-8") as f:
+            data = json.load(f)
+        if not isinstance(data, dict) or data.get("version") != SCHEMA_VERSION:
+            raise ValueError(f"unsupported schema version (expected {SCHEMA_VERSION})")
+        try:
+            row_path = tuple(str(tag) for tag in data["row_path"])
+            columns = [(str(c["name"]), tuple(str(tag) for tag in c["path"])) for c in data["columns"]]
+        except (KeyError, TypeError) as exc:
+            raise ValueError(f"malformed schema: {exc}") from None
+        if not row_path:
+            raise ValueError("malformed schema: empty row_path")
+        header_paths = dict(columns)
+        if len(header_paths) != len(columns):
+            raise ValueError("malformed schema: duplicate column names")
+        return cls(row_path, [name for name, _path in columns], header_paths)
+
+
+def select_projection(selected_columns: Sequence[str], schema: Optional[TableSchema] = None) -> ColumnProjection:
+    """
+    Return the projection that extracts only the selected columns. With a schema, they resolve to
+    its leaf paths up front (the output only has schema columns anyway); without one, leaves are
+    matched by tag.
+    """
+    paths: Optional[FrozenSet[PathKey]] = None
+    if schema is not None:
+        paths = frozenset(schema.header_paths[col] for col in selected_columns if col in schema.header_paths)
+    return ColumnProjection(frozenset(selected_columns), paths)
+
+
+@dataclass(frozen=True)
+class ConversionOptions:
+    """
+    Settings shared by every per-file conversion; picklable so it can be sent to worker processes.
+    """
+
+    output_dir: Optional[Path]
+    encoding: str
+    delimiter: str
+    selected_columns: Optional[List[str]] = None
+    list_columns: bool = False
+    spill: bool = False
+    spill_dir: Optional[Path] = None
+    # Split inputs larger than this into row-aligned chunks (parallel runs only)
+    split_bytes: Optional[int] = None
+    # Detect the row element from only this many leading bytes (single-pass conversion)
+    detect_bytes: Optional[int] = None
+    expansion: ExpansionPolicy = ExpansionPolicy()
+    # Known row path and header (--schema-in): single pass, rows written as they are extracted
+    schema: Optional[TableSchema] = None
+    # Known row path (--row-path): single pass, no row detection
+    row_path: Optional[PathKey] = None
+    compression: Optional[OutputCompression] = None
+    # Extract only the selected columns (see select_projection)
+    projection: Optional[ColumnProjection] = None
+    # Write only the rows that meet the --where conditions
+    row_filter: Optional[RowFilter] = None
+    # Collect a ConversionStats per input (--stats)
+    stats: bool = False
+    # Where worker processes leave their profiles (--profile), and whether they run cProfile as well
+    # as the stack sampler; see run_profiled
+    profile_dir: Optional[str] = None
+    profile_calls: bool = True
+
+    @property
+    def csv_suffix(self) -> str:
+        """
+        Suffix of the CSVs written: .csv, plus the compression suffix with --compress.
+        """
+        return ".csv" if self.compression is None else ".csv" + self.compression.suffix
+
+    @property
+    def known_row_path(self) -> Optional[PathKey]:
+        """
+        The row path given up front, by --row-path or the schema, if any.
+        """
+        return self.schema.row_path if self.schema is not None else self.row_path
+
+    def new_header(self) -> Tuple[List[str], Dict[str, PathKey]]:
+        """
+        Return the (header_order, header_paths) pair an input is extracted into.
+        """
+        if self.schema is not None:
+            return self.schema.new_header()
+        return [], {}
+
+    def new_stats(self, inp: Path) -> Optional[ConversionStats]:
+        """
+        Return the stats an input is timed into, started in its buffer stage (the time spent
+        between pulling rows), or None without --stats.
+        """
+        if not self.stats:
+            return None
+        stats = ConversionStats(str(inp))
+        stats.switch("buffer")
+        return stats
+
+
+@dataclass
+class FileResult:
+    """
+    Outcome of converting one input. Messages are collected rather than printed so that results
+    coming back from worker processes are reported by the parent in input order.
+    """
+
+    input_path: Path
+    output_path: Optional[Path] = None
+    header: List[str] = field(default_factory=list)
+    header_paths: Dict[str, PathKey] = field(default_factory=dict)
+    row_path: Optional[PathKey] = None
+    # Every file written for this input (the CSV, plus group tables in normalized mode)
+    outputs: List[Path] = field(default_factory=list)
+    messages: List[str] = field(default_factory=list)
+    failed: bool = False
+    skipped: bool = False
+    # Not converted because its outputs are still up to date (--incremental)
+    unchanged: bool = False
+    stats: Optional[ConversionStats] = None
+
+
+@dataclass
+class TablePart:
+    """
+    Rows extracted from one input against its own local header, so that inputs can be extracted in
+    separate processes and reconciled into one merged header afterwards (see merge_part_header).
+    """
+
+    input_path: Path
+    header_order: List[str] = field(default_factory=list)
+    header_paths: Dict[str, PathKey] = field(default_factory=dict)
+    # Positional rows (values in local header_order index order), or a spill file holding them
+    records: List[Row] = field(default_factory=list)
+    spill_path: Optional[Path] = None
+    row_count: int = 0
+    row_path: Optional[PathKey] = None
+    error: Optional[str] = None
+    # Stats the part's rows are counted in; rows the parent's --where filter drops are taken off
+    # again (see iter_part_records)
+    stats: Optional[ConversionStats] = None
+    # Warnings about the input, reported by the parent in input order
+    messages: List[str] = field(default_factory=list)
+
+    def iter_records(self) -> Iterator[Sequence[Optional[str]]]:
+        if self.spill_path is None:
+            yield from self.records
+            return
+        with self.spill_path.open("r", encoding="utf-8", newline="") as f:
+            yield from csv.reader(f)
+
+    def discard(self) -> None:
+        self.records = []
+        if self.spill_path is not None:
+            self.spill_path.unlink(missing_ok=True)
+            self.spill_path = None
+
+
+def fill_table_part(part: TablePart, rows: Iterable[Row], options: ConversionOptions) -> TablePart:
+    """
+    Consume rows extracted against part.header_order/header_paths into the part's records.
+    """
+    try:
+        if options.list_columns:
+            # Extracted with schema_only: only the header is filled in
+            for _row in rows:
+                pass
+        elif options.spill:
+            spool = RowSpool(part.header_order, options.spill_dir, keep_file=True)
+            try:
+                spool.extend(rows)
+            except Exception:
+                spool.close()
+                raise
+            part.spill_path = spool.detach()
+            part.row_count = spool.row_count
+        else:
+            part.records = list(rows)
+            part.row_count = len(part.records)
+    except Exception as exc:
+        part.error = str(exc)
+    if part.stats is not None:
+        part.stats.finish()
+    return part
+
+
+@profiled_per_input
+def extract_table_part(
+    inp: Path, options: ConversionOptions, source: Union[Path, IO[bytes], None] = None
+) -> TablePart:
+    """
+    Extract one input (read from source, if given) into a TablePart, in a worker process for
+    parallel merges. --where is left to the parent, which knows the merged header.
+    """
+    part = TablePart(inp, *options.new_header(), stats=options.new_stats(inp))
+
+    def found(row_path: PathKey) -> None:
+        part.row_path = row_path
+
+    def late(columns: List[str]) -> None:
+        part.messages.append(late_fields_warning(inp, columns))
+
+    rows = iter_table_rows(
+        source or inp,
+        part.header_order,
+        part.header_paths,
+        options.detect_bytes,
+        options.expansion,
+        schema_only=options.list_columns,
+        row_path=options.known_row_path,
+        on_row_path=found,
+        projection=options.projection,
+        stats=part.stats,
+        on_late_fields=late,
+    )
+    return fill_table_part(part, rows, options)
+
+
+@profiled_per_input
+def extract_chunk_part(chunk: RowChunk, options: ConversionOptions) -> TablePart:
+    """
+    Extract the rows of one row-aligned chunk into a TablePart. Runs in worker processes; like
+    extract_table_part, it leaves --where to the parent.
+    """
+    part = TablePart(
+        chunk.input_path, *options.new_header(), row_path=chunk.row_path, stats=options.new_stats(chunk.input_path)
+    )
+    if part.stats is not None:
+        part.stats.bytes_read += chunk.end - chunk.start
+        if chunk.scan_stats is not None:
+            part.stats.add(chunk.scan_stats)
+    rows = iter_rows_from_events(
+        iter_chunk_events(chunk),
+        chunk.row_path,
+        chunk.row_parent,
+        chunk.row_tag,
+        part.header_order,
+        part.header_paths,
+        options.expansion,
+        schema_only=options.list_columns,
+        projection=options.projection,
+        stats=part.stats,
+    )
+    return fill_table_part(part, rows, options)
+
+
+@profiled_per_input
+def plan_input_chunks(inp: Path, options: ConversionOptions) -> Optional[List[RowChunk]]:
+    """
+    Return row-aligned chunks for an input large enough to split (see --split-size), else None.
+    """
+    if options.split_bytes is None or not is_plain_input(inp):
+        # Compressed inputs and archive members cannot be read from an arbitrary offset
+        return None
+    if inp.stat().st_size <= options.split_bytes:
+        return None
+    if options.expansion.mode == "normalized":
+        # Record ids are numbered through the whole file
+        return None
+    if options.list_columns and options.known_row_path is None:
+        # The columns are listed from the scan that would plan the chunks (see ShapeTable)
+        return None
+    chunks = plan_row_chunks(inp, options.split_bytes, options.known_row_path, options.new_stats(inp))
+    if chunks is None or len(chunks) < 2:
+        return None
+    return chunks
+
+
+def submit_task(executor: ProcessPoolExecutor, options: ConversionOptions, fn: Callable, *args: object) -> Future:
+    """
+    Submit fn(*args) to a worker process, profiled there with --profile.
+    """
+    if options.profile_dir is None:
+        return executor.submit(fn, *args)
+    return executor.submit(run_profiled, options.profile_dir, options.profile_calls, fn, *args)
+
+
+def submit_input(
+    executor: ProcessPoolExecutor, options: ConversionOptions, fn: Callable, inp: Path, *args: object
+) -> Future:
+    """
+    Submit fn(inp, *args) like submit_task, except for standard input and streamed archive members
+    (see MemberSpools), which worker processes do not share: those are read here and returned as an
+    already finished future.
+    """
+    if inp != STDIO_PATH and not any(isinstance(arg, io.IOBase) for arg in args):
+        return submit_task(executor, options, fn, inp, *args)
+    future: Future = Future()
+    try:
+        future.set_result(fn(inp, *args))
+    except Exception as exc:
+        future.set_exception(exc)
+    return future
+
+
+def run_windowed(
+    inputs: Iterable[Path],
+    start: Callable[[Path], object],
+    finish: Callable[[Path, object], None],
+    jobs: int,
+) -> None:
+    """
+    Call start(inp) for each input and finish(inp, task) with what it returned, in input order.
+    Only jobs * PENDING_PER_WORKER inputs are started ahead of the one being finished, so results
+    are reported while inputs are still being discovered and the queue stays small.
+    """
+    pending: Deque[Tuple[Path, object]] = deque()
+    window = jobs * PENDING_PER_WORKER
+    for inp in inputs:
+        while len(pending) >= window:
+            finish(*pending.popleft())
+        pending.append((inp, start(inp)))
+    while pending:
+        finish(*pending.popleft())
+
+
+def submit_table_parts(
+    inp: Path, options: ConversionOptions, executor: ProcessPoolExecutor, source: Union[Path, IO[bytes], None] = None
+) -> List[Future]:
+    """
+    Submit the extraction of one input (read from source, if given) as a single whole-file task, or
+    one task per chunk when the input is split. The futures resolve to TableParts in row order.
+    """
+    chunks = plan_input_chunks(inp, options)
+    if chunks is None:
+        return [submit_input(executor, options, extract_table_part, inp, options, source)]
+    return [submit_task(executor, options, extract_chunk_part, chunk, options) for chunk in chunks]
+
+
+def gather_table_parts(inp: Path, futures: Sequence[Future], max_rows: Optional[int] = None) -> List[TablePart]:
+    """
+    Wait for the parts of one input. If any part failed, or together they exceed max_rows, the parts
+    are discarded and a single part carrying the error is returned.
+    """
+    parts: List[TablePart] = []
+    error: Optional[str] = None
+    for future in futures:
+        try:
+            part = future.result()
+        except Exception as exc:
+            # The worker itself died (e.g. killed or out of memory)
+            part = TablePart(inp, error=str(exc))
+        if part.error is not None and error is None:
+            error = part.error
+        parts.append(part)
+    if error is None and max_rows is not None and sum(part.row_count for part in parts) > max_rows:
+        error = file_expansion_error(max_rows)
+    if error is not None:
+        for part in parts:
+            part.discard()
+        return [TablePart(inp, error=error)]
+    return parts
+
+
+def merge_part_header(
+    part: TablePart,
+    header_order: List[str],
+    header_paths: Dict[str, PathKey],
+) -> Dict[str, int]:
+    """
+    Register a part's columns in the merged header and return merged column name -> position in
+    the part's records.
+    """
+    return merge_header(part.header_order, part.header_paths, header_order, header_paths)
+
+
+def merge_header(
+    local_order: Sequence[str],
+    local_paths: Mapping[str, PathKey],
+    header_order: List[str],
+    header_paths: Dict[str, PathKey],
+) -> Dict[str, int]:
+    """
+    Register the columns of a header resolved on its own in another header, in order; returns
+    merged column name -> position in the local header (see merge_part_header).
+    """
+    positions: Dict[str, int] = {}
+    for idx, local_col in enumerate(local_order):
+        positions[register_column(local_paths[local_col], header_order, header_paths)] = idx
+    return positions
+
+
+def iter_part_records(
+    parts: Sequence[Tuple[TablePart, Dict[str, int]]],
+    columns: Sequence[str],
+    row_filter: Optional[RowFilter] = None,
+) -> Iterator[List[str]]:
+    """
+    Yield the records of each part, in order, remapped onto the given merged columns, leaving out
+    those row_filter rejects (its columns are named in the merged header).
+    """
+    for part, part_positions in parts:
+        positions = [part_positions.get(col, -1) for col in columns]
+        test = row_filter.record_test(part_positions) if row_filter is not None else None
+        rejected = 0
+        for record in part.iter_records():
+            if test is not None and not test(record):
+                rejected += 1
+                continue
+            size = len(record)
+            yield [record[idx] if 0 <= idx < size else "" for idx in positions]
+        if part.stats is not None:
+            part.stats.rows -= rejected
+
+
+def late_fields_warning(inp: Path, columns: Sequence[str]) -> str:
+    """
+    Describe the container fields a single-pass extraction read too late for the rows: those that
+    follow the first row.
+    """
+    return (
+        f"Warning: {inp.name} has fields after its first row, which a single pass reads too late "
+        f"for its rows: {', '.join(columns)}"
+    )
+
+
+def write_file_result(
+    result: FileResult,
+    header_order: List[str],
+    make_records: Callable[[List[str]], Iterable[Sequence[str]]],
+    options: ConversionOptions,
+) -> None:
+    """
+    Finish a per-file conversion once its header is known: list the columns, or write the CSV
+    with make_records(columns) supplying the rows.
+    """
+    inp = result.input_path
+    result.header = header_order
+    if options.list_columns:
+        result.messages.append(f"{inp.name}: {','.join(header_order)}")
+        return
+
+    # With a schema, the output has exactly the schema's columns, even if the input has more
+    known = header_order if options.schema is None else header_order[: len(options.schema.header_order)]
+    columns_to_write, missing = choose_columns_to_write(options.selected_columns, known)
+    if missing and not columns_to_write:
+        raise ValueError(f"none of the selected columns are in {inp.name}: {', '.join(missing)}")
+    if missing:
+        result.messages.append(f"Warning: skipping unknown columns for {inp.name}: {', '.join(missing)}")
+    columns_to_write = list(columns_to_write)
+    stem = output_stem(inp, options.output_dir)
+    out_path = stem.with_name(stem.name + options.csv_suffix)
+    try:
+        write_csv(
+            out_path,
+            columns_to_write,
+            make_records(columns_to_write),
+            options.encoding,
+            options.delimiter,
+            options.compression,
+            result.stats,
+        )
+    except BaseException:
+        # make_records may still be extracting (see convert_file): drop the partial output
+        out_path.unlink(missing_ok=True)
+        raise
+    result.output_path = out_path
+    result.outputs.append(out_path)
+    result.messages.append(f"Wrote: {out_path}")
+    extra = header_order[len(known) :]
+    if extra:
+        result.messages.append(f"Warning: {inp.name} has columns that are not in the schema: {', '.join(extra)}")
+
+
+def write_group_tables(result: FileResult, group_tables: GroupTables, options: ConversionOptions) -> None:
+    """
+    List or write the group tables of a normalized conversion, one <stem>.<group>.csv per group.
+    Column selection only applies to the row table.
+    """
+    inp = result.input_path
+    for table in group_tables.tables.values():
+        if options.list_columns:
+            result.messages.append(f"{inp.name} [{table.name}]: {','.join(table.header_order)}")
+            continue
+        stem = output_stem(inp, options.output_dir)
+        out_path = stem.with_name(f"{stem.name}.{table.name}{options.csv_suffix}")
+        columns = table.header_order
+        write_csv(
+            out_path,
+            columns,
+            table.iter_records(columns),
+            options.encoding,
+            options.delimiter,
+            options.compression,
+            result.stats,
+        )
+        result.outputs.append(out_path)
+        result.messages.append(f"Wrote: {out_path}")
+
+
+@profiled_per_input
+def convert_file(inp: Path, options: ConversionOptions, source: Union[Path, IO[bytes], None] = None) -> FileResult:
+    """
+    Convert (or, with list_columns, only list the columns of) a single input to its own CSV. The
+    input is read from source if given (see MemberSpools).
+    """
+    result = FileResult(inp, stats=options.new_stats(inp))
+    spool: Optional[RowSpool] = None
+    spill = options.spill and not options.list_columns
+    group_tables: Optional[GroupTables] = None
+    if options.expansion.mode == "normalized":
+        group_tables = GroupTables(spill, options.spill_dir, keep_rows=not options.list_columns)
+    try:
+        # Build header (and rows) first to support listing/selection
+        header_order, header_paths = options.new_header()
+        result.header_paths = header_paths
+
+        def found(row_path: PathKey) -> None:
+            result.row_path = row_path
+
+        def late(columns: List[str]) -> None:
+            result.messages.append(late_fields_warning(inp, columns))
+
+        rows = iter_table_rows(
+            source or inp,
+            header_order,
+            header_paths,
+            options.detect_bytes,
+            options.expansion,
+            group_tables,
+            options.list_columns,
+            options.known_row_path,
+            found,
+            options.projection,
+            options.row_filter,
+            result.stats,
+            late,
+        )
+        if options.schema is not None and not options.list_columns:
+            # The header is known up front: rows go straight to the CSV as they are extracted
+            write_file_result(result, header_order, lambda columns: iter_row_records(rows, header_order, columns), options)
+        elif spill:
+            spool = RowSpool(header_order, options.spill_dir)
+            spool.extend(rows)
+            write_file_result(result, header_order, spool.iter_records, options)
+        else:
+            row_list = list(rows)
+            write_file_result(
+                result, header_order, lambda columns: iter_row_records(row_list, header_order, columns), options
+            )
+        if group_tables is not None:
+            write_group_tables(result, group_tables, options)
+    except Exception as exc:
+        result.failed = True
+        result.messages.append(f"Failed to convert {inp}: {exc}")
+    finally:
+        if spool is not None:
+            spool.close()
+        if group_tables is not None:
+            group_tables.close()
+        if result.stats is not None:
+            result.stats.finish()
+    return result
+
+
+@profiled_per_input
+def convert_table_parts(inp: Path, parts: List[TablePart], options: ConversionOptions) -> FileResult:
+    """
+    Write one input's CSV from the parts it was extracted into (see submit_table_parts).
+    """
+    result = FileResult(inp)
+    if options.stats:
+        # The parts' stats already stopped their clocks; writing is timed by write_csv alone
+        result.stats = ConversionStats(str(inp))
+        for part in parts:
+            if part.stats is not None:
+                result.stats.add(part.stats)
+            # Rows dropped by --where are taken off the input's count
+            part.stats = result.stats
+    try:
+        if parts[0].error is not None:
+            raise ValueError(parts[0].error)
+        header_order, header_paths = options.new_header()
+        result.header_paths = header_paths
+        result.row_path = parts[0].row_path
+        positioned = [(part, merge_part_header(part, header_order, header_paths)) for part in parts]
+        write_file_result(
+            result,
+            header_order,
+            lambda columns: iter_part_records(positioned, columns, options.row_filter),
+            options,
+        )
+    except Exception as exc:
+        result.failed = True
+        result.messages.append(f"Failed to convert {inp}: {exc}")
+    finally:
+        for part in parts:
+            part.discard()
+    return result
+
+
+# Format version of --incremental manifests; older or newer manifests are started afresh
+MANIFEST_VERSION = 1
+
+
+def file_digest(path: Path) -> str:
+    """
+    Return the SHA-256 of a file's contents.
+    """
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(SCAN_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def options_signature(options: ConversionOptions) -> str:
+    """
+    Fingerprint of the options that shape a per-file output; a manifest entry recorded under other
+    options is not trusted.
+    """
+    schema = options.schema
+    data = {
+        "output_dir": str(options.output_dir) if options.output_dir is not None else None,
+        "encoding": options.encoding,
+        "delimiter": options.delimiter,
+        "selected_columns": options.selected_columns,
+        "detect_bytes": options.detect_bytes,
+        "expand": options.expansion.mode,
+        "schema": None
+        if schema is None
+        else [list(schema.row_path), [[col, list(schema.header_paths[col])] for col in schema.header_order]],
+    }
+    if options.row_path is not None:
+        data["row_path"] = list(options.row_path)
+    # An output written without a limit may hold an input the limit rejects
+    if options.expansion.max_rows_per_element is not None:
+        data["max_expansion"] = options.expansion.max_rows_per_element
+    if options.expansion.max_rows_per_file is not None:
+        data["max_file_expansion"] = options.expansion.max_rows_per_file
+    if options.row_filter is not None:
+        data["where"] = [[cond.column, cond.op, cond.operand] for cond in options.row_filter.conditions]
+    if options.compression is not None:
+        # Only present when set, so manifests written before --compress existed stay valid
+        data["compression"] = [options.compression.method, options.compression.level]
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class Manifest:
+    """
+    Record of earlier per-file conversions for --incremental runs: each input's size, mtime and content hash,
+    the options signature and the outputs written, with their sizes.
+    """
+
+    def __init__(self, path: Path, signature: str, force: bool = False) -> None:
+        self.path = path
+        self.signature = signature
+        # Reconvert everything, but still record the results
+        self.force = force
+        self.entries: Dict[str, Dict] = {}
+        # Hashes computed while checking inputs, reused when recording them (and for the other
+        # members of the same archive)
+        self._digests: Dict[str, str] = {}
+
+    @classmethod
+    def load(cls, path: Path, signature: str, force: bool = False) -> "Manifest":
+        manifest = cls(path, signature, force)
+        try:
+            with path.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return manifest
+        except (OSError, ValueError) as exc:
+            print(f"Warning: ignoring unreadable manifest {path}: {exc}")
+            return manifest
+        if isinstance(data, dict) and data.get("version") == MANIFEST_VERSION:
+            manifest.entries = data.get("entries", {})
+        return manifest
+
+    def is_current(self, inp: Path) -> bool:
+        if self.force:
+            return False
+        key = str(inp)
+        entry = self.entries.get(key)
+        if entry is None or entry.get("signature") != self.signature:
+            return False
+        try:
+            for output in entry["outputs"]:
+                if Path(output["path"]).stat().st_size != output["size"]:
+                    return False
+            source = input_source(inp)
+            stat = source.stat()
+        except OSError:
+            return False
+        if stat.st_size != entry["size"]:
+            return False
+        if stat.st_mtime_ns != entry["mtime_ns"]:
+            # Touched or rewritten: compare the contents
+            digest = self._digest(source)
+            if digest != entry["sha256"]:
+                return False
+            entry["mtime_ns"] = stat.st_mtime_ns
+        return True
+
+    def _digest(self, source: Path) -> str:
+        key = str(source)
+        digest = self._digests.get(key)
+        if digest is None:
+            digest = self._digests[key] = file_digest(source)
+        return digest
+
+    def record(self, result: FileResult) -> None:
+        """
+        Update the entry of a finished per-file conversion.
+        """
+        key = str(result.input_path)
+        if result.unchanged:
+            return
+        if result.failed or result.skipped or not result.outputs:
+            self.entries.pop(key, None)
+            return
+        try:
+            source = input_source(result.input_path)
+            stat = source.stat()
+            digest = self._digest(source)
+            if source == result.input_path:
+                # Only archives are shared between inputs
+                self._digests.pop(str(source), None)
+            outputs = [{"path": str(path), "size": path.stat().st_size} for path in result.outputs]
+        except OSError:
+            self.entries.pop(key, None)
+            return
+        self.entries[key] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": digest,
+            "signature": self.signature,
+            "outputs": outputs,
+        }
+
+    def save(self) -> None:
+        """
+        Write the manifest atomically, so an interrupted save leaves the previous one intact.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with tmp_path.open("w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "entries": self.entries}, f, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+
+
+# Single compressed documents, decompressed on the fly by the matching stdlib module
+COMPRESSORS: Dict[str, Callable[..., IO[bytes]]] = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+
+# Archives whose XML members are converted as separate inputs
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+# File (and archive member) suffixes picked up when walking an input directory or archive
+XML_SUFFIXES = (".xml",) + tuple(".xml" + suffix for suffix in COMPRESSORS)
+
+# Inputs submitted to the process pool ahead of the one being reported, per worker
+PENDING_PER_WORKER = 4
+
+
+def is_glob_pattern(spec: str) -> bool:
+    """
+    True if an input argument contains glob metacharacters.
+    """
+    return any(ch in spec for ch in "*?[")
+
+
+def is_xml_input(name: str) -> bool:
+    """
+    True if a file found in an input directory or archive should be converted.
+    """
+    return name.lower().endswith(XML_SUFFIXES)
+
+
+def is_archive(name: str) -> bool:
+    """
+    True if a file name has an archive suffix (zip or tar, optionally compressed).
+    """
+    return name.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def split_archive_member(path: Path) -> Optional[Tuple[Path, str]]:
+    """
+    If path names a member inside an archive (e.g. feeds.zip/2024/orders.xml), return the archive
+    file and the member name; otherwise None.
+    """
+    for archive in path.parents:
+        if is_archive(archive.name) and archive.is_file():
+            return archive, path.relative_to(archive).as_posix()
+    return None
+
+
+def input_source(inp: Path) -> Path:
+    """
+    The file on disk that holds an input: the archive for an archive member, else the input itself.
+    """
+    member = split_archive_member(inp)
+    return member[0] if member is not None else inp
+
+
+def input_exists(inp: Path) -> bool:
+    """
+    True if an input file, or the archive holding an archive member, exists.
+    """
+    return inp == STDIO_PATH or inp.exists() or split_archive_member(inp) is not None
+
+
+def is_plain_input(inp: Path) -> bool:
+    """
+    True if an input is an uncompressed file on disk, whose bytes can be read at any offset.
+    """
+    if inp == STDIO_PATH:
+        return False
+    return inp.suffix.lower() not in COMPRESSORS and split_archive_member(inp) is None
+
+
+def strip_suffix(name: str, suffixes: Iterable[str]) -> str:
+    """
+    Remove the first of suffixes (matched case-insensitively) that name ends with.
+    """
+    for suffix in suffixes:
+        if name.lower().endswith(suffix):
+            return name[: -len(suffix)]
+    return name
+
+
+def output_stem(inp: Path, output_dir: Optional[Path]) -> Path:
+    """
+    Return the directory and base name (without extension) of an input's CSV outputs, creating the directory
+    an archive member's output mirrors (feeds.zip/2024/orders.xml gives feeds/2024/orders.csv).
+    """
+    if inp == STDIO_PATH:
+        return (output_dir if output_dir is not None else Path.cwd()) / "stdin"
+    member = split_archive_member(inp)
+    if member is None:
+        out_dir = output_dir if output_dir is not None else inp.parent
+    else:
+        archive, name = member
+        base = output_dir if output_dir is not None else archive.parent
+        out_dir = base / strip_suffix(archive.name, ARCHIVE_SUFFIXES) / PurePosixPath(name).parent
+        out_dir.mkdir(parents=True, exist_ok=True)
+    return out_dir / Path(strip_suffix(inp.name, COMPRESSORS)).stem
+
+
+def open_zip_archive(archive: Path) -> zipfile.ZipFile:
+    """
+    Return a zip archive opened once per process and kept open, so that reading each member (on each
+    pass) does not read the central directory again. A rewritten archive is opened afresh.
+    """
+    st = archive.stat()
+    return _open_zip_archive(archive, st.st_mtime_ns, st.st_size)
+
+
+@lru_cache(maxsize=8)
+def _open_zip_archive(archive: Path, mtime_ns: int, size: int) -> zipfile.ZipFile:
+    return zipfile.ZipFile(archive)
+
+
+if hasattr(os, "register_at_fork"):
+    # A forked worker must not share the parent's open archives, whose file offset it would move
+    os.register_at_fork(after_in_child=_open_zip_archive.cache_clear)
+
+
+@contextmanager
+def open_input(inp: Path) -> Iterator[IO[bytes]]:
+    """
+    Open an input for streaming binary reads: .gz, .bz2 and .xz files are decompressed as they are
+    read, and a member named inside an archive is looked up there without extracting it to disk.
+    Tar members found by walking an archive are read as it reaches them instead (see MemberSpools).
+    """
+    with ExitStack() as stack:
+        member = split_archive_member(inp)
+        if member is None:
+            f: IO[bytes] = stack.enter_context(inp.open("rb"))
+        else:
+            archive, name = member
+            if archive.name.lower().endswith(".zip"):
+                f = stack.enter_context(open_zip_archive(archive).open(name))
+            else:
+                tf = stack.enter_context(tarfile.open(archive, "r:*"))
+                # Read up to the member rather than indexing the whole (possibly compressed) archive
+                for info in tf:
+                    if info.isfile() and PurePosixPath(info.name) == PurePosixPath(name):
+                        break
+                else:
+                    raise ValueError(f"{archive} has no file named {name}")
+                f = stack.enter_context(tf.extractfile(info))
+        opener = COMPRESSORS.get(inp.suffix.lower())
+        if opener is not None:
+            f = stack.enter_context(opener(f, "rb"))
+        yield f
+
+
+class MemberSpools:
+    """
+    Where the tar members found by walking an archive are read from. A tar is read once as a stream, so a
+    member is either converted in one pass as the stream reaches it (single_pass) or copied to a temporary
+    file that both passes read, released once its input has been reported. Zip members need neither.
+    """
+
+    def __init__(self, spill_dir: Optional[Path] = None, single_pass: bool = False) -> None:
+        self.spill_dir = spill_dir
+        self.single_pass = single_pass
+        self.directory: Optional[Path] = None
+        # Member input path -> its copies, oldest first (an archive can be given more than once)
+        self.copies: Dict[Path, Deque[Path]] = {}
+        # Member input path -> its decompressed stream, while the archive is at that member
+        self.streams: Dict[Path, IO[bytes]] = {}
+
+    def add(self, inp: Path, member: IO[bytes]) -> None:
+        if self.directory is None:
+            self.directory = Path(tempfile.mkdtemp(prefix="xml2csv-members-", dir=self.spill_dir))
+        # Same suffix as the member, so that open_input decompresses a compressed one
+        fd, name = tempfile.mkstemp(suffix=inp.suffix, dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                shutil.copyfileobj(member, f, SCAN_BLOCK_SIZE)
+        except BaseException:
+            os.unlink(name)
+            raise
+        self.copies.setdefault(inp, deque()).append(Path(name))
+
+    @contextmanager
+    def streaming(self, inp: Path, member: IO[bytes]) -> Iterator[None]:
+        """
+        Let inp be read from member, the archive stream positioned at it, until the archive moves on.
+        """
+        with ExitStack() as stack:
+            opener = COMPRESSORS.get(inp.suffix.lower())
+            self.streams[inp] = stack.enter_context(opener(member, "rb")) if opener is not None else member
+            try:
+                yield
+            finally:
+                del self.streams[inp]
+
+    def source(self, inp: Path) -> Union[Path, IO[bytes]]:
+        """
+        What to read an input from: the stream or latest copy of a tar member, else the input itself.
+        A stream can be read once, and only in this process (see submit_input).
+        """
+        stream = self.streams.get(inp)
+        if stream is not None:
+            return stream
+        copies = self.copies.get(inp)
+        return copies[-1] if copies else inp
+
+    def release(self, inp: Path) -> None:
+        """
+        Delete the oldest copy of an input, once it has been converted.
+        """
+        copies = self.copies.get(inp)
+        if not copies:
+            return
+        copies.popleft().unlink(missing_ok=True)
+        if not copies:
+            del self.copies[inp]
+
+    def close(self) -> None:
+        self.copies.clear()
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+
+def iter_archive_members(archive: Path, spools: MemberSpools) -> Iterator[Path]:
+    """
+    Yield the XML members of a zip or tar archive as archive / member paths, in archive order. Zip members
+    are read from the archive itself; a tar member is streamed from, or copied into, spools.
+    """
+    try:
+        if archive.name.lower().endswith(".zip"):
+            for info in open_zip_archive(archive).infolist():
+                inp = archive_member_path(archive, info.filename)
+                if inp is not None and not info.is_dir():
+                    yield inp
+        else:
+            with tarfile.open(archive, "r|*") as tf:
+                for tar_info in tf:
+                    inp = archive_member_path(archive, tar_info.name)
+                    if inp is None or not tar_info.isfile():
+                        continue
+                    tar_member = tf.extractfile(tar_info)
+                    assert tar_member is not None
+                    with tar_member:
+                        if spools.single_pass:
+                            with spools.streaming(inp, tar_member):
+                                yield inp
+                            continue
+                        spools.add(inp, tar_member)
+                    yield inp
+    except (OSError, EOFError, zipfile.BadZipFile, tarfile.TarError) as exc:
+        print(f"Skipping unreadable archive {archive}: {exc}")
+
+
+def archive_member_path(archive: Path, name: str) -> Optional[Path]:
+    """
+    Return the input path of an archive member (archive / name), or None if the member is not XML
+    or its name would step outside the archive.
+    """
+    parts = PurePosixPath(name).parts
+    if not is_xml_input(name) or name.startswith("/") or ".." in parts:
+        return None
+    return archive.joinpath(*parts)
+
+
+def iter_path_inputs(path: Path, spools: MemberSpools) -> Iterator[Path]:
+    """
+    Yield the inputs behind one path: the XML files under a directory, the XML members of an
+    archive (see MemberSpools), or the path itself.
+    """
+    if path.is_dir():
+        yield from iter_directory_inputs(path, spools)
+    elif is_archive(path.name) and path.is_file():
+        yield from iter_archive_members(path, spools)
+    else:
+        yield path
+
+
+def iter_directory_inputs(directory: Path, spools: MemberSpools) -> Iterator[Path]:
+    """
+    Walk a directory recursively with os.scandir, yielding XML files (and the XML members of any archives)
+    as they are found. Each directory is listed in full and sorted, its files before its subdirectories.
+    """
+    stack = [directory]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError as exc:
+            print(f"Skipping unreadable directory {current}: {exc}")
+            continue
+        subdirs: List[Path] = []
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(Path(entry.path))
+                elif not entry.is_file():
+                    continue
+                elif is_xml_input(entry.name):
+                    yield Path(entry.path)
+                elif is_archive(entry.name):
+                    yield from iter_archive_members(Path(entry.path), spools)
+            except OSError:
+                continue
+        stack.extend(reversed(subdirs))
+
+
+def iter_listed_inputs(list_path: str) -> Iterator[str]:
+    """
+    Yield the input arguments listed one per line in a file (or on stdin for "-"); blank lines are skipped.
+    """
+    f = sys.stdin if list_path == "-" else open(Path(list_path).expanduser(), "r", encoding="utf-8")
+    try:
+        for line in f:
+            if line.strip():
+                yield line.rstrip("\r\n")
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def iter_input_paths(specs: Iterable[str], spools: MemberSpools) -> Iterator[Path]:
+    """
+    Expand input arguments lazily into the files to convert: directories are walked, glob patterns (with **
+    for any depth) expanded, and any other argument is passed through as a file.
+    """
+    for spec in specs:
+        if spec == "-":
+            yield STDIO_PATH
+            continue
+        path = Path(spec).expanduser()
+        if is_glob_pattern(spec) and not path.exists():
+            matched = False
+            for match in glob.iglob(str(path), recursive=True):
+                matched = True
+                yield from iter_path_inputs(Path(match).resolve(), spools)
+            if not matched:
+                print(f"No inputs match pattern: {spec}")
+        else:
+            yield from iter_path_inputs(path.resolve(), spools)
+
+
+@dataclass
+class BatchSummary:
+    """
+    Totals of a per-file run, added up as results are reported so that no FileResult is kept.
+    """
+
+    # Per-file headers merged as --merge-into would, and the distinct row paths (for --schema-out)
+    header_order: List[str]
+    header_paths: Dict[str, PathKey]
+    row_paths: List[PathKey] = field(default_factory=list)
+    stats: List[ConversionStats] = field(default_factory=list)
+    converted: int = 0
+    failed: int = 0
+    skipped: int = 0
+    unchanged: int = 0
+
+    def add(self, result: FileResult) -> None:
+        if result.stats is not None:
+            self.stats.append(result.stats)
+        if result.failed:
+            self.failed += 1
+        elif result.skipped:
+            self.skipped += 1
+        elif result.unchanged:
+            self.unchanged += 1
+        else:
+            self.converted += 1
+        if result.failed or result.skipped or result.row_path is None:
+            return
+        merge_header(result.header, result.header_paths, self.header_order, self.header_paths)
+        if result.row_path not in self.row_paths:
+            self.row_paths.append(result.row_path)
+
+
+def convert_files(
+    inputs: Iterable[Path],
+    options: ConversionOptions,
+    jobs: int = 1,
+    manifest: Optional[Manifest] = None,
+    spools: Optional[MemberSpools] = None,
+) -> BatchSummary:
+    """
+    Convert each input to its own CSV (in a process pool with jobs > 1), printing per-file messages
+    in input order. Inputs the manifest finds up to date are skipped, and an input whose output name
+    is already taken by an earlier one fails instead of overwriting it.
+    """
+    summary = BatchSummary(*options.new_header())
+    copies = spools if spools is not None else MemberSpools()
+    # Output stem -> the input writing it
+    claimed: Dict[Path, Path] = {}
+
+    def report(result: FileResult) -> None:
+        for message in result.messages:
+            print(message)
+        summary.add(result)
+        if manifest is not None:
+            manifest.record(result)
+        copies.release(result.input_path)
+
+    def up_to_date(inp: Path) -> Optional[FileResult]:
+        if manifest is None or not manifest.is_current(inp):
+            return None
+        return FileResult(inp, messages=[f"Up to date: {inp}"], unchanged=True)
+
+    def skipped(inp: Path) -> FileResult:
+        return FileResult(inp, messages=[f"Skipping non-existent file: {inp}"], skipped=True)
+
+    def failed(inp: Path, exc: BaseException) -> FileResult:
+        return FileResult(inp, messages=[f"Failed to convert {inp}: {exc}"], failed=True)
+
+    def collision(inp: Path) -> Optional[FileResult]:
+        try:
+            stem = output_stem(inp, options.output_dir)
+        except OSError as exc:
+            return failed(inp, exc)
+        owner = claimed.setdefault(stem, inp)
+        if owner == inp:
+            return None
+        output = stem.with_name(stem.name + options.csv_suffix)
+        return failed(inp, ValueError(f"{output} is already the output of {owner}"))
+
+    if jobs <= 1:
+        for inp in inputs:
+            if not input_exists(inp):
+                report(skipped(inp))
+            else:
+                report(collision(inp) or up_to_date(inp) or convert_file(inp, options, copies.source(inp)))
+        return summary
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        # Per input: None (missing), a finished result, a whole-file task, or the tasks of its chunks
+        def start(inp: Path) -> Union[None, FileResult, Future, List[Future]]:
+            if not input_exists(inp):
+                return None
+            current = collision(inp) or up_to_date(inp)
+            if current is not None:
+                return current
+            try:
+                chunks = plan_input_chunks(inp, options)
+            except Exception as exc:
+                return failed(inp, exc)
+            if chunks is None:
+                return submit_input(executor, options, convert_file, inp, options, copies.source(inp))
+            return [submit_task(executor, options, extract_chunk_part, chunk, options) for chunk in chunks]
+
+        def finish(inp: Path, task: Union[None, FileResult, Future, List[Future]]) -> None:
+            if task is None:
+                report(skipped(inp))
+            elif isinstance(task, FileResult):
+                report(task)
+            elif isinstance(task, list):
+                parts = gather_table_parts(inp, task, options.expansion.max_rows_per_file)
+                report(convert_table_parts(inp, parts, options))
+            else:
+                try:
+                    report(task.result())
+                except Exception as exc:
+                    # The worker itself died (e.g. killed or out of memory)
+                    report(failed(inp, exc))
+
+        run_windowed(inputs, start, finish, jobs)
+    return summary
+
+
+def resolve_merge_path(merge_into: str, compression: Optional[OutputCompression] = None) -> Path:
+    """
+    Return the merged CSV path for --merge-into, creating its directory. With compression, the
+    compression suffix is appended unless the path already ends with it. "-" (--stdout) is kept.
+    """
+    if merge_into == "-":
+        return STDIO_PATH
+    merge_path = Path(merge_into).expanduser().resolve()
+    if merge_path.is_dir():
+        # If a directory is provided, use a default filename inside it
+        merge_path = merge_path / "merged.csv"
+    if compression is not None and merge_path.suffix.lower() != compression.suffix:
+        merge_path = merge_path.with_name(merge_path.name + compression.suffix)
+    merge_path.parent.mkdir(parents=True, exist_ok=True)
+    return merge_path
+
+
+def stream_merged(
+    inputs: Iterable[Path],
+    merge_into: str,
+    options: ConversionOptions,
+    header_order: List[str],
+    header_paths: Dict[str, PathKey],
+    row_paths: List[PathKey],
+    stats: Optional[List[ConversionStats]] = None,
+    spools: Optional[MemberSpools] = None,
+) -> None:
+    """
+    Serial merge against a known schema: the header is written first and every input is appended as its own
+    segment (see open_csv_segment), truncated away again if the input fails. Archive member copies in spools
+    are released once their input has been written.
+    """
+    assert options.schema is not None
+    copies = spools if spools is not None else MemberSpools()
+    known = header_order[: len(options.schema.header_order)]
+    columns_to_write, missing = choose_columns_to_write(options.selected_columns, known)
+    if missing:
+        print(f"Warning: skipping unknown columns in merged output: {', '.join(missing)}")
+    columns_to_write = list(columns_to_write)
+    merge_path = resolve_merge_path(merge_into, options.compression)
+    output_stats = ConversionStats(merged_output_name(merge_path)) if options.stats else None
+    # Only the first segment starts with a byte order mark
+    continued = bomless_encoding(options.encoding)
+    converted = 0
+    label_profile(merged_output_name(merge_path))
+    with open_raw_output(merge_path, output_stats) as raw:
+        # A pipe cannot be truncated: rows already written for a failing input stay there
+        seekable = raw.seekable()
+        with open_csv_segment(raw, options.encoding, options.compression) as f:
+            csv.writer(f, delimiter=options.delimiter).writerow(columns_to_write)
+        for inp in inputs:
+            if not input_exists(inp):
+                print(f"Skipping non-existent file: {inp}")
+                continue
+            mark = raw.tell() if seekable else None
+            input_stats = options.new_stats(inp)
+            label_profile(inp)
+            if input_stats is not None:
+                input_stats.switch("write")
+            # Columns and row path of an input that fails are left out, as in merge_files
+            input_order, input_paths = list(header_order), dict(header_paths)
+            input_row_paths: List[PathKey] = []
+            try:
+                rows = iter_table_rows(
+                    copies.source(inp),
+                    input_order,
+                    input_paths,
+                    options.detect_bytes,
+                    options.expansion,
+                    row_path=options.schema.row_path,
+                    on_row_path=input_row_paths.append,
+                    projection=options.projection,
+                    row_filter=options.row_filter,
+                    stats=input_stats,
+                    on_late_fields=lambda columns: print(late_fields_warning(inp, columns)),
+                )
+                with open_csv_segment(raw, continued, options.compression) as f:
+                    records = iter_row_records(rows, input_order, columns_to_write)
+                    csv.writer(f, delimiter=options.delimiter).writerows(records)
+                header_order.extend(input_order[len(header_order) :])
+                header_paths.update(input_paths)
+                row_paths.extend(input_row_paths)
+                converted += 1
+                if input_stats is not None:
+                    input_stats.finish()
+                    if stats is not None:
+                        stats.append(input_stats)
+            except Exception as exc:
+                if mark is not None:
+                    raw.seek(mark)
+                    raw.truncate()
+                else:
+                    print(f"Warning: rows already written for {inp} cannot be withdrawn from the output stream")
+                print(f"Failed to parse {inp}: {exc}")
+            finally:
+                copies.release(inp)
+    if converted:
+        print(f"Wrote merged CSV: {merged_output_name(merge_path)}")
+    if output_stats is not None and stats is not None:
+        output_stats.finish()
+        stats.append(output_stats)
+    extra = header_order[len(known) :]
+    if extra:
+        print(f"Warning: inputs have columns that are not in the schema: {', '.join(extra)}")
+
+
+def merged_output_name(merge_path: Path) -> str:
+    return str(merge_path) if merge_path != STDIO_PATH else "standard output"
+
+
+def merge_files(
+    inputs: Iterable[Path],
+    merge_into: str,
+    options: ConversionOptions,
+    jobs: int = 1,
+    stats: Optional[List[ConversionStats]] = None,
+    spools: Optional[MemberSpools] = None,
+) -> Tuple[List[str], Dict[str, PathKey], List[PathKey]]:
+    """
+    Combine the rows of all inputs into a single CSV (or, with list_columns, print the merged header),
+    extracting them in a process pool with jobs > 1. Returns the merged header (order and paths) and
+    the row path of every input read; the stats of every input and of the output go to stats.
+    """
+    merged_header_order, merged_header_paths = options.new_header()
+    row_paths: List[PathKey] = []
+    if stats is None:
+        stats = []
+    copies = spools if spools is not None else MemberSpools()
+    if options.schema is not None and not options.list_columns and jobs <= 1:
+        stream_merged(inputs, merge_into, options, merged_header_order, merged_header_paths, row_paths, stats, copies)
+        return merged_header_order, merged_header_paths, row_paths
+
+    merged_rows: List[Row] = []
+    parts: List[Tuple[TablePart, Dict[str, int]]] = []
+    # Inputs read without errors
+    extracted: List[Path] = []
+    spool = RowSpool(merged_header_order, options.spill_dir) if options.spill and not options.list_columns else None
+    row_path = options.known_row_path
+
+    try:
+        if jobs <= 1:
+            for inp in inputs:
+                if not input_exists(inp):
+                    print(f"Skipping non-existent file: {inp}")
+                    continue
+                input_stats = options.new_stats(inp)
+                label_profile(inp)
+                # Columns and row path of an input that fails are left out, as with --jobs
+                input_order, input_paths = list(merged_header_order), dict(merged_header_paths)
+                input_row_paths: List[PathKey] = []
+                try:
+                    rows = iter_table_rows(
+                        copies.source(inp),
+                        input_order,
+                        input_paths,
+                        options.detect_bytes,
+                        options.expansion,
+                        schema_only=options.list_columns,
+                        row_path=row_path,
+                        on_row_path=input_row_paths.append,
+                        projection=options.projection,
+                        row_filter=options.row_filter,
+                        stats=input_stats,
+                        on_late_fields=lambda columns: print(late_fields_warning(inp, columns)),
+                    )
+                    if options.list_columns:
+                        for _row in rows:
+                            pass
+                    elif spool is not None:
+                        mark = spool.mark()
+                        try:
+                            spool.extend(rows)
+                        except Exception:
+                            spool.rollback(mark)
+                            raise
+                    else:
+                        merged_rows.extend(list(rows))
+                    merged_header_order.extend(input_order[len(merged_header_order) :])
+                    merged_header_paths.update(input_paths)
+                    row_paths.extend(input_row_paths)
+                    extracted.append(inp)
+                    if input_stats is not None:
+                        input_stats.finish()
+                        stats.append(input_stats)
+                except Exception as exc:
+                    print(f"Failed to parse {inp}: {exc}")
+                finally:
+                    copies.release(inp)
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                # Per input: None (missing), an error, or the tasks of its parts
+                def start(inp: Path) -> Union[None, str, List[Future]]:
+                    if not input_exists(inp):
+                        return None
+                    try:
+                        return submit_table_parts(inp, options, executor, copies.source(inp))
+                    except Exception as exc:
+                        return str(exc)
+
+                # Parts are reconciled in input order while later inputs are still being extracted
+                def finish(inp: Path, task: Union[None, str, List[Future]]) -> None:
+                    if task is None:
+                        print(f"Skipping non-existent file: {inp}")
+                        return
+                    if isinstance(task, str):
+                        file_parts = [TablePart(inp, error=task)]
+                    else:
+                        file_parts = gather_table_parts(inp, task, options.expansion.max_rows_per_file)
+                    copies.release(inp)
+                    if file_parts[0].error is not None:
+                        print(f"Failed to parse {inp}: {file_parts[0].error}")
+                        return
+                    for part in file_parts:
+                        for message in part.messages:
+                            print(message)
+                    if file_parts[0].row_path is not None:
+                        row_paths.append(file_parts[0].row_path)
+                    extracted.append(inp)
+                    label_profile(inp)
+                    if options.stats:
+                        input_stats = ConversionStats(str(inp))
+                        for part in file_parts:
+                            if part.stats is not None:
+                                input_stats.add(part.stats)
+                            # Rows dropped by --where are taken off the input's count
+                            part.stats = input_stats
+                        stats.append(input_stats)
+                    for part in file_parts:
+                        parts.append((part, merge_part_header(part, merged_header_order, merged_header_paths)))
+
+                run_windowed(inputs, start, finish, jobs)
+
+        # If only listing columns, print and exit
+        if options.list_columns:
+            print(",".join(merged_header_order))
+            return merged_header_order, merged_header_paths, row_paths
+
+        merge_path = resolve_merge_path(merge_into, options.compression)
+        known = merged_header_order
+        if options.schema is not None:
+            known = merged_header_order[: len(options.schema.header_order)]
+        columns_to_write, missing = choose_columns_to_write(options.selected_columns, known)
+        if missing:
+            print(f"Warning: skipping unknown columns in merged output: {', '.join(missing)}")
+        if parts:
+            records: Iterable[List[str]] = iter_part_records(parts, columns_to_write, options.row_filter)
+        elif spool is not None:
+            records = spool.iter_records(columns_to_write)
+        else:
+            records = iter_row_records(merged_rows, merged_header_order, columns_to_write)
+        output_stats = ConversionStats(merged_output_name(merge_path)) if options.stats else None
+        label_profile(merged_output_name(merge_path))
+        write_csv(
+            merge_path,
+            columns_to_write,
+            records,
+            options.encoding,
+            options.delimiter,
+            options.compression,
+            output_stats,
+        )
+        if output_stats is not None:
+            output_stats.finish()
+            stats.append(output_stats)
+        if extracted:
+            print(f"Wrote merged CSV: {merged_output_name(merge_path)}")
+        extra = merged_header_order[len(known) :]
+        if extra:
+            print(f"Warning: inputs have columns that are not in the schema: {', '.join(extra)}")
+        return merged_header_order, merged_header_paths, row_paths
+    finally:
+        if spool is not None:
+            spool.close()
+        for part, _positions in parts:
+            part.discard()
+
+
+def save_schema(
+    schema_out: str,
+    header_order: List[str],
+    header_paths: Dict[str, PathKey],
+    row_paths: Sequence[PathKey],
+) -> None:
+    """
+    Write a --schema-out file. The row path is the first input's; inputs whose rows were found
+    elsewhere are reported, as a run with the schema would read them at the first input's path.
+    """
+    if not row_paths:
+        print("Warning: no input was read; schema not written")
+        return
+    row_path = row_paths[0]
+    others = sorted({"/".join(path) for path in row_paths if path != row_path})
+    if others:
+        print(f"Warning: schema uses row element {'/'.join(row_path)}; some inputs had rows at: {', '.join(others)}")
+    schema_path = Path(schema_out).expanduser().resolve()
+    TableSchema(row_path, header_order, header_paths).save(schema_path)
+    print(f"Wrote schema: {schema_path}")
+
+
+# A document to read: a path (as accepted on the command line) or a binary file object
+Source = Union[str, "os.PathLike[str]", IO[bytes]]
+
+
+class Converter:
+    """
+    Conversion state for Python callers: the header and row element of every document it reads, so the
+    documents of one feed share column names and order, as with --merge-into.
+
+        converter = Converter()
+        for row in converter.iter_rows("orders.xml"):
+            record = dict(zip(converter.columns, row))
+    """
+
+    def __init__(
+        self,
+        schema: Optional[TableSchema] = None,
+        detect_bytes: Optional[int] = None,
+        expansion: ExpansionPolicy = ExpansionPolicy(),
+    ) -> None:
+        if expansion.mode == "normalized":
+            raise ValueError("a Converter produces a single table; use the command line for normalized output")
+        self.schema = schema
+        self.detect_bytes = detect_bytes
+        self.expansion = expansion
+        self.header_order, self.header_paths = schema.new_header() if schema is not None else ([], {})
+        # Row path of every document read, in order
+        self.row_paths: List[PathKey] = []
+
+    @property
+    def columns(self) -> Tuple[str, ...]:
+        """
+        The column names known so far, in header order.
+        """
+        return tuple(self.header_order)
+
+    def to_schema(self) -> TableSchema:
+        """
+        Return the current state as a TableSchema (with the first document's row element), e.g. to
+        save() it for --schema-in or start other Converters from it.
+        """
+        if self.schema is not None:
+            row_path = self.schema.row_path
+        elif self.row_paths:
+            row_path = self.row_paths[0]
+        else:
+            raise ValueError("no document has been read yet")
+        return TableSchema(row_path, list(self.header_order), dict(self.header_paths))
+
+    def iter_rows(self, source: Source, columns: Optional[Sequence[str]] = None) -> Iterator[Tuple[str, ...]]:
+        """
+        Yield the rows of one document lazily, each a tuple of strings. source is a path (as on the command
+        line) or a binary file object. With columns, each tuple holds exactly those columns; otherwise it has
+        one value per column known when it was yielded.
+        """
+        header_order = self.header_order
+        row_path = self.schema.row_path if self.schema is not None else None
+        if hasattr(source, "read"):
+            rows = iter_stream_rows(
+                source,  # type: ignore[arg-type]
+                header_order,
+                self.header_paths,
+                self.detect_bytes,
+                self.expansion,
+                row_path=row_path,
+                on_row_path=self.row_paths.append,
+            )
+        else:
+            rows = iter_table_rows(
+                Path(os.fspath(source)).expanduser(),  # type: ignore[arg-type]
+                header_order,
+                self.header_paths,
+                self.detect_bytes,
+                self.expansion,
+                row_path=row_path,
+                on_row_path=self.row_paths.append,
+            )
+        if columns is None:
+            for row in rows:
+                values = ["" if value is None else value for value in row]
+                if len(values) < len(header_order):
+                    values.extend([""] * (len(header_order) - len(values)))
+                yield tuple(values)
+            return
+        wanted = list(columns)
+        positions: List[int] = []
+        known = -1
+        for row in rows:
+            if known != len(header_order):
+                # Wanted columns may only appear in the header part-way through the document
+                known = len(header_order)
+                index = {col: idx for idx, col in enumerate(header_order)}
+                positions = [index.get(col, known) for col in wanted]
+            size = len(row)
+            yield tuple(["" if idx >= size or row[idx] is None else row[idx] for idx in positions])
+
+    def convert(
+        self,
+        source: Source,
+        dest: Union[str, "os.PathLike[str]"],
+        columns: Optional[Sequence[str]] = None,
+        encoding: str = "utf-8",
+        delimiter: str = ",",
+        compression: Optional[OutputCompression] = None,
+    ) -> List[str]:
+        """
+        Convert one document to a CSV file at dest ("-" for standard output) and return the columns written;
+        unknown columns raise ValueError. A failed conversion leaves no file.
+        """
+        rows: Iterable[Tuple[str, ...]] = self.iter_rows(source)
+        if self.schema is None:
+            rows = list(rows)
+            known = self.header_order
+        else:
+            known = self.header_order[: len(self.schema.header_order)]
+        chosen, missing = choose_columns_to_write(list(columns) if columns is not None else None, known)
+        if missing:
+            raise ValueError(f"unknown columns: {', '.join(missing)}")
+        chosen = list(chosen)
+        positions = [self.header_order.index(column) for column in chosen]
+        records = ([row[i] if i < len(row) else "" for i in positions] for row in rows)
+        out_path = Path(os.fspath(dest)).expanduser()
+        try:
+            write_csv(out_path, chosen, records, encoding, delimiter, compression)
+        except BaseException:
+            if out_path != STDIO_PATH:
+                out_path.unlink(missing_ok=True)
+            raise
+        return chosen
+
+
+def iter_rows(
+    source: Source,
+    columns: Optional[Sequence[str]] = None,
+    schema: Optional[TableSchema] = None,
+    detect_bytes: Optional[int] = None,
+    expansion: ExpansionPolicy = ExpansionPolicy(),
+) -> Iterator[Tuple[str, ...]]:
+    """
+    Yield the rows of one document as tuples; see Converter.iter_rows.
+    """
+    return Converter(schema, detect_bytes, expansion).iter_rows(source, columns)
+
+
+def convert(
+    source: Source,
+    dest: Union[str, "os.PathLike[str]"],
+    columns: Optional[Sequence[str]] = None,
+    schema: Optional[TableSchema] = None,
+    encoding: str = "utf-8",
+    delimiter: str = ",",
+    compression: Optional[OutputCompression] = None,
+    detect_bytes: Optional[int] = None,
+    expansion: ExpansionPolicy = ExpansionPolicy(),
+) -> List[str]:
+    """
+    Convert one document to a CSV file and return the columns written; see Converter.convert.
+    """
+    converter = Converter(schema, detect_bytes, expansion)
+    return converter.convert(source, dest, columns, encoding, delimiter, compression)
+
+
+def format_bytes(count: float) -> str:
+    if count < 1000:
+        return f"{count:.0f} B"
+    for unit in ("KB", "MB"):
+        count /= 1000
+        if count < 1000:
+            return f"{count:.1f} {unit}"
+    return f"{count / 1000:.1f} GB"
+
+
+def report_stats(
+    all_stats: Sequence[ConversionStats],
+    run_start: Tuple[float, float],
+    show: bool,
+    json_path: Optional[str],
+) -> None:
+    """
+    Print the --stats report to standard error and/or write it as JSON. run_start is the
+    (perf_counter, process_time) the run started at.
+    """
+    wall = time.perf_counter() - run_start[0]
+    times = os.times()
+    cpu = time.process_time() - run_start[1] + times.children_user + times.children_system
+    total = ConversionStats("total")
+    for stats in all_stats:
+        total.add(stats)
+    total.peak_rss = peak_rss_bytes()
+    if show:
+        print("Stats:", file=sys.stderr)
+        print(f"  {'stage':<12}{'wall s':>10}{'cpu s':>10}", file=sys.stderr)
+        for stage in STATS_STAGES:
+            print(f"  {stage:<12}{total.wall[stage]:>10.3f}{total.cpu[stage]:>10.3f}", file=sys.stderr)
+        for stats in all_stats:
+            seconds = stats.seconds
+            line = f"  {stats.name}: {format_bytes(stats.bytes_read)} read, {stats.rows} rows"
+            if stats.bytes_written:
+                line += f", {format_bytes(stats.bytes_written)} written"
+            line += f" in {seconds:.3f} s"
+            if seconds and stats.bytes_read:
+                line += f" ({stats.bytes_read / 1e6 / seconds:.2f} MB/s, {stats.rows / seconds:.0f} rows/s)"
+            print(line, file=sys.stderr)
+        summary = (
+            f"  Run: {wall:.3f} s wall, {cpu:.3f} s CPU; {total.rows} rows from {total.row_elements} row elements "
+            f"({total.expanded} after expansion); {format_bytes(total.bytes_read)} read, "
+            f"{format_bytes(total.bytes_written)} written"
+        )
+        if total.peak_rss is not None:
+            summary += f"; peak RSS {format_bytes(total.peak_rss)}"
+        print(summary, file=sys.stderr)
+    if json_path is not None:
+        report = {
+            "wall": wall,
+            "cpu": cpu,
+            "peak_rss": total.peak_rss,
+            "stages": {stage: {"wall": total.wall[stage], "cpu": total.cpu[stage]} for stage in STATS_STAGES},
+            "total": total.to_json(),
+            "files": [stats.to_json() for stats in all_stats],
+        }
+        path = Path(json_path).expanduser().resolve()
+        with path.open("w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"Wrote stats: {path}", file=sys.stderr)
+
+
+def write_profile(profiler: RunProfiler, path: Path, profile_dir: Optional[str]) -> None:
+    """
+    Write the --profile output: the parent's profile merged with those the workers left in
+    profile_dir, as pstats to path (unless only sampled) and as collapsed stacks to folded_path(path).
+    """
+    stats = pstats.Stats(profiler.profile) if profiler.profile is not None else None
+    stacks = profiler.folded()
+    if profile_dir is not None:
+        for worker_path in sorted(Path(profile_dir).glob("*.folded")):
+            with worker_path.open(encoding="utf-8") as f:
+                for line in f:
+                    stack, _, count = line.rstrip("\n").rpartition(" ")
+                    stacks[stack] += int(count)
+            if stats is not None:
+                stats.add(str(worker_path.with_name(worker_path.name[: -len(".folded")])))
+        shutil.rmtree(profile_dir, ignore_errors=True)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    write_folded(folded_path(path), stacks)
+    if stats is None:
+        print(f"Wrote profile: {folded_path(path)} (collapsed stacks)")
+        return
+    stats.dump_stats(str(path))
+    print(f"Wrote profile: {path} (collapsed stacks: {folded_path(path)})")
+
+
+# Exit status after the reader of standard output went away, as for a process killed by SIGPIPE
+EXIT_BROKEN_PIPE = 128 + 13
+
+
+def main() -> None:
+    run_start = (time.perf_counter(), time.process_time())
+    args = parse_args()
+    try:
+        run(args, run_start)
+    except BrokenPipeError:
+        # The consumer of our output (say, head after --stdout) stopped reading. Point standard
+        # output at the null device so that flushing it at exit does not fail again, and stop quietly
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.__stdout__.fileno())
+        sys.exit(EXIT_BROKEN_PIPE)
+
+
+def run(args: argparse.Namespace, run_start: Tuple[float, float]) -> None:
+    """
+    Carry out the conversion the command line asks for; run_start is when the run began (wall and
+    CPU time), for --stats.
+    """
+    if args.merge_into == "-":
+        # The CSV owns standard output (see open_raw_output); every message goes to stderr
+        sys.stdout = sys.stderr
+    specs: Iterable[str] = args.inputs
+    if args.inputs_from is not None:
+        specs = chain(specs, iter_listed_inputs(args.inputs_from))
+    output_dir: Optional[Path] = None
+    if args.output_dir is not None:
+        output_dir = Path(args.output_dir).expanduser().resolve()
+        output_dir.mkdir(parents=True, exist_ok=True)
+    spill_dir: Optional[Path] = None
+    if args.spill_dir is not None:
+        spill_dir = Path(args.spill_dir).expanduser().resolve()
+
+    selected_columns = normalize_selected_columns(args.select_columns)
+    schema: Optional[TableSchema] = None
+    if args.schema_in is not None:
+        try:
+            schema = TableSchema.load(Path(args.schema_in).expanduser().resolve())
+        except (OSError, ValueError) as exc:
+            raise SystemExit(f"Cannot read schema {args.schema_in}: {exc}")
+        if selected_columns and not any(col in schema.header_paths for col in selected_columns):
+            raise SystemExit(f"--select-columns: none of the selected columns are in the schema {args.schema_in}")
+
+    profiler: Optional[RunProfiler] = None
+    profile_dir: Optional[str] = None
+    if args.profile is not None:
+        profile_dir = tempfile.mkdtemp(prefix="xml2csv-profile-")
+        profiler = RunProfiler(calls=not args.profile_sampling)
+    # Tar members are copied for a second pass unless the row element is known or detected from a prefix
+    known_row_path = schema.row_path if schema is not None else args.row_path
+    single_pass = (known_row_path is not None or args.detect_bytes is not None) and args.expand != "normalized"
+    spools = MemberSpools(spill_dir, single_pass)
+    # Discovered lazily, so conversion starts while directories are still being walked
+    inputs = iter_input_paths(specs, spools)
+    try:
+        options = ConversionOptions(
+            output_dir=output_dir,
+            encoding=args.encoding,
+            delimiter=args.delimiter,
+            selected_columns=selected_columns,
+            list_columns=args.list_columns,
+            spill=args.spill,
+            spill_dir=spill_dir,
+            split_bytes=int(args.split_size * 1024 * 1024) if args.split_size is not None else None,
+            detect_bytes=args.detect_bytes,
+            expansion=ExpansionPolicy(args.expand, args.max_expansion, args.max_file_expansion),
+            schema=schema,
+            row_path=args.row_path,
+            compression=(
+                OutputCompression(args.compress, args.compress_level) if args.compress is not None else None
+            ),
+            # Listing and --schema-out need every column, and the selection does not apply to group tables.
+            # Columns --where reads are extracted too
+            projection=(
+                select_projection(selected_columns + (args.row_filter.columns if args.row_filter else []), schema)
+                if selected_columns and not args.list_columns and args.schema_out is None and args.expand != "normalized"
+                else None
+            ),
+            row_filter=args.row_filter,
+            stats=args.stats or args.stats_json is not None,
+            profile_dir=profile_dir,
+            profile_calls=not args.profile_sampling,
+        )
+        if profiler is not None:
+            profiler.start()
+        jobs = args.jobs or os.cpu_count() or 1
+
+        all_stats: List[ConversionStats] = []
+        if args.merge_into is not None:
+            # Merge all inputs into a single CSV
+            header_order, header_paths, row_paths = merge_files(
+                inputs, args.merge_into, options, jobs, all_stats, spools
+            )
+        else:
+            # One CSV per input
+            manifest: Optional[Manifest] = None
+            if args.incremental and not args.list_columns:
+                if args.manifest is not None:
+                    manifest_path = Path(args.manifest).expanduser().resolve()
+                else:
+                    manifest_path = (output_dir or Path.cwd()) / ".xml2csv-manifest.json"
+                manifest = Manifest.load(manifest_path, options_signature(options), args.force)
+            try:
+                summary = convert_files(inputs, options, jobs, manifest, spools)
+            finally:
+                if manifest is not None:
+                    manifest.save()
+            if not args.list_columns:
+                line = f"Summary: {summary.converted} converted, {summary.failed} failed, {summary.skipped} skipped"
+                if manifest is not None:
+                    line += f", {summary.unchanged} up to date"
+                print(line)
+            # The schema covers every input, so per-file headers are merged as --merge-into would
+            header_order, header_paths, row_paths = summary.header_order, summary.header_paths, summary.row_paths
+            all_stats.extend(summary.stats)
+
+        if args.schema_out is not None:
+            save_schema(args.schema_out, header_order, header_paths, row_paths)
+        if profiler is not None:
+            profiler.stop()
+            write_profile(profiler, Path(args.profile).expanduser(), profile_dir)
+        if options.stats:
+            report_stats(all_stats, run_start, args.stats, args.stats_json)
+    finally:
+        spools.close()
+        if profiler is not None and RunProfiler.active is profiler:
+            # The run failed: stop sampling before the profiles are removed
+            profiler.stop()
+        if profile_dir is not None:
+            shutil.rmtree(profile_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()